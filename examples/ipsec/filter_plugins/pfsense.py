@@ -0,0 +1 @@
+../../../filter_plugins/pfsense.py
\ No newline at end of file
@@ -0,0 +1,303 @@
+# -*- coding: utf-8 -*-
+
+# Copyright: (c) 2019, Frederic Bor <frederic.bor@wanadoo.fr>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+DOCUMENTATION = """
+    name: pfsense
+    author: Frederic Bor (@f-bor)
+    short_description: Format a fully connected ipsec tunnels definition for pfsense_ipsec_aggregate
+    description:
+    - C(format_ipsec_aggregate) returns the aggregated_ipsecs, aggregated_ipsec_proposals and aggregated_ipsec_p2s parameters
+      of the pfsense_ipsec_aggregate module for one pfsense, from a dictionary of tunnels, each one connecting all its pfsenses.
+    - C(format_ipsec_aggregate_ipsecs), C(format_ipsec_aggregate_proposals) and C(format_ipsec_aggregate_p2s) return only one of them.
+    - C(index_ipsec_tunnels) returns the names of the tunnels of each pfsense. The index should be computed once for the play
+      with a run_once set_fact, and given to the other filters to expand only the tunnels of the pfsense instead of scanning
+      all the tunnels for each host.
+    - Ansible runs the tasks of each host in its own worker and templates a new copy of a variable each time it is used,
+      so the parameters of a pfsense should be computed once for each host with set_fact.
+"""
+
+EXAMPLES = """
+- hosts: pfsense
+  tasks:
+    - name: "index ipsec tunnels"
+      set_fact:
+        ipsec_index: "{{ ipsec_tunnels | index_ipsec_tunnels }}"
+      run_once: true
+
+    - name: "format ipsec parameters"
+      set_fact:
+        params: "{{ ipsec_tunnels | format_ipsec_aggregate(inventory_hostname, ipsec_index) }}"
+
+    - name: "setup ipsec"
+      pfsense_ipsec_aggregate:
+        aggregated_ipsecs: "{{ params['aggregated_ipsecs'] }}"
+        aggregated_ipsec_proposals: "{{ params['aggregated_ipsec_proposals'] }}"
+        aggregated_ipsec_p2s: "{{ params['aggregated_ipsec_p2s'] }}"
+"""
+
+from ansible.errors import AnsibleFilterError
+
+
+def index_ipsec_tunnels(all_tunnels):
+    """ return the names of the tunnels of each pfsense """
+    if not isinstance(all_tunnels, dict):
+        raise AnsibleFilterError("index_ipsec_tunnels expects one dictionnary of ipsec tunnels")
+
+    index = dict()
+    for name, ipsec in all_tunnels.items():
+        for pfname in ipsec['pfsenses']:
+            index.setdefault(pfname, []).append(name)
+    return index
+
+
+class PFSenseIpsecMesh(object):
+    """ Class expanding fully connected ipsec tunnels into pfsense_ipsec_aggregate parameters
+
+        The tunnels of a pfsense are found once, from the index of the play if there is one, or with a single
+        scan of the tunnels. The options of each tunnel are prepared once, and the parameters are yielded lazily. """
+
+    def __init__(self, all_tunnels, index=None):
+        self.all_tunnels = all_tunnels
+        self.index = index
+
+        self._tunnels_names = dict()
+        self._ipsec_options = dict()
+        self._proposals = dict()
+        self._p2_options = dict()
+
+    def get(self, kind, pfname):
+        """ return the list of kind (ipsecs, proposals or p2s) parameters of pfname """
+        return list(getattr(self, 'iter_' + kind)(pfname))
+
+    def _get_tunnels_names(self, pfname):
+        """ return the names of the tunnels of pfname """
+        if pfname not in self._tunnels_names:
+            if self.index is None:
+                names = [name for name, ipsec in self.all_tunnels.items() if pfname in ipsec['pfsenses']]
+            else:
+                names = self.index.get(pfname, [])
+                for name in names:
+                    if name not in self.all_tunnels or pfname not in self.all_tunnels[name]['pfsenses']:
+                        raise AnsibleFilterError("the ipsec tunnels index does not match the tunnels for {0} in {1}".format(pfname, name))
+            self._tunnels_names[pfname] = names
+        return self._tunnels_names[pfname]
+
+    def _tunnels(self, pfname):
+        """ yield the name, the definition and the pfsenses of the tunnels of pfname """
+        for name in self._get_tunnels_names(pfname):
+            ipsec = self.all_tunnels[name]
+            yield (name, ipsec, ipsec['pfsenses'])
+
+    ##############################
+    # phases 1
+    #
+    def _get_ipsec_options(self, name, ipsec):
+        """ return the options shared by all the phases 1 of a tunnel """
+        if name not in self._ipsec_options:
+            self._ipsec_options[name] = [(option, value) for option, value in ipsec.items() if option not in ['pfsenses', 'phase1', 'phase2']]
+        return self._ipsec_options[name]
+
+    def iter_ipsecs(self, pfname):
+        """ yield the aggregated_ipsecs parameters of pfname """
+        for name, ipsec, pfsenses in self._tunnels(pfname):
+            local = pfsenses[pfname]
+            options = self._get_ipsec_options(name, ipsec)
+
+            for remote_name, remote_options in pfsenses.items():
+                if remote_name == pfname:
+                    continue
+
+                params = dict()
+                params['descr'] = name + ' to ' + remote_name
+                params['state'] = 'present'
+                params.update(options)
+
+                for option in remote_options:
+                    if option in ['sharing', 'myid_data']:
+                        continue
+                    params[option] = remote_options[option]
+
+                if 'peerid_type' in params and params['peerid_type'] == 'keyid tag':
+                    params['peerid_data'] = remote_options['myid_data']
+
+                if 'myid_data' in local:
+                    params['myid_data'] = local['myid_data']
+                yield params
+
+    ##############################
+    # proposals
+    #
+    def _get_proposals(self, name, ipsec):
+        """ return the proposals parameters of a tunnel, without their descr """
+        if name not in self._proposals:
+            if 'phase1' not in ipsec:
+                raise AnsibleFilterError("phase1 is missing in {0}".format(name))
+
+            phase1 = ipsec['phase1']
+            if 'encryptions' not in phase1:
+                raise AnsibleFilterError("encryptions is missing in phase1 of {0}".format(name))
+
+            if 'hashes' not in phase1:
+                raise AnsibleFilterError("hashes is missing in phase1 of {0}".format(name))
+
+            encryptions = phase1['encryptions']
+            hashes = phase1['hashes'].split(' ')
+            options = [(option, value) for option, value in phase1.items() if option not in ['encryptions', 'hashes']]
+
+            proposals = list()
+            for encryption in encryptions:
+                for hash_option in hashes:
+                    params = dict()
+                    params['state'] = 'present'
+                    params['hash'] = hash_option
+                    params['encryption'] = encryption
+                    if encryptions[encryption] is not None and encryptions[encryption] != 'None':
+                        params['key_length'] = encryptions[encryption]
+                    params.update(options)
+                    proposals.append(params)
+            self._proposals[name] = proposals
+        return self._proposals[name]
+
+    def iter_proposals(self, pfname):
+        """ yield the aggregated_ipsec_proposals parameters of pfname """
+        for name, ipsec, pfsenses in self._tunnels(pfname):
+            proposals = self._get_proposals(name, ipsec)
+
+            for remote_name in pfsenses:
+                if remote_name == pfname:
+                    continue
+
+                descr = name + ' to ' + remote_name
+                for proposal in proposals:
+                    params = dict(descr=descr)
+                    params.update(proposal)
+                    yield params
+
+    ##############################
+    # phases 2
+    #
+    def _get_p2_options(self, name, ipsec):
+        """ return the mode and the options shared by all the phases 2 of a tunnel """
+        if name not in self._p2_options:
+            if 'phase2' not in ipsec:
+                raise AnsibleFilterError("phase2 is missing in {0}".format(name))
+            phase2 = ipsec['phase2']
+
+            if 'mode' not in phase2:
+                raise AnsibleFilterError("mode is missing in phase2 of {0}".format(name))
+
+            options = list()
+            for p2_option, p2_value in phase2.items():
+                if p2_option == 'encryptions':
+                    for encryption, keylength in p2_value.items():
+                        options.append((encryption, True))
+                        if keylength is not None and keylength != 'None':
+                            if isinstance(keylength, str):
+                                options.append((encryption + '_len', keylength))
+                            else:
+                                options.append((encryption + '_len', str(keylength)))
+                elif p2_option == 'hashes':
+                    for hash_option in p2_value.split(' '):
+                        options.append((hash_option, True))
+                else:
+                    options.append((p2_option, p2_value))
+            self._p2_options[name] = (phase2['mode'], options)
+        return self._p2_options[name]
+
+    def iter_p2s(self, pfname):
+        """ yield the aggregated_ipsec_p2s parameters of pfname """
+        for name, ipsec, pfsenses in self._tunnels(pfname):
+            (mode, options) = self._get_p2_options(name, ipsec)
+
+            local = pfsenses[pfname]
+            if 'sharing' in local:
+                local_sharing = local['sharing'].split(' ')
+            elif mode != 'transport':
+                raise AnsibleFilterError("sharing is missing for {0} in {1}".format(pfname, name))
+
+            for remote_name, remote in pfsenses.items():
+                if remote_name == pfname:
+                    continue
+                if 'sharing' in remote:
+                    remote_sharing = remote['sharing'].split(' ')
+                elif mode != 'transport':
+                    raise AnsibleFilterError("sharing is missing for {0} in {1}".format(remote_name, name))
+
+                p1_descr = name + ' to ' + remote_name
+                if mode != 'transport':
+                    for local_network in local_sharing:
+                        for remote_network in remote_sharing:
+                            params = dict()
+                            params['p1_descr'] = p1_descr
+                            params['descr'] = local_network + ' to ' + remote_network
+                            params['state'] = 'present'
+                            params['local'] = local_network
+                            params['remote'] = remote_network
+                            params.update(options)
+                            yield params
+                else:
+                    params = dict()
+                    params['descr'] = p1_descr
+                    params['p1_descr'] = p1_descr
+                    params['state'] = 'present'
+                    params.update(options)
+                    yield params
+
+
+def get_ipsec_mesh(name, terms):
+    """ check the filters arguments and return the PFSenseIpsecMesh of the tunnels """
+    if len(terms) not in [2, 3] or not isinstance(terms[0], dict):
+        raise AnsibleFilterError("{0} expects one dictionnary of ipsec tunnels".format(name))
+
+    if len(terms) == 3 and not isinstance(terms[2], dict):
+        raise AnsibleFilterError("{0} expects the index of the ipsec tunnels returned by index_ipsec_tunnels".format(name))
+
+    return PFSenseIpsecMesh(terms[0], terms[2] if len(terms) == 3 else None)
+
+
+def format_ipsec_aggregate_ipsecs(*terms):
+    """ format aggregated_ipsecs for pfsense_ipsec_aggregate """
+    return get_ipsec_mesh('format_ipsec_aggregate_ipsecs', terms).get('ipsecs', terms[1])
+
+
+def format_ipsec_aggregate_proposals(*terms):
+    """ format aggregated_ipsec_proposals for pfsense_ipsec_aggregate """
+    return get_ipsec_mesh('format_ipsec_aggregate_proposals', terms).get('proposals', terms[1])
+
+
+def format_ipsec_aggregate_p2s(*terms):
+    """ format aggregated_ipsec_p2s for pfsense_ipsec_aggregate """
+    return get_ipsec_mesh('format_ipsec_aggregate_p2s', terms).get('p2s', terms[1])
+
+
+def format_ipsec_aggregate(*terms):
+    """ format var for ipsec_aggregate """
+    mesh = get_ipsec_mesh('format_ipsec_aggregate', terms)
+    pfname = terms[1]
+
+    res = dict()
+    res['aggregated_ipsecs'] = mesh.get('ipsecs', pfname)
+    res['aggregated_ipsec_proposals'] = mesh.get('proposals', pfname)
+    res['aggregated_ipsec_p2s'] = mesh.get('p2s', pfname)
+
+    return res
+
+
+class FilterModule(object):
+    """ FilterModule """
+
+    @staticmethod
+    def filters():
+        """ defined functions """
+        return {
+            'format_ipsec_aggregate': format_ipsec_aggregate,
+            'format_ipsec_aggregate_ipsecs': format_ipsec_aggregate_ipsecs,
+            'format_ipsec_aggregate_proposals': format_ipsec_aggregate_proposals,
+            'format_ipsec_aggregate_p2s': format_ipsec_aggregate_p2s,
+            'index_ipsec_tunnels': index_ipsec_tunnels,
+        }
@@ -572,6 +572,12 @@ result_vlans:
     returned: success
     type: list
     sample: ["create vlan 'mvneta.100', descr='voice', priority='5'", "update vlan 'mvneta.100', set priority='6'", "delete vlan 'mvneta.100'"]
+timings:
+    description: phases timings (in milliseconds) and counters of the whole run (pfsense) and of each kind of object, if PFSENSE_MODULE_TIMINGS is set
+    returned: success, when PFSENSE_MODULE_TIMINGS is set in the environment
+    type: dict
+    sample: {"pfsense": {"phases_ms": {"parse": 12.3, "write_config": 8.2, "apply": 1520.4}, "counts": {"php_calls": 1, "bytes_written": 84211}},
+        "rules": {"phases_ms": {"validate": 1.2, "params": 3.4, "find_target": 0.8, "mutate": 2.1}, "counts": {"runs": 12, "elements_scanned": 480}}}
 """
 
 from ansible.module_utils.network.pfsense.pfsense import PFSenseModule
@@ -1022,7 +1028,9 @@ class PFSenseModuleAggregate(object):
 
         if changed and not self.module.check_mode:
             self.pfsense.write_config(descr='aggregated change')
+            started = self.pfsense.timings.start()
             (dummy, stdout, stderr) = self._update()
+            self.pfsense.timings.stop('apply', started)
 
         result = {}
         result['result_aliases'] = self.pfsense_aliases.result['commands']
@@ -1035,6 +1043,17 @@ class PFSenseModuleAggregate(object):
         result['changed'] = changed
         result['stdout'] = stdout
         result['stderr'] = stderr
+        if self.pfsense.timings.enabled:
+            result['timings'] = dict(
+                pfsense=self.pfsense.timings.to_dict(),
+                aliases=self.pfsense_aliases.timings.to_dict(),
+                interfaces=self.pfsense_interfaces.timings.to_dict(),
+                nat_outbounds=self.pfsense_nat_outbounds.timings.to_dict(),
+                nat_port_forwards=self.pfsense_nat_port_forwards.timings.to_dict(),
+                rules=self.pfsense_rules.timings.to_dict(),
+                rule_separators=self.pfsense_rule_separators.timings.to_dict(),
+                vlans=self.pfsense_vlans.timings.to_dict(),
+            )
         self.module.exit_json(**result)
 
 
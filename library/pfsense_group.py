@@ -126,11 +126,11 @@ class PFSenseGroupModule(PFSenseModuleBase):
         """ do some extra checks on input parameters """
 
     def _nextgid(self):
-        """ return and update netgid counter """
+        """ return the first unused gid from netgid counter and update it """
         nextgid_elt = self.root_elt.find('nextgid')
-        nextgid = nextgid_elt.text
-        nextgid_elt.text = str(int(nextgid) + 1)
-        return nextgid
+        gid = self.pfsense.allocate_id('gid', int(nextgid_elt.text))
+        nextgid_elt.text = str(gid + 1)
+        return str(gid)
 
     ##############################
     # XML processing
@@ -138,14 +138,11 @@ class PFSenseGroupModule(PFSenseModuleBase):
     def _copy_and_add_target(self):
         """ create the XML target_elt """
         if 'gid' not in self.obj:
-            # Search for an open gid
-            while True:
-                self.obj['gid'] = self._nextgid()
-                if self._find_group_by_gid(self.obj['gid']) is None:
-                    break
+            self.obj['gid'] = self._nextgid()
         else:
             if self._find_group_by_gid(self.obj['gid']) is not None:
                 self.module.fail_json(msg='A different group already exists with gid {0}.'.format(self.obj['gid']))
+            self.pfsense.reserve_id('gid', self.obj['gid'])
         self.pfsense.copy_dict_to_element(self.obj, self.target_elt)
         self.diff['after'] = self.pfsense.element_to_dict(self.target_elt)
         self.root_elt.insert(self._find_last_group_index(), self.target_elt)
@@ -168,6 +165,13 @@ class PFSenseGroupModule(PFSenseModuleBase):
     def _find_target(self):
         return self.pfsense.find_elt('group', self.obj['name'], search_field='name', root_elt=self.root_elt)
 
+    def _pre_remove_target_elt(self):
+        """ processing before removing elt """
+        super(PFSenseGroupModule, self)._pre_remove_target_elt()
+        gid_elt = self.target_elt.find('gid')
+        if gid_elt is not None:
+            self.pfsense.release_id('gid', gid_elt.text)
+
     def _find_group_by_gid(self, gid):
         return self.pfsense.find_elt('group', gid, search_field='gid', root_elt=self.root_elt)
 
@@ -371,6 +371,15 @@ options:
     description: Apply VPN configuration on target pfSense
     default: True
     type: bool
+  apply_mode:
+    description:
+      How the VPN configuration is applied. C(all) reloads all the IPsec connections and the filter.
+      C(changed) loads the new IPsec configuration but only resets the connections of the created, updated or deleted phase1 and phase2,
+      and reloads the filter only when a phase1 is created or deleted or when its interface, gateway, protocol or state changed.
+      C(all) is always used with pfSense < 2.5.0 or when a VTI phase2 is created, updated or deleted.
+    default: all
+    choices: [ "all", "changed" ]
+    type: str
 """
 
 EXAMPLES = """
@@ -411,6 +420,12 @@ result_ipsec_p2s:
     returned: success
     type: list
     sample: ["create ipsec_p2 'test_p2' on 'test_tunnel', disabled='False', mode='vti', local='1.2.3.1', ...", "delete ipsec_p2 'test_p2' on 'test_tunnel'"]
+timings:
+    description: phases timings (in milliseconds) and counters of the whole run (pfsense) and of each kind of object, if PFSENSE_MODULE_TIMINGS is set
+    returned: success, when PFSENSE_MODULE_TIMINGS is set in the environment
+    type: dict
+    sample: {"pfsense": {"phases_ms": {"parse": 12.3, "write_config": 8.2, "apply": 1520.4}, "counts": {"php_calls": 1, "bytes_written": 84211}},
+        "ipsec_p2s": {"phases_ms": {"validate": 1.2, "params": 3.4, "find_target": 0.8, "mutate": 2.1}, "counts": {"runs": 12, "elements_scanned": 480}}}
 """
 
 from ansible.module_utils.network.pfsense.pfsense import PFSenseModule
@@ -438,24 +453,19 @@ class PFSenseModuleIpsecAggregate(object):
 
     def _update(self):
         if self.pfsense_ipsec.result['changed'] or self.pfsense_ipsec_proposal.result['changed'] or self.pfsense_ipsec_p2.result['changed']:
-            return self.pfsense.apply_ipsec_changes()
+            return self.pfsense.apply_ipsec_changes(changed_only=self.module.params['apply_mode'] == 'changed')
 
         return ('', '', '')
 
     @staticmethod
-    def want_ipsec(ipsec_elt, ipsecs):
-        """ return True if we want to keep ipsec_elt """
+    def want_ipsec(ipsec_elt, descrs):
+        """ return True if we want to keep ipsec_elt (descrs is the set of the wanted tunnels descr) """
         descr = ipsec_elt.find('descr')
 
         if descr is None:
             return True
 
-        for ipsec in ipsecs:
-            if ipsec['state'] == 'absent':
-                continue
-            if ipsec['descr'] == descr.text:
-                return True
-        return False
+        return descr.text in descrs
 
     def proposal_elt_to_params(self, ipsec_elt, proposal_elt):
         """ return the pfsense_ipsec_proposal params corresponding the proposal_elt """
@@ -481,11 +491,17 @@ class PFSenseModuleIpsecAggregate(object):
 
         return params
 
-    def want_ipsec_proposal(self, ipsec_elt, proposal_elt, proposals):
-        """ return True if we want to keep proposal_elt """
-        params_from_elt = self.proposal_elt_to_params(ipsec_elt, proposal_elt)
-        params_from_elt['state'] = 'present'
+    @staticmethod
+    def proposal_key(proposal):
+        """ return a hashable key of the proposal params """
+        return tuple(sorted(proposal.items()))
+
+    def wanted_ipsec_proposals(self, proposals):
+        """ return the keys of the wanted proposals, with and without prf
 
+            The proposals without prf are compared without prf (any prf of the proposal elt is kept) """
+        keys = set()
+        keys_without_prf = set()
         if proposals is not None:
             for proposal in proposals:
                 _proposal = deepcopy(proposal)
@@ -494,36 +510,43 @@ class PFSenseModuleIpsecAggregate(object):
                     _proposal.pop('prf', None)
                 elif _proposal.get('prf') is None:
                     _proposal.pop('prf', None)
-                    params_from_elt.pop('prf', None)
+                    keys_without_prf.add(self.proposal_key(_proposal))
+                    continue
+                keys.add(self.proposal_key(_proposal))
+
+        return (keys, keys_without_prf)
+
+    def want_ipsec_proposal(self, params_from_elt, wanted):
+        """ return True if we want to keep the proposal elt params_from_elt (wanted are the wanted_ipsec_proposals keys) """
+        params_from_elt = dict(params_from_elt)
+        params_from_elt['state'] = 'present'
+
+        (keys, keys_without_prf) = wanted
+        if self.proposal_key(params_from_elt) in keys:
+            return True
 
-                if params_from_elt == _proposal:
-                    return True
+        params_from_elt.pop('prf', None)
+        return self.proposal_key(params_from_elt) in keys_without_prf
 
-        return False
+    @staticmethod
+    def want_ipsec_phase2(phase2_elt, phase1_elts, descrs):
+        """ return True if we want to keep phase2_elt
 
-    def want_ipsec_phase2(self, phase2_elt, phases2):
-        """ return True if we want to keep proposal_elt """
+            phase1_elts are the phase1 elts by ikeid and descrs the set of the wanted (p1_descr, descr) phase2 """
         ikeid_elt = phase2_elt.find('ikeid')
         descr = phase2_elt.find('descr')
 
         if descr is None or ikeid_elt is None:
             return True
 
-        phase1_elt = self.pfsense.find_ipsec_phase1(ikeid_elt.text, 'ikeid')
+        phase1_elt = phase1_elts.get(ikeid_elt.text)
         if phase1_elt is None:
             return True
         phase1_descr_elt = phase1_elt.find('descr')
         if phase1_descr_elt is None:
             return True
-        p1_descr = phase1_descr_elt.text
 
-        if phases2 is not None:
-            for phase2 in phases2:
-                if phase2['state'] == 'absent':
-                    continue
-                if phase2['descr'] == descr.text and phase2['p1_descr'] == p1_descr:
-                    return True
-        return False
+        return (phase1_descr_elt.text, descr.text) in descrs
 
     def run_ipsecs(self):
         """ process input params to add/update/delete all ipsecs tunnels """
@@ -536,11 +559,12 @@ class PFSenseModuleIpsecAggregate(object):
 
         # delete every other if required
         if self.module.params['purge_ipsecs']:
+            descrs = set(ipsec['descr'] for ipsec in want or [] if ipsec['state'] != 'absent')
             todel = []
             for ipsec_elt in self.pfsense_ipsec.root_elt:
                 if ipsec_elt.tag != 'phase1':
                     continue
-                if not self.want_ipsec(ipsec_elt, want):
+                if not self.want_ipsec(ipsec_elt, descrs):
                     params = {}
                     params['state'] = 'absent'
                     params['apply'] = False
@@ -562,6 +586,7 @@ class PFSenseModuleIpsecAggregate(object):
 
         # delete every other if required
         if self.module.params['purge_ipsec_proposals']:
+            wanted = self.wanted_ipsec_proposals(want)
             todel = []
             for ipsec_elt in self.pfsense_ipsec_proposal.ipsec:
                 if ipsec_elt.tag != 'phase1':
@@ -573,8 +598,8 @@ class PFSenseModuleIpsecAggregate(object):
 
                 items_elt = encryption_elt.findall('item')
                 for proposal_elt in items_elt:
-                    if not self.want_ipsec_proposal(ipsec_elt, proposal_elt, want):
-                        params = self.proposal_elt_to_params(ipsec_elt, proposal_elt)
+                    params = self.proposal_elt_to_params(ipsec_elt, proposal_elt)
+                    if not self.want_ipsec_proposal(params, wanted):
                         params['state'] = 'absent'
                         params['apply'] = False
                         params['descr'] = ipsec_elt.find('descr').text
@@ -595,16 +620,23 @@ class PFSenseModuleIpsecAggregate(object):
 
         # delete every other if required
         if self.module.params['purge_ipsec_p2s']:
+            descrs = set((phase2['p1_descr'], phase2['descr']) for phase2 in want or [] if phase2['state'] != 'absent')
+            phase1_elts = dict()
+            for phase1_elt in self.pfsense.ipsec.findall('phase1'):
+                ikeid_elt = phase1_elt.find('ikeid')
+                if ikeid_elt is not None:
+                    phase1_elts.setdefault(ikeid_elt.text, phase1_elt)
+
             todel = []
             for phase2_elt in self.pfsense_ipsec_p2.root_elt:
                 if phase2_elt.tag != 'phase2':
                     continue
-                if not self.want_ipsec_phase2(phase2_elt, want):
+                if not self.want_ipsec_phase2(phase2_elt, phase1_elts, descrs):
                     params = {}
                     params['state'] = 'absent'
                     params['apply'] = False
                     params['descr'] = phase2_elt.find('descr').text
-                    params['p1_descr'] = self.pfsense.find_ipsec_phase1(phase2_elt.find('ikeid').text, 'ikeid').find('descr').text
+                    params['p1_descr'] = phase1_elts[phase2_elt.find('ikeid').text].find('descr').text
                     params['ikeid'] = phase2_elt.find('ikeid').text
                     todel.append(params)
 
@@ -620,7 +652,9 @@ class PFSenseModuleIpsecAggregate(object):
         if changed and not self.module.check_mode:
             self.pfsense.write_config(descr='aggregated change')
             if self.module.params['apply']:
+                started = self.pfsense.timings.start()
                 (dummy, stdout, stderr) = self._update()
+                self.pfsense.timings.stop('apply', started)
 
         result = {}
         result['result_ipsecs'] = self.pfsense_ipsec.result['commands']
@@ -629,6 +663,13 @@ class PFSenseModuleIpsecAggregate(object):
         result['changed'] = changed
         result['stdout'] = stdout
         result['stderr'] = stderr
+        if self.pfsense.timings.enabled:
+            result['timings'] = dict(
+                pfsense=self.pfsense.timings.to_dict(),
+                ipsecs=self.pfsense_ipsec.timings.to_dict(),
+                ipsec_proposals=self.pfsense_ipsec_proposal.timings.to_dict(),
+                ipsec_p2s=self.pfsense_ipsec_p2.timings.to_dict(),
+            )
         self.module.exit_json(**result)
 
 
@@ -641,6 +682,7 @@ def main():
         purge_ipsec_proposals=dict(default=False, type='bool'),
         purge_ipsec_p2s=dict(default=False, type='bool'),
         apply=dict(default=True, type='bool'),
+        apply_mode=dict(default='all', choices=['all', 'changed'], type='str'),
     )
 
     required_one_of = [['aggregated_ipsecs', 'aggregated_ipsec_proposals', 'aggregated_ipsec_p2s']]
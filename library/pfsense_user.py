@@ -216,9 +216,9 @@ class PFSenseUserModule(PFSenseModuleBase):
 
     def _nextuid(self):
         nextuid_elt = self.root_elt.find('nextuid')
-        nextuid = nextuid_elt.text
-        nextuid_elt.text = str(int(nextuid) + 1)
-        return nextuid
+        uid = self.pfsense.allocate_id('uid', int(nextuid_elt.text))
+        nextuid_elt.text = str(uid + 1)
+        return str(uid)
 
     def _format_diff_priv(self, priv):
         if isinstance(priv, str):
@@ -237,6 +237,8 @@ class PFSenseUserModule(PFSenseModuleBase):
             self.module.fail_json(msg='Password is required when adding a user')
         if 'uid' not in obj:
             obj['uid'] = self._nextuid()
+        else:
+            self.pfsense.reserve_id('uid', obj['uid'])
 
         self.diff['after'] = obj
         self.pfsense.copy_dict_to_element(self.obj, self.target_elt)
@@ -334,6 +336,7 @@ class PFSenseUserModule(PFSenseModuleBase):
             self.diff['before'] = self.pfsense.element_to_dict(self.target_elt)
             # Store uid for _update()
             self.obj['uid'] = self.target_elt.find('uid').text
+            self.pfsense.release_id('uid', self.obj['uid'])
 
             # Get current group membership
             self.diff['before']['groups'] = self._find_groups_for_uid(self.obj['uid'])
@@ -67,6 +67,11 @@ commands:
     returned: always
     type: list
     sample: ["create vlan 'mvneta.100', descr='voice', priority='5'", "update vlan 'mvneta.100', set priority='6'", "delete vlan 'mvneta.100'"]
+stdout:
+    description: the outcome of each destroyed or created vlan interface, when the changes are applied
+    returned: always
+    type: str
+    sample: "vlan mvneta.100 destroyed\nvlan mvneta.100 created\n"
 """
 
 from ansible.module_utils.basic import AnsibleModule
@@ -28,6 +28,47 @@ options:
       - aliases
       - rules
       - rule_separators
+  artifact:
+    description:
+    - Path of a definitions artifact compiled with the --artifact option of the plugin command line.
+      The definitions of the pfsense are read from it instead of being generated. When the yaml file is available,
+      the artifact must have been compiled from it and from the same included files, with the same options.
+  cache_dir:
+    description:
+    - Directory where the subrules required on the target are saved for each rule, with a hash of all the rule inputs.
+      On the next runs, only the rules whose inputs changed are decomposed again.
+  collapse_aliases:
+    description:
+    - Merge the adjacent and overlapping ip addresses and networks of the generated network aliases.
+      The number of entries saved is displayed in verbose mode.
+    default: False
+  compact_ports:
+    description:
+    - Merge the adjacent and overlapping ports and ports ranges of the rules and of the ports aliases,
+      so they are written as sorted minimal lists of ranges.
+    default: False
+  content_names:
+    description:
+    - Name the aliases generated to aggregate rules after their content instead of after the rules using them.
+      The same set of addresses or ports then always gets the same alias name, on every pfsense.
+    default: False
+  dns_workers:
+    description: Maximum number of fqdns resolved concurrently
+    default: 10
+  dns_cache:
+    description: Path of a json file used to cache resolved fqdns between runs
+  dns_cache_ttl:
+    description: Number of seconds a resolved fqdn is kept in dns_cache
+    default: 3600
+  dns_hosts_file:
+    description:
+    - Path of a file using /etc/hosts format. The fqdns defined in it are never resolved,
+      which allows reproducible runs without any dns server.
+notes:
+- When the C(PFSENSE_LOOKUP_PROFILE) environment variable is set to a true value, the wall time and the objects
+  counts of each compilation phase are displayed, with the slowest rules. When C(PFSENSE_LOOKUP_PROFILE_DUMP) is set,
+  a cProfile dump of the compilation is also written into the file it names. The plugin command line provides the same
+  with its --profile and --profile-dump options.
 """
 
 EXAMPLES = """
@@ -43,6 +84,18 @@ EXAMPLES = """
   debug:
     rule_separators: "{{ lookup('pfsense', 'all_pf_defs.yml', 'rule_separators') }}"
 
+- name: Get all definitions precompiled in CI with 'pfsense.py all_pf_defs.yml pf_name --artifact all_pf_defs.jsonl.gz'
+  debug:
+    definitions: "{{ lookup('pfsense', 'all_pf_defs.yml', 'all_definitions', artifact='all_pf_defs.jsonl.gz') }}"
+
+- name: Get all rules to be defined, decomposing again only the rules modified since the last run
+  debug:
+    rules: "{{ lookup('pfsense', 'all_pf_defs.yml', 'rules', cache_dir='/tmp/pf_rules_cache') }}"
+
+- name: Get all rules to be defined, using a dns cache and 20 concurrent dns queries
+  debug:
+    rules: "{{ lookup('pfsense', 'all_pf_defs.yml', 'rules', dns_workers=20, dns_cache='/tmp/pf_dns_cache.json') }}"
+
 """
 
 RETURN = """
@@ -193,18 +246,36 @@ ports_aliases:
 
 from copy import copy, deepcopy
 from collections import OrderedDict
+from tempfile import mkstemp
 from ansible.utils.display import Display
 from dns import resolver, exception
 
 import argparse
+import cProfile
+import errno
+import gzip
+import hashlib
 import json
 import re
 import socket
 import sys
+import time
 import yaml
 import traceback
 import os
 
+try:
+    from concurrent.futures import ThreadPoolExecutor
+    HAS_FUTURES = True
+except ImportError:
+    HAS_FUTURES = False
+
+try:
+    from yaml import CLoader, CSafeLoader
+    LIBYAML_LOADERS = {yaml.Loader: CLoader, yaml.SafeLoader: CSafeLoader}
+except ImportError:
+    LIBYAML_LOADERS = {}
+
 from ansible.errors import AnsibleError
 from ansible.plugins.lookup import LookupBase
 from ansible.module_utils.compat import ipaddress
@@ -228,8 +299,69 @@ def to_unicode(string):
     return string.decode("utf-8")
 
 
-def ordered_load(stream, loader_cls=yaml.Loader, object_pairs_hook=OrderedDict):
-    """ load and return yaml data from stream using ordered dicts """
+def static_vars(**kwargs):
+    """ static decorator to declare static vars """
+
+    def decorate(func):
+        """ static decorator func """
+        for k in kwargs:
+            setattr(func, k, kwargs[k])
+        return func
+    return decorate
+
+
+def copy_definitions(value):
+    """ return a copy of yaml data (faster than deepcopy since there are only dicts, lists and scalars) """
+    if isinstance(value, dict):
+        return value.__class__((key, copy_definitions(item)) for key, item in value.items())
+    if isinstance(value, list):
+        return [copy_definitions(item) for item in value]
+    return value
+
+
+def file_stamp(filename):
+    """ return the modification time and the size of filename """
+    stat = os.stat(filename)
+    return (stat.st_mtime, stat.st_size)
+
+
+def valid_stamps(stamps):
+    """ return True if none of the (filename, mtime, size) stamps files has been modified """
+    try:
+        return all(file_stamp(filename) == (mtime, size) for (filename, mtime, size) in stamps)
+    except OSError:
+        return False
+
+
+def write_file_atomically(filename, write, mode='w'):
+    """ call write with a temporary file of the directory of filename, and rename it to filename
+        so that concurrent writers (the forks of ansible) never leave a partial file """
+    (fd, tmp_file) = mkstemp(prefix=os.path.basename(filename) + '.', suffix='.tmp', dir=os.path.dirname(os.path.abspath(filename)))
+    try:
+        with os.fdopen(fd, mode) as f:
+            write(f)
+
+        # mkstemp creates the file readable only by its owner
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(tmp_file, 0o666 & ~umask)
+        os.rename(tmp_file, filename)
+    finally:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+
+
+@static_vars(includes_cache=dict())
+def ordered_load(stream, loader_cls=yaml.Loader, object_pairs_hook=OrderedDict, included=None):
+    """ load and return yaml data from stream using ordered dicts
+        the libyaml loader is used when available and included files are parsed only once
+        as long as neither them nor the files they include are modified
+        if included is set, the paths of all the files included, directly or not, are added to it """
+    includes_cache = ordered_load.includes_cache
+    loader_cls = LIBYAML_LOADERS.get(loader_cls, loader_cls)
+
+    # stamps of the files included by each file being loaded
+    frames = [[]]
 
     class OrderedLoader(loader_cls):
         def __init__(self, stream):
@@ -237,9 +369,22 @@ def ordered_load(stream, loader_cls=yaml.Loader, object_pairs_hook=OrderedDict):
             super(OrderedLoader, self).__init__(stream)
 
         def include(self, node):
-            filename = os.path.join(self._root, self.construct_scalar(node))
-            with open(filename, 'r') as f:
-                return yaml.load(f, OrderedLoader)
+            filename = os.path.abspath(os.path.join(self._root, self.construct_scalar(node)))
+            key = (filename, loader_cls, object_pairs_hook)
+            cached = includes_cache.get(key)
+            if cached is None or not valid_stamps(cached[0]):
+                frames.append([(filename,) + file_stamp(filename)])
+                try:
+                    with open(filename, 'r') as f:
+                        data = yaml.load(f, OrderedLoader)
+                finally:
+                    stamps = tuple(frames.pop())
+                cached = (stamps, data)
+                includes_cache[key] = cached
+            frames[-1].extend(cached[0])
+
+            # the definitions are modified when parsed, so the cached ones are never returned
+            return copy_definitions(cached[1])
 
     def construct_mapping(loader, node):
         loader.flatten_mapping(node)
@@ -251,18 +396,10 @@ def ordered_load(stream, loader_cls=yaml.Loader, object_pairs_hook=OrderedDict):
     OrderedLoader.add_constructor(
         '!include',
         OrderedLoader.include)
-    return yaml.load(stream, OrderedLoader)
-
-
-def static_vars(**kwargs):
-    """ static decorator to declare static vars """
-
-    def decorate(func):
-        """ static decorator func """
-        for k in kwargs:
-            setattr(func, k, kwargs[k])
-        return func
-    return decorate
+    data = yaml.load(stream, OrderedLoader)
+    if included is not None:
+        included.update(stamp[0] for stamp in frames[0])
+    return data
 
 
 @static_vars(res_cache=dict())
@@ -376,6 +513,203 @@ def resolve_hostname(address, dns_servers=None):
     raise AssertionError(msg)
 
 
+class PFSenseHostnameResolver(object):
+    """ Class resolving fqdns concurrently, with an optional on-disk cache and hosts file override """
+
+    def __init__(self, workers=10, cache_file=None, cache_ttl=3600, hosts_file=None):
+        self._workers = workers
+        self._cache_file = cache_file
+        self._cache_ttl = cache_ttl
+        self._cache = {}
+        self._cache_updated = False
+        self._hosts = {}
+        self._resolved = {}
+        self._errors = {}
+
+        if hosts_file is not None:
+            self._hosts = self.load_hosts_file(hosts_file)
+
+        if cache_file is not None:
+            self._load_cache()
+
+    @staticmethod
+    def load_hosts_file(filename):
+        """ load and return fqdns defined in a file using /etc/hosts format """
+        hosts = {}
+        with open(filename, 'r') as f:
+            for line in f:
+                fields = line.split('#', 1)[0].split()
+                if len(fields) < 2:
+                    continue
+
+                if not is_valid_ip(fields[0]):
+                    display.warning("Invalid ip address {0} in {1}".format(fields[0], filename))
+                    continue
+
+                for name in fields[1:]:
+                    hosts.setdefault(name.lower(), fields[0])
+        return hosts
+
+    def _load_cache(self):
+        """ load the cached answers which are not expired """
+        if not os.path.exists(self._cache_file):
+            return
+
+        now = time.time()
+        try:
+            with open(self._cache_file, 'r') as f:
+                cache = json.load(f)
+
+            valid = dict()
+            for key, (address, expires) in cache.items():
+                if expires > now:
+                    valid[key] = (address, expires)
+        except (AttributeError, KeyError, TypeError, ValueError):
+            display.warning("Ignoring invalid dns cache file {0}".format(self._cache_file))
+            return
+
+        self._cache.update(valid)
+
+    def _save_cache(self):
+        """ write the cached answers """
+        write_file_atomically(self._cache_file, lambda f: json.dump(self._cache, f))
+        self._cache_updated = False
+
+    @staticmethod
+    def _get_key(address, dns_servers):
+        """ return the key used to store an answer """
+        if dns_servers is None:
+            return address
+        return '{0}@{1}'.format(address, ','.join(dns_servers))
+
+    @staticmethod
+    def _resolve_one(query):
+        """ resolve a (address, dns_servers) query, returning (ip, error) """
+        try:
+            return (resolve_hostname(query[0], query[1]), None)
+        except AssertionError as error:
+            return (None, str(error))
+
+    def resolve_all(self, queries):
+        """ resolve all the (address, dns_servers) queries, doing at most workers dns requests at the same time """
+        todo = OrderedDict()
+        now = time.time()
+        for (address, dns_servers) in queries:
+            key = self._get_key(address, dns_servers)
+            if key in self._resolved or key in self._errors or key in todo:
+                continue
+
+            if address.lower() in self._hosts:
+                self._resolved[key] = self._hosts[address.lower()]
+            elif key in self._cache and self._cache[key][1] > now:
+                self._resolved[key] = self._cache[key][0]
+            else:
+                todo[key] = (address, dns_servers)
+
+        if todo:
+            if HAS_FUTURES and self._workers > 1 and len(todo) > 1:
+                with ThreadPoolExecutor(max_workers=self._workers) as executor:
+                    answers = list(executor.map(self._resolve_one, todo.values()))
+            else:
+                answers = [self._resolve_one(query) for query in todo.values()]
+
+            expires = time.time() + self._cache_ttl
+            for key, (address, error) in zip(todo.keys(), answers):
+                if error is not None:
+                    self._errors[key] = error
+                    continue
+                self._resolved[key] = address
+                self._cache[key] = (address, expires)
+                self._cache_updated = True
+
+        if self._cache_file is not None and self._cache_updated:
+            self._save_cache()
+
+    def resolve(self, address, dns_servers=None):
+        """ get ip for hostname """
+        key = self._get_key(address, dns_servers)
+        if key not in self._resolved and key not in self._errors:
+            self.resolve_all([(address, dns_servers)])
+
+        if key in self._errors:
+            raise AssertionError(self._errors[key])
+        return self._resolved[key]
+
+
+class PFSenseProfiler(object):
+    """ Class recording the wall time and objects counts of each compilation phase, and the time spent on each rule
+        when disabled, nothing is recorded """
+
+    def __init__(self, enabled=False, dump_file=None):
+        self.enabled = enabled or dump_file is not None
+        self._dump_file = dump_file
+        self._cprofile = None
+        self._phases = OrderedDict()
+        self._rules = {}
+
+    @staticmethod
+    def from_environment():
+        """ return a profiler configured with PFSENSE_LOOKUP_PROFILE and PFSENSE_LOOKUP_PROFILE_DUMP environment variables """
+        enabled = os.environ.get('PFSENSE_LOOKUP_PROFILE', '').lower() not in ['', '0', 'no', 'false']
+        return PFSenseProfiler(enabled, os.environ.get('PFSENSE_LOOKUP_PROFILE_DUMP') or None)
+
+    def begin(self):
+        """ start the cProfile profiling, if a dump file is set """
+        if self._dump_file is not None:
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+
+    def end(self):
+        """ stop the cProfile profiling and write its dump file """
+        if self._cprofile is not None:
+            self._cprofile.disable()
+            self._cprofile.dump_stats(self._dump_file)
+            self._cprofile = None
+
+    def start(self):
+        """ return the start time of a phase """
+        if self.enabled:
+            return time.time()
+        return None
+
+    def stop(self, phase, started, count=0):
+        """ record the time spent in phase since started and the number of objects processed
+            return the start time of the next phase """
+        if started is None:
+            return None
+
+        now = time.time()
+        if phase not in self._phases:
+            self._phases[phase] = [0.0, 0]
+        self._phases[phase][0] += now - started
+        self._phases[phase][1] += count
+        return now
+
+    def stop_rule(self, name, started, count):
+        """ record the time spent on the rule name since started and the number of subrules generated """
+        if started is not None:
+            self._rules[name] = (time.time() - started, count)
+
+    def report(self, top=10):
+        """ return the report lines of the phases and of the top slowest rules """
+        lines = ['Phases:']
+        for phase, (elapsed, count) in self._phases.items():
+            line = '  {0:<28} {1:9.3f}s'.format(phase, elapsed)
+            if count:
+                line += ' {0:>9} objects'.format(count)
+            lines.append(line)
+
+        if self._rules:
+            lines.append('Slowest rules:')
+            rules = sorted(self._rules.items(), key=lambda rule: rule[1][0], reverse=True)
+            for name, (elapsed, count) in rules[:top]:
+                lines.append('  {0:<28} {1:9.3f}s {2:>9} subrules'.format(name, elapsed, count))
+
+        if self._dump_file is not None:
+            lines.append('cProfile dump written to {0}'.format(self._dump_file))
+        return lines
+
+
 def is_valid_ip(address):
     """ validate ip address format """
     try:
@@ -406,6 +740,35 @@ def is_valid_port_range(port_range):
     return nport1 >= 0 and nport1 <= 65535 and nport2 >= 0 and nport2 <= 65535
 
 
+def merge_ports(ports):
+    """ return ports with adjacent and overlapping ports and ports ranges merged
+        aliases names are kept first, followed by the sorted ports and ports ranges """
+    ret = []
+    intervals = []
+    for port in ports:
+        if is_valid_port(port):
+            intervals.append((int(port), int(port)))
+        elif is_valid_port_range(port):
+            (start, end) = [int(value) for value in port.split('-')]
+            intervals.append((min(start, end), max(start, end)))
+        elif port not in ret:
+            ret.append(port)
+
+    merged = []
+    for (start, end) in sorted(intervals):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+
+    for (start, end) in merged:
+        if start == end:
+            ret.append(str(start))
+        else:
+            ret.append('{0}-{1}'.format(start, end))
+    return ret
+
+
 def is_valid_network(address):
     """ validate network address format """
     try:
@@ -454,6 +817,9 @@ def rule_product_ports(rule, field, field_port):
 
 class PFSenseHostAlias(object):
     """ Class holding structured pfsense host alias definition """
+    __slots__ = (
+        'name', 'descr', 'definition', 'ips', 'networks', 'dns', 'fake', 'local_interfaces', 'routed_interfaces', '_computed', '_addresses_key')
+
     def __init__(self):
         self.name = None
         self.descr = None
@@ -471,6 +837,7 @@ class PFSenseHostAlias(object):
         self.routed_interfaces = {}
 
         self._computed = False
+        self._addresses_key = None
 
     def __str__(self):
         return "name={0}, descr={1}, definition={2}, ips={3}, networks={4}, local_interfaces={5}, routed_interfaces={6}, fake={7}".format(
@@ -525,7 +892,7 @@ class PFSenseHostAlias(object):
             # it's a fqdn
             if address not in data.all_aliases:
                 if is_fqdn(address):
-                    resolved_ip = resolve_hostname(address, self.dns)
+                    resolved_ip = data.resolver.resolve(address, self.dns)
                     host_ip = to_ip_address(to_unicode(resolved_ip))
                     self.ips.append(host_ip)
                     continue
@@ -543,6 +910,12 @@ class PFSenseHostAlias(object):
 
             todo.extend(data.all_aliases[address]['ip'].split())
 
+    def addresses_key(self):
+        """ return the set of all ips and networks of the alias """
+        if self._addresses_key is None:
+            self._addresses_key = frozenset(self.ips).union(self.networks)
+        return self._addresses_key
+
     def _is_in_networks(self, interface, fcheckname):
         """ check if an alias is in a network of an interface """
         fcheck = getattr(interface, fcheckname)
@@ -757,6 +1130,10 @@ class PFSenseHostAlias(object):
 
 class PFSenseRule(object):
     """ Class holding structured pfsense rule declaration """
+    __slots__ = (
+        'name', 'separator', 'src', 'src_port', 'dst', 'dst_port', 'src_nat', 'dst_nat', 'dst_nat_port', 'protocol', 'action', 'options',
+        'floating', 'force', 'asymmetric', 'invert_dst', 'invert_src', 'sub_rules', 'interfaces', 'generated_names')
+
     def __init__(self):
         self.name = None
         self.separator = None
@@ -791,6 +1168,16 @@ class PFSenseRule(object):
             separator = separator.parent
         return None
 
+    def copy_with(self, src=None, dst=None):
+        """ return a copy of the rule with src and/or dst replaced
+            the fields which are never modified after parsing are shared with the rule instead of being copied """
+        rule = copy(self)
+        rule.src = [src] if src is not None else list(self.src)
+        rule.dst = [dst] if dst is not None else list(self.dst)
+        rule.sub_rules = []
+        rule.generated_names = {}
+        return rule
+
     def to_json(self):
         """ return JSON String containing rule """
         srcs = []
@@ -826,6 +1213,8 @@ class PFSenseRule(object):
 
 class PFSenseRuleSeparator(object):
     """ Class holding structured pfsense rule separator declaration """
+    __slots__ = ('name', 'interface', 'parent', 'options')
+
     def __init__(self):
         self.name = None
         self.interface = None
@@ -841,6 +1230,10 @@ class PFSenseRuleSeparator(object):
 
 class PFSenseInterface(object):
     """ Class holding structured pfsense interface definition """
+    __slots__ = (
+        'name', 'local_ip', 'local_network', 'local_ips', 'local_networks', 'remote_networks', 'adjacent_networks', 'tags', 'bridge',
+        '_remote_networks_contains_cache', '_adjacent_networks_contains_cache')
+
     def __init__(self):
         self.name = None
         self.local_ip = None        # first ip defined
@@ -930,6 +1323,11 @@ class PFSenseInterface(object):
 
 class PFSense(object):
     """ Class holding structured pfsense definition """
+    __slots__ = (
+        'name', 'interfaces', 'is_whole_in_pfsense_cache', 'is_whole_not_in_pfsense_cache', 'is_whole_in_same_routing_ifaces_cache',
+        '_interfaces_local_networks_contains_cache', '_interfaces_remote_networks_contains_cache', '_interfaces_adjacent_networks_contains_cache',
+        '_hack_internet_routing_cache')
+
     def __init__(self, name, interfaces):
         self.name = name
         self.interfaces = interfaces
@@ -1062,7 +1460,8 @@ class PFSense(object):
 class PFSenseData(object):
     """ Class holding all data """
 
-    def __init__(self, hosts_aliases, ports_aliases, pfsenses, rules, target_name, gendiff=False, debug=None, aggregate=True):
+    def __init__(self, hosts_aliases, ports_aliases, pfsenses, rules, target_name, gendiff=False, debug=None, aggregate=True, resolver=None,
+                 collapse=False, content_names=False, compact_ports=False, profiler=None):
         self._hosts_aliases = hosts_aliases
         self._ports_aliases = ports_aliases
         self._pfsenses = pfsenses
@@ -1078,14 +1477,37 @@ class PFSenseData(object):
         self.gendiff = gendiff
         self.debug = debug
         self.aggregate = aggregate
+        self.collapse = collapse
+        self.content_names = content_names
+        self.compact_ports = compact_ports
         self._all_aliases = copy(self._hosts_aliases)
         self._all_aliases.update(self._ports_aliases)
+        if resolver is None:
+            resolver = PFSenseHostnameResolver()
+        self._resolver = resolver
+        if profiler is None:
+            profiler = PFSenseProfiler()
+        self._profiler = profiler
+        self._hosts_aliases_members = {}
+        self._ports_aliases_members = {}
+        self._hosts_aliases_by_addresses = None
+        self._ports_aliases_by_ports = None
 
     @property
     def all_aliases(self):
         """ all_aliases getter """
         return self._all_aliases
 
+    @property
+    def resolver(self):
+        """ resolver getter """
+        return self._resolver
+
+    @property
+    def profiler(self):
+        """ profiler getter """
+        return self._profiler
+
     @property
     def hosts_aliases(self):
         """ hosts_aliases getter """
@@ -1174,15 +1596,75 @@ class PFSenseData(object):
 
         return ret
 
+    def get_host_alias_members(self, alias):
+        """ return the names of alias and of all the aliases nested in it, expanded once """
+        members = self._hosts_aliases_members.get(alias.name)
+        if members is None:
+            members = OrderedDict()
+            members[alias.name] = None
+            for target in alias.definition:
+                obj = self._hosts_aliases_obj[target]
+                if obj.fake:
+                    continue
+                for name in self.get_host_alias_members(obj):
+                    members[name] = None
+            members = tuple(members)
+            self._hosts_aliases_members[alias.name] = members
+        return members
+
+    def get_port_alias_members(self, alias):
+        """ return the names of alias and of all the aliases nested in it, expanded once """
+        members = self._ports_aliases_members.get(alias)
+        if members is None:
+            members = OrderedDict()
+            if alias in self._all_aliases:
+                members[alias] = None
+                if 'port' in self._all_aliases[alias]:
+                    for port in self._all_aliases[alias]['port'].split():
+                        for name in self.get_port_alias_members(port):
+                            members[name] = None
+            members = tuple(members)
+            self._ports_aliases_members[alias] = members
+        return members
+
+    @staticmethod
+    def canonical_ports(ports):
+        """ return the set of merged ports, ports ranges and aliases names in ports """
+        return frozenset(merge_ports(ports))
+
+    def _get_generated_alias_name(self, prefix, _basename, members):
+        """ return a free name for a generated alias
+            it's derived from the members of the alias if content_names is set, from _basename otherwise """
+        if self.content_names:
+            digest = hashlib.sha1(' '.join(sorted(members)).encode('utf-8')).hexdigest()
+            name = '{0}_{1}'.format(prefix, digest[0:16])
+            if name not in self._all_aliases:
+                return name
+            basename = digest[0:16]
+        else:
+            # alias can only be 32 chars long so we truncate a bit if required
+            basename = _basename[0:26]
+
+        idx = 1
+        while True:
+            name = '{0}_{1}_{2}'.format(prefix, basename, idx)
+            if name not in self._all_aliases:
+                return name
+            idx = idx + 1
+
     def get_hosts_alias(self, hosts, ips, networks, _basename):
         """ return an alias with all the hosts
             create it if required """
 
-        searched = ips.union(networks)
-        for alias in self._hosts_aliases_obj.values():
-            alias_ips = set(alias.ips).union(set(alias.networks))
-            if not alias_ips ^ searched:
-                return alias
+        if self._hosts_aliases_by_addresses is None:
+            self._hosts_aliases_by_addresses = {}
+            for alias in self._hosts_aliases_obj.values():
+                self._hosts_aliases_by_addresses.setdefault(alias.addresses_key(), alias)
+
+        searched = frozenset(ips.union(networks))
+        alias = self._hosts_aliases_by_addresses.get(searched)
+        if alias is not None:
+            return alias
 
         obj = PFSenseHostAlias()
         obj.definition = list(hosts)
@@ -1191,16 +1673,10 @@ class PFSenseData(object):
         obj.networks = list(networks)
         obj.fake = False
 
-        # alias can only be 32 chars long so we truncate a bit if required
-        basename = _basename[0:26]
-        idx = 1
-        while True:
-            obj.name = 'h_{0}_{1}'.format(basename, idx)
-            if obj.name not in self._all_aliases:
-                break
-            idx = idx + 1
+        obj.name = self._get_generated_alias_name('h', _basename, [str(address) for address in searched])
 
         self._hosts_aliases_obj[obj.name] = obj
+        self._hosts_aliases_by_addresses[searched] = obj
 
         alias = dict()
         alias['ip'] = ' '.join(obj.definition)
@@ -1213,19 +1689,16 @@ class PFSenseData(object):
         """ return an alias with all the ports
             create it if required """
 
-        for name, alias in self._ports_aliases.items():
-            alias_ports = set(alias['port'].split())
-            if not alias_ports ^ ports:
-                return name
+        if self._ports_aliases_by_ports is None:
+            self._ports_aliases_by_ports = {}
+            for name, alias in self._ports_aliases.items():
+                self._ports_aliases_by_ports.setdefault(self.canonical_ports(alias['port'].split()), name)
 
-        # alias can only be 32 chars long so we truncate a bit if required
-        basename = _basename[0:26]
-        idx = 1
-        while True:
-            name = 'p_{0}_{1}'.format(basename, idx)
-            if name not in self._all_aliases:
-                break
-            idx = idx + 1
+        searched = self.canonical_ports(ports)
+        if searched in self._ports_aliases_by_ports:
+            return self._ports_aliases_by_ports[searched]
+
+        name = self._get_generated_alias_name('p', _basename, searched)
 
         alias = dict()
         alias['descr'] = name
@@ -1234,6 +1707,7 @@ class PFSenseData(object):
         alias['port'] = ' '.join(sorted_ports)
         self._all_aliases[name] = alias
         self._ports_aliases[name] = alias
+        self._ports_aliases_by_ports[searched] = name
 
         return name
 
@@ -1243,6 +1717,7 @@ class PFSenseDataParser(object):
 
     def __init__(self, data):
         self._data = data
+        self._aliases_order = []
 
     @staticmethod
     def check_alias_name(name):
@@ -1418,6 +1893,43 @@ class PFSenseDataParser(object):
 
         return ret
 
+    def _get_alias_childs(self, name):
+        """ return the aliases directly used in the definition of alias name """
+        alias = self._data.all_aliases[name]
+        values = str(alias.get('ip', '')).split() + str(alias.get('port', '')).split()
+        return [value for value in values if value in self._data.all_aliases]
+
+    def parse_aliases_cycles(self):
+        """ Checking that no alias is defined using itself and sorting aliases in topological order """
+        ret = True
+        order = []
+        visiting = {}
+        for root in self._data.all_aliases:
+            if root in visiting:
+                continue
+
+            visiting[root] = True
+            path = [root]
+            childs = [iter(self._get_alias_childs(root))]
+            while childs:
+                child = next(childs[-1], None)
+                if child is None:
+                    name = path.pop()
+                    childs.pop()
+                    visiting[name] = False
+                    order.append(name)
+                elif child not in visiting:
+                    visiting[child] = True
+                    path.append(child)
+                    childs.append(iter(self._get_alias_childs(child)))
+                elif visiting[child]:
+                    cycle = path[path.index(child):] + [child]
+                    self._data.set_error("Circular definition of alias " + child + ": " + " -> ".join(cycle))
+                    ret = False
+
+        self._aliases_order = order
+        return ret
+
     def create_obj_any_alias(self):
         """ Create a PFSenseHostAlias object for address any (for easier processing later) """
         obj = PFSenseHostAlias()
@@ -2044,8 +2556,25 @@ class PFSenseDataParser(object):
 
         return ret
 
+    def resolve_hosts_aliases_fqdns(self):
+        """ Resolve all the fqdns used in host alias objs at once """
+        queries = []
+        for obj in self._data.hosts_aliases_obj.values():
+            for address in obj.definition:
+                if address not in self._data.all_aliases and is_fqdn(address):
+                    queries.append((address, obj.dns))
+
+        self._data.resolver.resolve_all(queries)
+        return True
+
     def parse_hosts_aliases_objs(self):
         """ Checking all host alias objs, addresses and finding pfsenses interfaces """
+        # nested aliases are computed first, so each alias is expanded only once
+        for name in self._aliases_order:
+            obj = self._data.hosts_aliases_obj.get(name)
+            if obj is not None:
+                obj.compute_all(self._data)
+
         for obj in self._data.hosts_aliases_obj.values():
             obj.compute_all(self._data)
 
@@ -2054,13 +2583,24 @@ class PFSenseDataParser(object):
     def parse(self):
         """ Check and parse everything """
         ret = True
+        profiler = self._data.profiler
+        started = profiler.start()
         self.create_pfsenses_aliases()
         ret = ret and self.parse_hosts_aliases()
+        started = profiler.stop('parse hosts aliases', started, len(self._data.hosts_aliases))
         ret = ret and self.parse_ports_aliases()
+        started = profiler.stop('parse ports aliases', started, len(self._data.ports_aliases))
+        ret = ret and self.parse_aliases_cycles()
+        started = profiler.stop('check aliases cycles', started)
         ret = ret and self.parse_rules()
+        started = profiler.stop('parse rules', started, len(self._data.rules_obj))
         ret = ret and self.parse_pfsenses()
         ret = ret and self.parse_target_name()
+        started = profiler.stop('parse pfsenses', started, len(self._data.pfsenses_obj))
+        ret = ret and self.resolve_hosts_aliases_fqdns()
+        started = profiler.stop('resolve fqdns', started)
         ret = ret and self.parse_hosts_aliases_objs()
+        profiler.stop('compute hosts aliases', started, len(self._data.hosts_aliases_obj))
 
         return ret
 
@@ -2128,27 +2668,26 @@ class PFSenseRuleDecomposer(object):
         src_sep = function(field)
         if len(src_sep) > 1:
             for src in src_sep:
-                new_rule = deepcopy(rule)
-                setattr(new_rule, attr, [src])
-                sub_rules.append(new_rule)
+                sub_rules.append(rule.copy_with(**{attr: src}))
 
         return sub_rules
 
+    @staticmethod
+    def product_rules(rule, reverse=False):
+        """ Yields one rule for each src and dst of rule """
+        srcs = reversed(rule.src) if reverse else rule.src
+        for src in srcs:
+            dsts = reversed(rule.dst) if reverse else rule.dst
+            for dst in dsts:
+                yield rule.copy_with(src, dst)
+
     def decompose_rule(self, rule):
         """ Returns smaller rules from rule """
         # A PFSense rule can have only one src or dst
         blocking = rule.action != 'pass'
 
-        sub_rules = []
         if len(rule.src) > 1 or len(rule.dst) > 1:
-            for src in rule.src:
-                for dst in rule.dst:
-                    new_rule = deepcopy(rule)
-                    new_rule.src = [src]
-                    new_rule.dst = [dst]
-                    sub_rules.append(new_rule)
-
-            return sub_rules
+            return list(self.product_rules(rule))
 
         if len(rule.src) != 1 or len(rule.dst) != 1:
             raise AssertionError()
@@ -2172,18 +2711,26 @@ class PFSenseRuleDecomposer(object):
 
         return sub_rules
 
-    def decompose_rules(self):
-        """ Returns smaller rules (more suited to pfsense logic ) """
-        for rule in self._data.rules_obj.values():
-            todo = []
-            todo.append(rule)
-            while todo:
-                obj = todo.pop()
-                res = self.decompose_rule(obj)
-                if not res:
-                    rule.sub_rules.append(obj)
-                else:
-                    todo.extend(res)
+    def decompose_rules(self, rule):
+        """ Yields smaller rules from rule (more suited to pfsense logic )
+            rules are generated one at a time, the product of sources and destinations is never built """
+        todo = [iter([rule])]
+        while todo:
+            obj = next(todo[-1], None)
+            if obj is None:
+                todo.pop()
+                continue
+
+            # the last generated rules are processed first
+            if len(obj.src) > 1 or len(obj.dst) > 1:
+                todo.append(self.product_rules(obj, reverse=True))
+                continue
+
+            res = self.decompose_rule(obj)
+            if not res:
+                yield obj
+            else:
+                todo.append(reversed(res))
 
 
 class PFSenseAliasFactory(object):
@@ -2191,29 +2738,43 @@ class PFSenseAliasFactory(object):
 
     def __init__(self, data):
         self._data = data
+        self.collapsed_entries = 0
+
+    @staticmethod
+    def collapse_addresses(addresses):
+        """ return addresses with adjacent and overlapping ips and networks merged
+            aliases names are kept first, followed by IPv4 and IPv6 networks """
+        ret = []
+        networks = {4: [], 6: []}
+        for address in addresses:
+            try:
+                network = to_ip_network(to_unicode(address))
+            except ValueError:
+                ret.append(address)
+                continue
+            networks[network.version].append(network)
+
+        for version in [4, 6]:
+            for network in ipaddress.collapse_addresses(networks[version]):
+                if network.num_addresses == 1:
+                    ret.append(str(network.network_address))
+                else:
+                    ret.append(str(network))
+        return ret
 
     def add_host_alias_rec(self, alias, aliases):
         """ set aliases hosts names to define (recursive) """
         if ':' in alias.name:
             return
 
-        name = alias.name
-        aliases[name] = self._data.all_aliases[name]
-        for target in alias.definition:
-            obj = self._data.hosts_aliases_obj[target]
-            if obj.fake:
-                continue
-            self.add_host_alias_rec(obj, aliases)
+        for name in self._data.get_host_alias_members(alias):
+            aliases[name] = self._data.all_aliases[name]
 
     def add_port_alias_rec(self, alias, aliases):
         """ Return aliases ports names to define (recursive) """
-        if alias in self._data.all_aliases:
-            if alias not in aliases:
-                aliases[alias] = self._data.all_aliases[alias]
-
-            if 'port' in aliases[alias]:
-                for port in aliases[alias]['port'].split():
-                    self.add_port_alias_rec(port, aliases)
+        for name in self._data.get_port_alias_members(alias):
+            if name not in aliases:
+                aliases[name] = self._data.all_aliases[name]
 
     def add_hosts_aliases(self, rule, aliases):
         """ Return aliases hosts names to define """
@@ -2234,6 +2795,7 @@ class PFSenseAliasFactory(object):
     def generate_aliases(self, rule_filter=None):
         """ Return aliases definitions for pfsense_aggregate """
 
+        started = self._data.profiler.start()
         hosts_aliases = {}
         ports_aliases = {}
 
@@ -2247,11 +2809,18 @@ class PFSenseAliasFactory(object):
                 self.add_ports_aliases(subrule, ports_aliases)
 
         ret = []
+        self.collapsed_entries = 0
         for name, alias in hosts_aliases.items():
             definition = {}
             definition['name'] = name
             definition['type'] = alias['type']
             definition['address'] = ' '.join(alias['ip'].split())
+            if self._data.collapse and alias['type'] == 'network':
+                addresses = alias['ip'].split()
+                collapsed = self.collapse_addresses(addresses)
+                if len(collapsed) < len(addresses):
+                    self.collapsed_entries += len(addresses) - len(collapsed)
+                    definition['address'] = ' '.join(collapsed)
             definition['state'] = 'present'
             if 'descr' in alias:
                 definition['descr'] = alias['descr']
@@ -2264,7 +2833,10 @@ class PFSenseAliasFactory(object):
             definition = {}
             definition['name'] = name
             definition['type'] = 'port'
-            definition['address'] = ' '.join(alias['port'].replace('-', ':').split())
+            if self._data.compact_ports:
+                definition['address'] = ' '.join(merge_ports(alias['port'].split())).replace('-', ':')
+            else:
+                definition['address'] = ' '.join(alias['port'].replace('-', ':').split())
             definition['state'] = 'present'
             if 'descr' in alias:
                 definition['descr'] = alias['descr']
@@ -2273,6 +2845,10 @@ class PFSenseAliasFactory(object):
             definition['detail'] = ''
             ret.append(definition)
 
+        if self._data.collapse:
+            display.v('Collapsing network aliases saved {0} entries'.format(self.collapsed_entries))
+
+        self._data.profiler.stop('generate aliases', started, len(ret))
         return ret
 
     @staticmethod
@@ -2310,13 +2886,142 @@ class PFSenseAliasFactory(object):
         print('\n'.join(definitions))
 
 
+class PFSenseRuleCache(object):
+    """ Class persisting, for each rule, the subrules required on the target with the hash of all their inputs
+        (rule, separators, host and port aliases, target interfaces) so only the modified rules are decomposed again """
+
+    VERSION = 1
+
+    def __init__(self, data, cache_dir):
+        self._data = data
+        self._filename = os.path.join(cache_dir, '{0}.json'.format(data.target_name))
+        self._rules = {}
+        self._hashes = {}
+        self._aliases_hashes = {}
+        self._base_hash = None
+        self.reused = 0
+        self.compiled = 0
+
+        try:
+            os.makedirs(cache_dir)
+        except OSError as exception:
+            if exception.errno != errno.EEXIST or not os.path.isdir(cache_dir):
+                raise
+
+        if os.path.exists(self._filename):
+            try:
+                with open(self._filename, 'r') as f:
+                    cache = json.load(f)
+                if cache.get('version') == self.VERSION:
+                    self._rules = cache['rules']
+            except ValueError:
+                display.warning("Ignoring invalid rules cache file {0}".format(self._filename))
+
+    @staticmethod
+    def _hash(value):
+        """ return the hash of a json serializable value """
+        return hashlib.sha1(json.dumps(value, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+    def _get_base_hash(self):
+        """ return the hash of the inputs shared by all rules: plugin code, options and pfsenses interfaces """
+        if self._base_hash is None:
+            with open(__file__, 'rb') as f:
+                code_hash = hashlib.sha1(f.read()).hexdigest()
+
+            interfaces = []
+            for pfsense_name in sorted(self._data.pfsenses_obj):
+                pfsense = self._data.pfsenses_obj[pfsense_name]
+                for name in sorted(pfsense.interfaces):
+                    interface = pfsense.interfaces[name]
+                    interfaces.append([
+                        pfsense_name, name, str(interface.local_ip), str(interface.local_network), sorted(str(ip) for ip in interface.local_ips),
+                        sorted(str(net) for net in interface.local_networks), sorted(str(net) for net in interface.remote_networks),
+                        sorted(str(net) for net in interface.adjacent_networks), interface.bridge, sorted(interface.tags)])
+
+            self._base_hash = self._hash([self.VERSION, code_hash, self._data.aggregate, self._data.target_name, interfaces])
+        return self._base_hash
+
+    def _get_alias_hash(self, name):
+        """ return the hash of an host alias and of all the aliases nested in it, with their names """
+        res = self._aliases_hashes.get(name)
+        if res is None:
+            obj = self._data.hosts_aliases_obj[name]
+            childs_hashes = []
+            childs = set()
+            for child in obj.definition:
+                if child != name and child in self._data.hosts_aliases_obj:
+                    (child_hash, child_childs) = self._get_alias_hash(child)
+                    childs_hashes.append(child_hash)
+                    childs.add(child)
+                    childs.update(child_childs)
+
+            alias_hash = self._hash([
+                name, self._data.all_aliases.get(name), obj.fake, sorted(str(ip) for ip in obj.ips), sorted(str(net) for net in obj.networks), childs_hashes])
+            res = (alias_hash, frozenset(childs))
+            self._aliases_hashes[name] = res
+        return res
+
+    def _get_rule_hash(self, rule):
+        """ return the hash of all the inputs of a rule, and the aliases it depends on """
+        separators = []
+        separator = rule.separator
+        while separator is not None:
+            separators.append([separator.name, separator.options])
+            separator = separator.parent
+
+        aliases_hashes = []
+        aliases = set()
+        for alias in rule.src + rule.dst + rule.src_nat + rule.dst_nat:
+            (alias_hash, childs) = self._get_alias_hash(alias.name)
+            aliases_hashes.append(alias_hash)
+            aliases.add(alias.name)
+            aliases.update(childs)
+
+        ports = OrderedDict()
+        for port in rule.src_port + rule.dst_port:
+            for name in self._data.get_port_alias_members(port):
+                ports[name] = self._data.all_aliases[name]
+
+        rule_hash = self._hash([
+            self._get_base_hash(), rule.name, rule.action, rule.protocol, rule.src_port, rule.dst_port, rule.dst_nat_port, rule.options,
+            rule.floating, rule.force, rule.asymmetric, rule.invert_src, rule.invert_dst, separators, aliases_hashes, ports])
+        return (rule_hash, sorted(aliases), list(ports.keys()))
+
+    def get(self, rule):
+        """ return the cached subrules of rule, or None if its inputs changed """
+        if rule.name not in self._hashes:
+            self._hashes[rule.name] = self._get_rule_hash(rule)
+
+        entry = self._rules.get(rule.name)
+        if entry is None or entry['hash'] != self._hashes[rule.name][0]:
+            self.compiled += 1
+            return None
+
+        self.reused += 1
+        return entry['subrules']
+
+    def set(self, rule, subrules):
+        """ set the subrules of rule, with the hash and the dependencies of the rule """
+        (rule_hash, aliases, ports) = self._hashes[rule.name]
+        self._rules[rule.name] = dict(hash=rule_hash, pfsense=self._data.target_name, aliases=aliases, ports=ports, subrules=subrules)
+
+    def save(self):
+        """ write the cache, removing the rules which are not defined anymore """
+        for name in list(self._rules.keys()):
+            if name not in self._data.rules_obj:
+                del self._rules[name]
+
+        write_file_atomically(self._filename, lambda f: json.dump(dict(version=self.VERSION, rules=self._rules), f))
+
+
 class PFSenseRuleFactory(object):
     """ Class generating rules definitions """
 
-    def __init__(self, data, display_warnings=True):
+    def __init__(self, data, display_warnings=True, cache=None):
         self._data = data
         self._decomposer = PFSenseRuleDecomposer(data)
         self._display_warnings = display_warnings
+        self._cache = cache
 
     def rule_interfaces_any(self, rule_obj):
         """ Return interfaces set on which the rule is needed to be defined
@@ -2395,21 +3100,28 @@ class PFSenseRuleFactory(object):
 
         return dst.local_interfaces[self._data.target.name]
 
-    def rule_interfaces(self, rule_obj):
-        """ Return interfaces list on which the rule is needed to be defined """
-        def filter_interfaces(interfaces):
-            if interface_filter is not None:
-                return interface_filter & interfaces
-            return interfaces
-
+    def is_filtered(self, rule_obj):
+        """ Return True if the rule filter or efilter exclude the target """
         # if the rule has a filter, apply it
         rule_filter = rule_obj.get_option('filter')
         if rule_filter and self._data.target.name not in rule_filter.split():
-            return set()
+            return True
 
         # if the rule has a efilter, apply it
         rule_efilter = rule_obj.get_option('efilter')
         if rule_efilter and self._data.target.name in rule_efilter.split():
+            return True
+
+        return False
+
+    def rule_interfaces(self, rule_obj):
+        """ Return interfaces list on which the rule is needed to be defined """
+        def filter_interfaces(interfaces):
+            if interface_filter is not None:
+                return interface_filter & interfaces
+            return interfaces
+
+        if self.is_filtered(rule_obj):
             return set()
 
         interface_filter = rule_obj.get_option('ifilter')
@@ -2644,6 +3356,10 @@ class PFSenseRuleFactory(object):
         if rule_obj.protocol:
             rule['protocol'] = ' '.join(rule_obj.protocol)
 
+        if self._data.compact_ports:
+            rule_obj.src_port = merge_ports(rule_obj.src_port)
+            rule_obj.dst_port = merge_ports(rule_obj.dst_port)
+
         if self._data.aggregate:
             if rule_obj.src_port:
                 if len(rule_obj.src_port) == 1:
@@ -2707,21 +3423,34 @@ class PFSenseRuleFactory(object):
                             _gen_rule_dict(rule_def, rule_name, interface)
                         rule_idx = rule_idx + 1
 
-    def aggregate_subrules(self, rule, interfaces, subrules, sub_interfaces):
-        """ aggregate generated subrules """
-        def _get_same_rule(new_rules, src, dst):
-            for rule in new_rules:
-                if rule.src[0].name == src.name and rule.dst[0].name == dst.name:
-                    return rule
-            return None
-
-        def _add_list(group, objs):
-            for obj in objs:
-                group.add(obj)
+    def aggregate_subrules(self, rule, interfaces, subrules, sub_interfaces, specs=None):
+        """ aggregate generated subrules
+            if specs is a dict, the way each aggregated subrule src and dst were built is set in it """
+        def _get_spec(alias, base, group_name, group_ip, group_net):
+            if len(group_name) != 1:
+                return dict(hosts=sorted(group_name), ips=sorted(str(ip) for ip in group_ip), networks=sorted(str(net) for net in group_net))
+            return dict(name=alias.name, base=base.name)
 
-        def _aggregate_job(interface=None):
+        def _get_groups(subrules):
+            src_group_name = set()
+            dst_group_name = set()
+            src_group_ip = set()
+            dst_group_ip = set()
+            src_group_net = set()
+            dst_group_net = set()
+            for subrule in subrules:
+                src_group_name.add(subrule.src[0].name)
+                dst_group_name.add(subrule.dst[0].name)
+                src_group_ip.update(subrule.src[0].ips)
+                src_group_net.update(subrule.src[0].networks)
+                dst_group_ip.update(subrule.dst[0].ips)
+                dst_group_net.update(subrule.dst[0].networks)
+            return (src_group_name, src_group_ip, src_group_net, dst_group_name, dst_group_ip, dst_group_net)
+
+        def _aggregate_job(groups, subrule, interface=None):
             # we create fake alias when required
             # we also use interfaces IP and NET when possible
+            (src_group_name, src_group_ip, src_group_net, dst_group_name, dst_group_ip, dst_group_net) = groups
             src = subrule.src[0]
             dst = subrule.dst[0]
             if len(src_group_name) != 1:
@@ -2751,13 +3480,17 @@ class PFSenseRuleFactory(object):
                 dst.name = "IP:{0}".format(interface)
 
             # when aggregating, we merge rules with same src/dst
-            existing_rule = _get_same_rule(new_rules, src, dst)
+            key = (src.name, dst.name)
+            existing_rule = new_rules.get(key)
             if existing_rule is None:
+                if specs is not None:
+                    specs[key] = (_get_spec(src, subrule.src[0], src_group_name, src_group_ip, src_group_net),
+                                  _get_spec(dst, subrule.dst[0], dst_group_name, dst_group_ip, dst_group_net))
                 existing_rule = copy(subrule)
                 existing_rule.src[0] = src
                 existing_rule.dst[0] = dst
                 existing_rule.interfaces = set()
-                new_rules.append(existing_rule)
+                new_rules[key] = existing_rule
 
             if rule.floating:
                 for sub_interface in sub_interfaces:
@@ -2770,46 +3503,79 @@ class PFSenseRuleFactory(object):
                 if interface not in interfaces:
                     interfaces[interface] = []
 
-        new_rules = list()
+        new_rules = OrderedDict()
         if rule.floating:
-            src_group_name = set()
-            dst_group_name = set()
-            src_group_ip = set()
-            dst_group_ip = set()
-            src_group_net = set()
-            dst_group_net = set()
-            subrule = None
+            all_subrules = []
             for interface in sorted(sub_interfaces):
-                for subrule in sub_interfaces[interface]:
-                    src_group_name.add(subrule.src[0].name)
-                    dst_group_name.add(subrule.dst[0].name)
-                    _add_list(src_group_ip, subrule.src[0].ips)
-                    _add_list(src_group_net, subrule.src[0].networks)
-                    _add_list(dst_group_ip, subrule.dst[0].ips)
-                    _add_list(dst_group_net, subrule.dst[0].networks)
-            _aggregate_job()
+                all_subrules.extend(sub_interfaces[interface])
+            _aggregate_job(_get_groups(all_subrules), all_subrules[-1])
         else:
             for interface in sorted(sub_interfaces):
-                src_group_name = set()
-                dst_group_name = set()
-                src_group_ip = set()
-                dst_group_ip = set()
-                src_group_net = set()
-                dst_group_net = set()
-                subrule = None
-                for subrule in sub_interfaces[interface]:
-                    src_group_name.add(subrule.src[0].name)
-                    dst_group_name.add(subrule.dst[0].name)
-                    _add_list(src_group_ip, subrule.src[0].ips)
-                    _add_list(src_group_net, subrule.src[0].networks)
-                    _add_list(dst_group_ip, subrule.dst[0].ips)
-                    _add_list(dst_group_net, subrule.dst[0].networks)
-                _aggregate_job(interface)
+                _aggregate_job(_get_groups(sub_interfaces[interface]), sub_interfaces[interface][-1], interface)
 
         if rule.floating and 'floating' not in interfaces:
             interfaces['floating'] = []
 
-        subrules.extend(new_rules)
+        subrules.extend(new_rules.values())
+
+    def guess_sub_rules(self, rule):
+        """ Yields the subrules of rule required on the target, with their interfaces set """
+        # subrules inherit the filters of their rule
+        if self.is_filtered(rule):
+            return
+
+        profiler = self._data.profiler
+        subrules = self._decomposer.decompose_rules(rule)
+        while True:
+            started = profiler.start()
+            subrule = next(subrules, None)
+            if subrule is None:
+                profiler.stop('decompose', started)
+                return
+
+            started = profiler.stop('decompose', started, 1)
+            subrule.interfaces = self.rule_interfaces(subrule)
+            profiler.stop('guess interfaces', started, 1 if subrule.interfaces else 0)
+            if subrule.interfaces:
+                yield subrule
+
+    def replay_sub_rules(self, rule, interfaces, records):
+        """ Return the subrules of rule rebuilt from the records of the rules cache """
+        aliases = {}
+
+        def _get_alias(spec):
+            if 'hosts' in spec:
+                ips = set(to_ip_address(ip) for ip in spec['ips'])
+                networks = set(to_ip_network(net) for net in spec['networks'])
+                return self._data.get_hosts_alias(set(spec['hosts']), ips, networks, rule.name)
+
+            alias = aliases.get(spec['base'])
+            if alias is None:
+                alias = self._data.hosts_aliases_obj[spec['base']]
+            if spec['name'] != alias.name:
+                alias = deepcopy(alias)
+                alias.name = spec['name']
+            aliases[alias.name] = alias
+            return alias
+
+        subrules = []
+        for record in records:
+            subrule = copy(rule)
+            subrule.src = [_get_alias(record['src'])]
+            subrule.dst = [_get_alias(record['dst'])]
+            subrule.interfaces = set(record['interfaces'])
+            subrule.sub_rules = []
+            subrule.generated_names = {}
+            subrules.append(subrule)
+
+            for interface in subrule.interfaces:
+                if interface not in interfaces:
+                    interfaces[interface] = []
+
+        if rule.floating and self._data.aggregate and subrules and 'floating' not in interfaces:
+            interfaces['floating'] = []
+
+        return subrules
 
     def guess_rules(self, rule_filter):
         """ Return interfaces, rules and rules names """
@@ -2819,15 +3585,29 @@ class PFSenseRuleFactory(object):
         for name, rule in self._data.rules_obj.items():
             subrules = []
             sub_interfaces = dict()
+            if rule_filter is not None and name != rule_filter:
+                continue
 
-            # for each subrule, we guess on which interfaces the subrule needs to be generated, if any
-            for subrule in sorted(rule.sub_rules, key=lambda x: x.src[0].name + x.dst[0].name):
-                subrule.interfaces = self.rule_interfaces(subrule)
-                if rule_filter is not None and name != rule_filter:
-                    continue
-                if not subrule.interfaces:
+            started = self._data.profiler.start()
+            if self._cache is not None:
+                records = self._cache.get(rule)
+                if records is not None:
+                    subrules = self.replay_sub_rules(rule, interfaces, records)
+                    if self._data.gendiff:
+                        rules.extend(subrules)
+                    else:
+                        for subrule in subrules:
+                            rules.append((name, subrule))
+                    rule.sub_rules = subrules
+                    self._data.profiler.stop_rule(name, started, len(subrules))
                     continue
 
+            specs = OrderedDict()
+            records = []
+
+            # for each subrule, we guess on which interfaces the subrule needs to be generated, if any
+            # the subrules which are not required are dropped as soon as they are generated
+            for subrule in sorted(self.guess_sub_rules(rule), key=lambda x: x.src[0].name + x.dst[0].name):
                 # when aggregating, we group the rules by interface for later
                 # otherwise, we add the subrule
                 if self._data.aggregate:
@@ -2837,13 +3617,22 @@ class PFSenseRuleFactory(object):
                         sub_interfaces[interface].append(subrule)
                 else:
                     subrules.append(subrule)
+                    specs[(subrule.src[0].name, subrule.dst[0].name, len(specs))] = (
+                        dict(name=subrule.src[0].name, base=subrule.src[0].name), dict(name=subrule.dst[0].name, base=subrule.dst[0].name))
                     for interface in subrule.interfaces:
                         if interface not in interfaces:
                             interfaces[interface] = []
 
             # let's aggregate
             if self._data.aggregate and sub_interfaces:
-                self.aggregate_subrules(rule, interfaces, subrules, sub_interfaces)
+                aggregation_started = self._data.profiler.start()
+                self.aggregate_subrules(rule, interfaces, subrules, sub_interfaces, specs)
+                self._data.profiler.stop('aggregation', aggregation_started, len(subrules))
+
+            if self._cache is not None:
+                for (src, dst), subrule in zip(specs.values(), subrules):
+                    records.append(dict(src=src, dst=dst, interfaces=sorted(subrule.interfaces)))
+                self._cache.set(rule, records)
 
             if self._data.gendiff:
                 rules.extend(subrules)
@@ -2853,6 +3642,7 @@ class PFSenseRuleFactory(object):
 
             # we only keep the subrules having interfaces
             rule.sub_rules = subrules
+            self._data.profiler.stop_rule(name, started, len(subrules))
 
         return (interfaces, rules)
 
@@ -2866,10 +3656,13 @@ class PFSenseRuleFactory(object):
         dst_nat_rules = []
 
         # first, we break rules in small parts (one src, one dst)
-        self._decomposer.decompose_rules()
-
-        # then, we guess the rules which are required on the target
+        # and guess the ones which are required on the target
+        started = self._data.profiler.start()
         (interfaces, rules) = self.guess_rules(rule_filter)
+        if self._cache is not None:
+            self._cache.save()
+            display.v('Rules cache: {0} rules reused, {1} rules compiled'.format(self._cache.reused, self._cache.compiled))
+        started = self._data.profiler.stop('guess rules', started, len(rules))
 
         # last, we generate each required rule
         last_name = dict()
@@ -2879,6 +3672,7 @@ class PFSenseRuleFactory(object):
         else:
             for (name, rule) in rules:
                 self.generate_rule(name, rule, interfaces, last_name)
+        self._data.profiler.stop('generate rules', started, sum(len(definitions) for definitions in interfaces.values()))
 
         # since nat is not separated by interface, we manage the order here
         last_src_nat = 'top'
@@ -3040,6 +3834,7 @@ class PFSenseRuleSeparatorFactory(object):
     def generate_rule_separators(self, rule_filter=None):
         """ Return rule_separators definitions for pfsense_aggregate """
 
+        started = self._data.profiler.start()
         separators = OrderedDict()
 
         for name, rule in self._data.rules_obj.items():
@@ -3073,6 +3868,7 @@ class PFSenseRuleSeparatorFactory(object):
             definition['state'] = 'present'
             ret.append(definition)
 
+        self._data.profiler.stop('generate rule separators', started, len(ret))
         return ret
 
     def output_rule_separators(self, separators):
@@ -3097,6 +3893,112 @@ class PFSenseRuleSeparatorFactory(object):
         print('\n'.join(definitions))
 
 
+class PFSenseArtifact(object):
+    """ Class reading and writing compiled definitions artifacts
+
+        An artifact is a gzip compressed file of json lines. The first line is a header holding the format version,
+        the files included by the definitions file and the hash of the inputs, each other line holds one definition
+        of one pfsense:
+        {"pfsense": "pf_name", "type": "rules", "definition": {...}}
+        so CI can compile the definitions once and deploy jobs only load the compiled result """
+
+    FORMAT = 'pfsense-definitions'
+    VERSION = 2
+    TYPES = ['aliases', 'rules', 'rule_separators', 'nat_outbounds', 'nat_port_forwards']
+
+    def __init__(self, filename):
+        self._filename = filename
+
+    @staticmethod
+    def get_includes(from_file, included):
+        """ return the paths of the included files, relative to the directory of the definitions file """
+        root = os.path.dirname(os.path.abspath(from_file))
+        return sorted(os.path.relpath(filename, root) for filename in included)
+
+    @staticmethod
+    def get_input_hash(from_file, options, includes=()):
+        """ return the hash of the definitions file, of the files it includes and of the options used to compile it """
+        sha1 = hashlib.sha1()
+        with open(from_file, 'rb') as f:
+            sha1.update(f.read())
+
+        root = os.path.dirname(os.path.abspath(from_file))
+        for include in includes:
+            sha1.update(include.encode('utf-8') + b'\0')
+            try:
+                with open(os.path.join(root, include), 'rb') as f:
+                    sha1.update(f.read())
+            except (IOError, OSError):
+                sha1.update(b'\0missing')
+        sha1.update(json.dumps(options, sort_keys=True).encode('utf-8'))
+        return sha1.hexdigest()
+
+    def _read_lines(self):
+        """ yields the header and then the definitions lines of the artifact """
+        with gzip.open(self._filename, 'rb') as f:
+            for line in f:
+                yield json.loads(line.decode('utf-8'), object_pairs_hook=OrderedDict)
+
+    def read_header(self):
+        """ return the artifact header, checking its format """
+        header = next(self._read_lines(), None)
+        if header is None or header.get('format') != self.FORMAT:
+            raise AnsibleError("{0} is not a pfsense definitions artifact".format(self._filename))
+        if header.get('version') != self.VERSION:
+            raise AnsibleError("Unsupported version {0} of pfsense definitions artifact {1} (expected {2})".format(
+                header.get('version'), self._filename, self.VERSION))
+        return header
+
+    def read(self, pfsense, input_hash=None):
+        """ return the definitions of pfsense, by type
+            if input_hash is set, the artifact must have been compiled from the same inputs """
+        header = self.read_header()
+        if input_hash is not None and header['input_hash'] != input_hash:
+            raise AnsibleError("{0} has not been compiled from the current definitions".format(self._filename))
+        if pfsense not in header['pfsenses']:
+            raise AnsibleError("No definitions for {0} in {1}".format(pfsense, self._filename))
+
+        definitions = OrderedDict((name, []) for name in self.TYPES)
+        lines = self._read_lines()
+        next(lines)
+        for line in lines:
+            if line['pfsense'] == pfsense:
+                definitions[line['type']].append(line['definition'])
+        return definitions
+
+    def write(self, pfsense, input_hash, definitions, includes=()):
+        """ write the definitions of pfsense, by type
+            the definitions of the other pfsenses compiled from the same inputs are kept """
+        pfsenses = [pfsense]
+        lines = []
+        if os.path.exists(self._filename):
+            try:
+                header = self.read_header()
+            except AnsibleError:
+                header = None
+
+            if header is not None and header['input_hash'] == input_hash:
+                pfsenses = [name for name in header['pfsenses'] if name != pfsense] + pfsenses
+                lines = self._read_lines()
+                next(lines)
+                lines = [line for line in lines if line['pfsense'] != pfsense]
+
+        def write_lines(fileobj):
+            """ write the header and the definitions lines """
+            with gzip.GzipFile(filename=os.path.basename(self._filename), mode='wb', fileobj=fileobj) as f:
+                header = OrderedDict([
+                    ('format', self.FORMAT), ('version', self.VERSION), ('input_hash', input_hash), ('includes', list(includes)), ('pfsenses', pfsenses)])
+                f.write((json.dumps(header) + '\n').encode('utf-8'))
+                for line in lines:
+                    f.write((json.dumps(line) + '\n').encode('utf-8'))
+                for name in self.TYPES:
+                    for definition in definitions[name]:
+                        line = OrderedDict([('pfsense', pfsense), ('type', name), ('definition', definition)])
+                        f.write((json.dumps(line) + '\n').encode('utf-8'))
+
+        write_file_atomically(self._filename, write_lines, mode='wb')
+
+
 class LookupModule(LookupBase):
     """ Lookup module generating pfsense definitions """
 
@@ -3110,9 +4012,13 @@ class LookupModule(LookupBase):
         """ Just for easier mock """
         return ordered_load(open(from_file), yaml.SafeLoader)
 
-    def load_data(self, from_file):
+    def load_data(self, from_file, resolver=None, collapse=False, content_names=False, compact_ports=False, profiler=None):
         """ Load and return pfsense data """
+        if profiler is None:
+            profiler = PFSenseProfiler()
+        started = profiler.start()
         fvars = self.get_definitions(from_file)
+        profiler.stop('load', started)
         if fvars is None:
             raise AnsibleError("No usable data found in {0}".format(from_file))
 
@@ -3125,46 +4031,98 @@ class LookupModule(LookupBase):
             ports_aliases=fvars['ports_aliases'],
             pfsenses=fvars['pfsenses'],
             rules=fvars['rules'],
-            target_name=self.get_hostname()
+            target_name=self.get_hostname(),
+            resolver=resolver,
+            collapse=collapse,
+            content_names=content_names,
+            compact_ports=compact_ports,
+            profiler=profiler,
         )
         return data
 
+    @staticmethod
+    def get_options(kwargs):
+        """ return the options changing the generated definitions """
+        return dict(
+            aggregate=True,
+            gendiff=False,
+            collapse=bool(kwargs.get('collapse_aliases', False)),
+            content_names=bool(kwargs.get('content_names', False)),
+            compact_ports=bool(kwargs.get('compact_ports', False)),
+        )
+
+    def load_artifact(self, from_file, artifact, kwargs):
+        """ Load and return the definitions precompiled in artifact
+            when the definitions file is available, the artifact must have been compiled from it """
+        artifact = PFSenseArtifact(artifact)
+        input_hash = None
+        if os.path.exists(from_file):
+            includes = artifact.read_header().get('includes', [])
+            input_hash = PFSenseArtifact.get_input_hash(from_file, self.get_options(kwargs), includes)
+        return artifact.read(self.get_hostname(), input_hash)
+
+    def compile_definitions(self, from_file, display_warnings, kwargs):
+        """ Load data and return the generated definitions
+            with PFSENSE_LOOKUP_PROFILE set, the compilation phases timings are displayed """
+        profiler = PFSenseProfiler.from_environment()
+        profiler.begin()
+        try:
+            resolver = PFSenseHostnameResolver(
+                workers=int(kwargs.get('dns_workers', 10)),
+                cache_file=kwargs.get('dns_cache'),
+                cache_ttl=int(kwargs.get('dns_cache_ttl', 3600)),
+                hosts_file=kwargs.get('dns_hosts_file'),
+            )
+            data = self.load_data(
+                from_file,
+                resolver,
+                collapse=kwargs.get('collapse_aliases', False),
+                content_names=kwargs.get('content_names', False),
+                compact_ports=kwargs.get('compact_ports', False),
+                profiler=profiler,
+            )
+
+            parser = PFSenseDataParser(data)
+            if not parser.parse():
+                raise AnsibleError("Error checking pfsense data")
+
+            rule_cache = None
+            if kwargs.get('cache_dir'):
+                rule_cache = PFSenseRuleCache(data, kwargs['cache_dir'])
+
+            alias_factory = PFSenseAliasFactory(data)
+            rule_factory = PFSenseRuleFactory(data, display_warnings=display_warnings, cache=rule_cache)
+            rule_separator_factory = PFSenseRuleSeparatorFactory(data)
+
+            definitions = {}
+            (definitions['rules'], definitions['nat_outbounds'], definitions['nat_port_forwards']) = rule_factory.generate_rules()
+            definitions['rule_separators'] = rule_separator_factory.generate_rule_separators()
+            definitions['aliases'] = alias_factory.generate_aliases()
+        finally:
+            profiler.end()
+
+        if profiler.enabled:
+            display.display('Compilation profile of {0}:'.format(data.target_name))
+            for line in profiler.report():
+                display.display(line)
+        return definitions
+
     def _run(self, terms, variables, **kwargs):
         """ Main function """
         if len(terms) != 2:
             raise AnsibleError("pfsense lookup requires a filename and another parameter in [aliases, rules, rule_separators, all_definitions]")
 
-        data = self.load_data(terms[0])
-
-        parser = PFSenseDataParser(data)
-        if not parser.parse():
-            raise AnsibleError("Error checking pfsense data")
-
-        alias_factory = PFSenseAliasFactory(data)
-        rule_factory = PFSenseRuleFactory(data, display_warnings=(terms[1] == 'rules'))
-        rule_separator_factory = PFSenseRuleSeparatorFactory(data)
-
-        (rules, src_nat_rules, dst_nat_rules) = rule_factory.generate_rules()
-        rule_separators = rule_separator_factory.generate_rule_separators()
-        aliases = alias_factory.generate_aliases()
-
-        if terms[1] == 'aliases':
-            return [aliases]
-        elif terms[1] == 'rules':
-            return [rules]
-        elif terms[1] == 'nat_outbounds':
-            return [src_nat_rules]
-        elif terms[1] == 'nat_port_forwards':
-            return [dst_nat_rules]
-        elif terms[1] == 'rule_separators':
-            return [rule_separators]
+        if kwargs.get('artifact'):
+            definitions = self.load_artifact(terms[0], kwargs['artifact'], kwargs)
+        else:
+            definitions = self.compile_definitions(terms[0], terms[1] == 'rules', kwargs)
+
+        if terms[1] in PFSenseArtifact.TYPES:
+            return [definitions[terms[1]]]
         elif terms[1] == 'all_definitions':
             res = {}
-            res['aggregated_aliases'] = aliases
-            res['aggregated_rules'] = rules
-            res['aggregated_rule_separators'] = rule_separators
-            res['aggregated_nat_outbounds'] = src_nat_rules
-            res['aggregated_nat_port_forwards'] = dst_nat_rules
+            for name in PFSenseArtifact.TYPES:
+                res['aggregated_' + name] = definitions[name]
             return [res]
 
         return []
@@ -3223,23 +4181,18 @@ def unit_test_helper(filename, pfname):
     return (aliases, rules)
 
 
-def main():
-    """ Output debug helper """
-    parser = argparse.ArgumentParser()
-    parser.add_argument("file", help="input file")
-    parser.add_argument("pfsense", help="target_fw")
-    parser.add_argument('filter', help="rule_name", nargs='?')
-    parser.add_argument("-a", "--dont-aggregate", action="store_false", help="dont generate aliases to aggregate rules")
-    parser.add_argument("-g", "--gendiff", action="store_true", help="output more suitable for diffs (debbuging)")
-    parser.add_argument("-d", "--debug-rule", action="store", help="debug rule")
-    args = parser.parse_args()
-
+def compile_main(args, profiler):
+    """ compile and output the definitions of the command line arguments
+        return False if the definitions are not valid """
     rule_filter = None
     if args.filter:
         rule_filter = args.filter
 
     print('Loading data...')
-    fvars = ordered_load(open(args.file), yaml.SafeLoader)
+    started = profiler.start()
+    included = set()
+    fvars = ordered_load(open(args.file), yaml.SafeLoader, included=included)
+    profiler.stop('load', started)
 
     data = PFSenseData(
         hosts_aliases=fvars['hosts_aliases'],
@@ -3250,19 +4203,36 @@ def main():
         gendiff=args.gendiff,
         debug=args.debug_rule,
         aggregate=args.dont_aggregate,
+        collapse=args.collapse_aliases,
+        content_names=args.content_names,
+        compact_ports=args.compact_ports,
+        resolver=PFSenseHostnameResolver(
+            workers=args.dns_workers,
+            cache_file=args.dns_cache,
+            cache_ttl=args.dns_cache_ttl,
+            hosts_file=args.dns_hosts_file,
+        ),
+        profiler=profiler,
     )
 
     parser = PFSenseDataParser(data)
     print('Parsing data...')
     if not parser.parse():
-        return
+        return False
+
+    # the cache is bypassed when debugging since the debugged rule would not be decomposed again
+    rule_cache = None
+    if args.cache_dir and not args.debug_rule:
+        rule_cache = PFSenseRuleCache(data, args.cache_dir)
 
     alias_factory = PFSenseAliasFactory(data)
-    rule_factory = PFSenseRuleFactory(data)
+    rule_factory = PFSenseRuleFactory(data, cache=rule_cache)
     rule_separator_factory = PFSenseRuleSeparatorFactory(data)
 
     print('Generating rules...')
     (rules, src_nat_rules, dst_nat_rules) = rule_factory.generate_rules(rule_filter)
+    if rule_cache is not None:
+        print('Rules cache: {0} rules reused, {1} rules compiled'.format(rule_cache.reused, rule_cache.compiled))
 
     if rule_filter is None:
         print('Generating rule separators...')
@@ -3272,6 +4242,25 @@ def main():
 
     print('Generating aliases...')
     aliases = alias_factory.generate_aliases(rule_filter)
+    if args.collapse_aliases:
+        print('Collapsing network aliases saved {0} entries'.format(alias_factory.collapsed_entries))
+
+    if args.artifact:
+        if rule_filter is None:
+            print('Writing artifact...')
+            options = dict(
+                aggregate=args.dont_aggregate,
+                gendiff=args.gendiff,
+                collapse=args.collapse_aliases,
+                content_names=args.content_names,
+                compact_ports=args.compact_ports,
+            )
+            definitions = dict(aliases=aliases, rules=rules, rule_separators=rule_separators, nat_outbounds=src_nat_rules, nat_port_forwards=dst_nat_rules)
+            includes = PFSenseArtifact.get_includes(args.file, included)
+            input_hash = PFSenseArtifact.get_input_hash(args.file, options, includes)
+            PFSenseArtifact(args.artifact).write(args.pfsense, input_hash, definitions, includes)
+        else:
+            print('Filter set. Skipping artifact...')
 
     alias_factory.output_aliases(aliases)
     rule_factory.output_rules(rules)
@@ -3279,6 +4268,44 @@ def main():
     rule_factory.output_dst_nat_rules(dst_nat_rules)
     if rule_filter is None:
         rule_separator_factory.output_rule_separators(rule_separators)
+    return True
+
+
+def main():
+    """ Output debug helper """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("file", help="input file")
+    parser.add_argument("pfsense", help="target_fw")
+    parser.add_argument('filter', help="rule_name", nargs='?')
+    parser.add_argument("-a", "--dont-aggregate", action="store_false", help="dont generate aliases to aggregate rules")
+    parser.add_argument("-g", "--gendiff", action="store_true", help="output more suitable for diffs (debbuging)")
+    parser.add_argument("-d", "--debug-rule", action="store", help="debug rule")
+    parser.add_argument("-c", "--collapse-aliases", action="store_true", help="merge adjacent and overlapping addresses of network aliases")
+    parser.add_argument("-n", "--content-names", action="store_true", help="name generated aliases after their content")
+    parser.add_argument("-p", "--compact-ports", action="store_true", help="merge adjacent and overlapping ports and ports ranges")
+    parser.add_argument("--dns-workers", action="store", type=int, default=10, help="maximum number of concurrent dns queries")
+    parser.add_argument("--dns-cache", action="store", help="dns cache file")
+    parser.add_argument("--dns-cache-ttl", action="store", type=int, default=3600, help="dns cache entries lifetime (seconds)")
+    parser.add_argument("--dns-hosts-file", action="store", help="hosts file overriding dns resolution")
+    parser.add_argument("--cache-dir", action="store", help="directory of the rules cache (only modified rules are decomposed again)")
+    parser.add_argument("-o", "--artifact", action="store", help="write the compiled definitions into this artifact file")
+    parser.add_argument("--profile", action="store_true", help="display the timings and objects counts of each compilation phase")
+    parser.add_argument("--profile-dump", action="store", help="write a cProfile dump of the compilation into this file")
+    args = parser.parse_args()
+
+    if args.profile or args.profile_dump:
+        profiler = PFSenseProfiler(args.profile, args.profile_dump)
+    else:
+        profiler = PFSenseProfiler.from_environment()
+    profiler.begin()
+    try:
+        if not compile_main(args, profiler):
+            return
+    finally:
+        profiler.end()
+
+    if profiler.enabled:
+        print('\n'.join(profiler.report()))
 
 
 if __name__ == '__main__':
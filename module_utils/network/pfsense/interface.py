@@ -40,6 +40,25 @@ INTERFACE_REQUIRED_IF = [
 
 INTERFACE_MUTUALLY_EXCLUSIVE = [['interface', 'interface_descr']]
 
+# classes of the interface fields changes, the fields not listed here are addressing changes:
+# - cosmetic changes only need the config to be saved (the descr is an addressing change on interfaces with a dynamic
+#   address, since their gateways are named after it)
+# - filter changes only need the filter to be reloaded
+# - link changes need the interface to be reconfigured
+# - enable and addressing changes (like creations and deletions) need the interface to be brought down and
+#   the services depending on the interfaces addresses (gateways monitoring, snmp, static routes, rrd) to be reloaded
+INTERFACE_CHANGE_CLASSES = dict(
+    descr='cosmetic',
+    blockpriv='filter',
+    blockbogons='filter',
+    mss='filter',
+    mtu='link',
+    media='link',
+    mediaopt='link',
+    enable='enable',
+)
+INTERFACE_RELOAD_CHANGES = set(['create', 'remove', 'enable', 'addressing'])
+
 
 class PFSenseInterfaceModule(PFSenseModuleBase):
     """ module managing pfsense interfaces """
@@ -59,6 +78,7 @@ class PFSenseInterfaceModule(PFSenseModuleBase):
 
         self.root_elt = self.pfsense.interfaces
         self.setup_interface_cmds = ""
+        self.interface_changes = set()
 
     ##############################
     # params processing
@@ -205,6 +225,7 @@ class PFSenseInterfaceModule(PFSenseModuleBase):
         """ create the XML target_elt """
         self.pfsense.copy_dict_to_element(self.obj, self.target_elt)
         self.setup_interface_cmds += "interface_configure('{0}', true);\n".format(self.target_elt.tag)
+        self.interface_changes.add('create')
 
     def _copy_and_update_target(self):
         """ update the XML target_elt """
@@ -214,14 +235,36 @@ class PFSenseInterfaceModule(PFSenseModuleBase):
             changed = True
 
         if changed:
-            if self.params['enable']:
+            changes = self._classify_changes(before, self.pfsense.element_to_dict(self.target_elt))
+            self.interface_changes.update(changes)
+            if not self.params['enable']:
+                if changes & set(['enable', 'addressing', 'link']):
+                    self.setup_interface_cmds += "interface_bring_down('{0}', true);\n".format(self.target_elt.tag)
+            elif changes & set(['enable', 'addressing']):
                 self.setup_interface_cmds += "interface_bring_down('{0}', false);\n".format(self.target_elt.tag)
                 self.setup_interface_cmds += "interface_configure('{0}', true);\n".format(self.target_elt.tag)
-            else:
-                self.setup_interface_cmds += "interface_bring_down('{0}', true);\n".format(self.target_elt.tag)
+            elif 'link' in changes:
+                self.setup_interface_cmds += "interface_configure('{0}', true);\n".format(self.target_elt.tag)
 
         return (before, changed)
 
+    def _has_dynamic_address(self, interface):
+        """ return True if the interface dict gets an address dynamically (dhcp, pppoe, dhcp6, slaac, ...) """
+        ipaddr = interface.get('ipaddr')
+        ipaddrv6 = interface.get('ipaddrv6')
+        return bool(ipaddr and not self.pfsense.is_ipv4_address(ipaddr) or ipaddrv6 and not self.pfsense.is_ipv6_address(ipaddrv6))
+
+    def _classify_changes(self, before, after):
+        """ return the classes of the changes between the before and after interface dicts """
+        changes = set()
+        for field in set(before.keys()) | set(after.keys()):
+            if before.get(field) != after.get(field):
+                change = INTERFACE_CHANGE_CLASSES.get(field, 'addressing')
+                if field == 'descr' and (self._has_dynamic_address(before) or self._has_dynamic_address(after)):
+                    change = 'addressing'
+                changes.add(change)
+        return changes
+
     def _create_target(self):
         """ create the XML target_elt """
         # wan can't be deleted, so the first interface we can create is lan
@@ -317,6 +360,7 @@ class PFSenseInterfaceModule(PFSenseModuleBase):
         self._remove_all_rules(self.target_elt.tag)
 
         self.setup_interface_cmds += "interface_bring_down('{0}');\n".format(self.target_elt.tag)
+        self.interface_changes.add('remove')
 
     def _remove_all_rules(self, interface):
         """ delete all interface rules """
@@ -378,81 +422,12 @@ class PFSenseInterfaceModule(PFSenseModuleBase):
     # run
     #
     def _get_interface_list(self):
-        return self.pfsense.php(
-            "require_once('/etc/inc/interfaces.inc');"
-            "$portlist = get_interface_list();"
-            ""
-            "/* add wireless clone interfaces */"
-            "if (is_array($config['wireless']['clone']) && count($config['wireless']['clone']))"
-            "    foreach ($config['wireless']['clone'] as $clone)  $portlist[$clone['cloneif']] = $clone;"
-            ""
-            "/* add VLAN interfaces */"
-            "if (is_array($config['vlans']['vlan']) && count($config['vlans']['vlan']))"
-            "    foreach ($config['vlans']['vlan'] as $vlan)  $portlist[$vlan['vlanif']] = $vlan;"
-            ""
-            "/* add Bridge interfaces */"
-            "if (is_array($config['bridges']['bridged']) && count($config['bridges']['bridged']))"
-            "    foreach ($config['bridges']['bridged'] as $bridge) $portlist[$bridge['bridgeif']] = $bridge;"
-            ""
-            "/* add GIF interfaces */"
-            "if (is_array($config['gifs']['gif']) && count($config['gifs']['gif']))"
-            "    foreach ($config['gifs']['gif'] as $gif) $portlist[$gif['gifif']] = $gif;"
-            ""
-            "/* add GRE interfaces */"
-            "if (is_array($config['gres']['gre']) && count($config['gres']['gre']))"
-            "    foreach ($config['gres']['gre'] as $gre) $portlist[$gre['greif']] = $gre;"
-            ""
-            "/* add LAGG interfaces */"
-            "if (is_array($config['laggs']['lagg']) && count($config['laggs']['lagg']))"
-            "    foreach ($config['laggs']['lagg'] as $lagg) {"
-            "        $portlist[$lagg['laggif']] = $lagg;"
-            "        /* LAGG members cannot be assigned */"
-            "        $lagifs = explode(',', $lagg['members']);"
-            "        foreach ($lagifs as $lagif)"
-            "            if (isset($portlist[$lagif])) unset($portlist[$lagif]);"
-            "    }"
-            ""
-            "/* add QinQ interfaces */"
-            "if (is_array($config['qinqs']['qinqentry']) && count($config['qinqs']['qinqentry']))"
-            "    foreach ($config['qinqs']['qinqentry'] as $qinq) {"
-            "        $portlist[\"{$qinq['vlanif']}\"] = $qinq;"
-            "        /* QinQ members */"
-            "        $qinqifs = explode(' ', $qinq['members']);"
-            "        foreach ($qinqifs as $qinqif) $portlist[\"{$qinq['vlanif']}.{$qinqif}\"] = $qinqif;"
-            "    }"
-            ""
-            "/* add PPP interfaces */"
-            "if (is_array($config['ppps']['ppp']) && count($config['ppps']['ppp']))"
-            "    foreach ($config['ppps']['ppp'] as $pppid => $ppp) $portlist[$ppp['if']] = $ppp;"
-            ""
-            "if (is_array($config['openvpn'])) {"
-            "    if (is_array($config['openvpn']['openvpn-server']))"
-            "        foreach ($config['openvpn']['openvpn-server'] as $s) $portlist[\"ovpns{$s['vpnid']}\"] = $s;"
-            "    if (is_array($config['openvpn']['openvpn-client']))"
-            "        foreach ($config['openvpn']['openvpn-client'] as $c)  $portlist[\"ovpnc{$c['vpnid']}\"] = $c;"
-            "}"
-            ""
-            "$ipsec_descrs = interface_ipsec_vti_list_all();"
-            "foreach ($ipsec_descrs as $ifname => $ifdescr) $portlist[$ifname] = array('descr' => $ifdescr);"
-            ""
-            "echo json_encode($portlist, JSON_PRETTY_PRINT);")
+        """ return the ports which can be assigned """
+        return self.pfsense.get_port_inventory()['assignable_ports']
 
     def _get_media_mode(self, interface):
         """ Find all possible media options for the interface """
-        return self.pfsense.php(
-            '$mediaopts_list = array();\n'
-            'exec("/sbin/ifconfig -m ' + interface + ' | grep \'media \'", $mediaopts);\n'
-            'foreach ($mediaopts as $mediaopt) {\n'
-            '        preg_match("/media (.*)/", $mediaopt, $matches);\n'
-            '        if (preg_match("/(.*) mediaopt (.*)/", $matches[1], $matches1)) {\n'
-            '                // there is media + mediaopt like "media 1000baseT mediaopt full-duplex"\n'
-            '                array_push($mediaopts_list, $matches1[1] . " " . $matches1[2]);\n'
-            '        } else {\n'
-            '                // there is only media like "media 1000baseT"\n'
-            '                array_push($mediaopts_list, $matches[1]);\n'
-            '        }\n'
-            '}\n'
-            'echo json_encode($mediaopts_list);')
+        return self.pfsense.get_port_inventory()['media'].get(interface, [])
 
     def get_update_cmds(self):
         """ build and return php commands to setup interfaces """
@@ -466,6 +441,13 @@ class PFSenseInterfaceModule(PFSenseModuleBase):
         if self.setup_interface_cmds != "":
             cmd += self.setup_interface_cmds
 
+        # cosmetic, filter and link changes do not need the services depending on the interfaces to be reloaded
+        if not self.interface_changes & INTERFACE_RELOAD_CHANGES:
+            cmd += "clear_subsystem_dirty('interfaces');\n"
+            if 'filter' in self.interface_changes:
+                cmd += "filter_configure();\n"
+            return cmd
+
         cmd += 'services_snmpd_configure();\n'
         cmd += 'setup_gateways_monitor();\n'
         cmd += "clear_subsystem_dirty('interfaces');\n"
@@ -98,24 +98,9 @@ class PFSenseIpsecModule(PFSenseModuleBase):
     def _create_target(self):
         """ create the XML target_elt """
         ipsec_elt = self.pfsense.new_element('phase1')
-        self.obj['ikeid'] = str(self._find_free_ikeid())
+        self.obj['ikeid'] = str(self.pfsense.allocate_id('ikeid'))
         return ipsec_elt
 
-    def _find_free_ikeid(self):
-        """ return first unused ikeid """
-        ikeid = 1
-        while True:
-            found = False
-            for ipsec_elt in self.root_elt:
-                ikeid_elt = ipsec_elt.find('ikeid')
-                if ikeid_elt is not None and ikeid_elt.text == str(ikeid):
-                    found = True
-                    break
-
-            if not found:
-                return ikeid
-            ikeid = ikeid + 1
-
     def _find_target(self):
         """ find the XML target_elt """
         if self.params.get('ikeid') is not None:
@@ -134,8 +119,24 @@ class PFSenseIpsecModule(PFSenseModuleBase):
 
         return params
 
+    def _copy_and_add_target(self):
+        """ create the XML target_elt """
+        super(PFSenseIpsecModule, self)._copy_and_add_target()
+        self.pfsense.ipsec_changed(self.obj['ikeid'], filter_reload=True)
+
+    def _copy_and_update_target(self):
+        """ update the XML target_elt """
+        (before, changed) = super(PFSenseIpsecModule, self)._copy_and_update_target()
+        if changed:
+            filter_reload = any(before.get(field) != self.obj.get(field) for field in ['interface', 'remote-gateway', 'protocol', 'disabled'])
+            self.pfsense.ipsec_changed(self.target_elt.find('ikeid').text, filter_reload=filter_reload)
+        return (before, changed)
+
     def _pre_remove_target_elt(self):
         """ processing before removing elt """
+        ikeid_elt = self.target_elt.find('ikeid')
+        if ikeid_elt is not None:
+            self.pfsense.ipsec_changed(ikeid_elt.text, filter_reload=True)
         self._remove_phases2()
 
     def _remove_phases2(self):
@@ -144,12 +145,16 @@ class PFSenseIpsecModule(PFSenseModuleBase):
         if ikeid_elt is None:
             return
         ikeid = ikeid_elt.text
+        self.pfsense.release_id('ikeid', ikeid)
         phase2_elts = self.root_elt.findall('phase2')
         for phase2_elt in phase2_elts:
             ikeid_elt = phase2_elt.find('ikeid')
             if ikeid_elt is None:
                 continue
             if ikeid == ikeid_elt.text:
+                reqid_elt = phase2_elt.find('reqid')
+                if reqid_elt is not None:
+                    self.pfsense.release_id('reqid', reqid_elt.text)
                 self.root_elt.remove(phase2_elt)
 
     ##############################
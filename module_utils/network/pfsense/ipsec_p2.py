@@ -94,33 +94,75 @@ class PFSenseIpsecP2Module(PFSenseModuleBase):
         self._phase1 = None
         self.before_elt = None
 
+        self._phase2_index = None    # phase1 elt -> local and remote ids -> phase2 elts
+        self._phase2_keys = None     # phase2 elt -> (phase1 elt, local and remote ids)
+
     ##############################
     # params processing
     #
-    def _check_for_duplicate_phase2(self, phase2):
-        """ check for another phase2 with same remote and local """
-        def strip_phase(phase):
-            _phase2 = {}
-            if phase.get('localid') is not None:
-                _phase2['localid'] = phase['localid']
-            if phase.get('remoteid') is not None:
-                _phase2['remoteid'] = phase['remoteid']
-            return _phase2
-
-        _phase2 = strip_phase(phase2)
-        ikeid = self._phase1.find('ikeid').text
-        for phase2_elt in self.root_elt:
-            if phase2_elt.tag != 'phase2':
-                continue
-
-            if phase2_elt.find('ikeid').text != ikeid:
-                continue
-
-            if phase2_elt.find('descr').text == phase2['descr']:
+    @staticmethod
+    def _phase2_key(phase2):
+        """ return the hashable local and remote ids of a phase2 dict """
+        def normalize(name):
+            value = phase2.get(name)
+            if isinstance(value, dict):
+                return tuple(sorted((key, tuple(item) if isinstance(item, list) else item) for key, item in value.items()))
+            return value
+
+        return (normalize('localid'), normalize('remoteid'))
+
+    def _phase2_elt_key(self, phase2_elt):
+        """ return the hashable local and remote ids of a phase2 elt """
+        phase2 = {}
+        for name in ['localid', 'remoteid']:
+            id_elt = phase2_elt.find(name)
+            if id_elt is None:
                 continue
+            if len(id_elt) > 0:
+                phase2[name] = self.pfsense.element_to_dict(id_elt)
+            else:
+                phase2[name] = id_elt.text if id_elt.text is not None else ''
+        return self._phase2_key(phase2)
+
+    def _index_phase2(self, phase1_elt, phase2_elt):
+        """ add phase2_elt to the index """
+        key = self._phase2_elt_key(phase2_elt)
+        self._phase2_index.setdefault(phase1_elt, dict()).setdefault(key, []).append(phase2_elt)
+        self._phase2_keys[phase2_elt] = (phase1_elt, key)
+
+    def _unindex_phase2(self, phase2_elt):
+        """ remove phase2_elt from the index """
+        if self._phase2_index is None or phase2_elt not in self._phase2_keys:
+            return
+        (phase1_elt, key) = self._phase2_keys.pop(phase2_elt)
+        self._phase2_index[phase1_elt][key].remove(phase2_elt)
+
+    def _get_phase2_index(self, phase1_elt):
+        """ return the phase2 elts of phase1_elt by local and remote ids
+
+            The index is built on first call and updated when phase2 are added, updated or removed, so an aggregated
+            run does not scan all the phase2 for each one. It is keyed by the phase1 elts: the phase2 removed
+            along with their phase1 by the ipsec module can not be found again, even if the phase1 ikeid is reused. """
+        if self._phase2_index is None:
+            self._phase2_index = dict()
+            self._phase2_keys = dict()
+            phase1_elts = dict()
+            for elt in self.root_elt.findall('phase1'):
+                ikeid_elt = elt.find('ikeid')
+                if ikeid_elt is not None:
+                    phase1_elts.setdefault(ikeid_elt.text, elt)
+
+            for phase2_elt in self.root_elt.findall('phase2'):
+                ikeid_elt = phase2_elt.find('ikeid')
+                if ikeid_elt is not None and ikeid_elt.text in phase1_elts:
+                    self._index_phase2(phase1_elts[ikeid_elt.text], phase2_elt)
+
+        return self._phase2_index.get(phase1_elt, dict())
 
-            other_phase2 = self.pfsense.element_to_dict(phase2_elt)
-            if _phase2 == strip_phase(other_phase2):
+    def _check_for_duplicate_phase2(self, phase2):
+        """ check for another phase2 with same remote and local """
+        for phase2_elt in self._get_phase2_index(self._phase1).get(self._phase2_key(phase2), []):
+            if phase2_elt.find('descr').text != phase2['descr']:
                 self.module.fail_json(msg='Phase2 with this Local/Remote networks combination is already defined for this Phase1.')
 
     def _id_to_phase2(self, name, phase2, address, param_name):
@@ -243,6 +285,9 @@ class PFSenseIpsecP2Module(PFSenseModuleBase):
         self._sync_encryptions(self.target_elt)
         self._sync_hashes(self.target_elt)
         self.root_elt.append(self.target_elt)
+        if self._phase2_index is not None:
+            self._index_phase2(self._phase1, self.target_elt)
+        self.pfsense.ipsec_changed(self.obj['ikeid'], self.obj['reqid'], full_reload=self.obj.get('mode') == 'vti')
 
     def _copy_and_update_target(self):
         """ update the XML target_elt """
@@ -259,6 +304,13 @@ class PFSenseIpsecP2Module(PFSenseModuleBase):
         if self._remove_deleted_ipsec_params():
             changed = True
 
+        if changed and self._phase2_index is not None:
+            self._unindex_phase2(self.target_elt)
+            self._index_phase2(self._phase1, self.target_elt)
+
+        if changed:
+            self._ipsec_changed(before.get('mode'))
+
         return (before, changed)
 
     def _create_target(self):
@@ -266,26 +318,9 @@ class PFSenseIpsecP2Module(PFSenseModuleBase):
         target_elt = self.pfsense.new_element('phase2')
         self.obj['ikeid'] = self._phase1.find('ikeid').text
         self.obj['uniqid'] = self.pfsense.uniqid()
-        self.obj['reqid'] = str(self._find_free_reqid())
+        self.obj['reqid'] = str(self.pfsense.allocate_id('reqid'))
         return target_elt
 
-    def _find_free_reqid(self):
-        """ return first unused reqid """
-        reqid = 1
-        while True:
-            found = False
-            for phase2_elt in self.root_elt:
-                if phase2_elt.tag != 'phase2':
-                    continue
-                reqid_elt = phase2_elt.find('reqid')
-                if reqid_elt is not None and reqid_elt.text == str(reqid):
-                    found = True
-                    break
-
-            if not found:
-                return reqid
-            reqid = reqid + 1
-
     def _find_target(self):
         """ return ipsec phase2 elt if found """
         ikeid = self._phase1.find('ikeid').text
@@ -302,6 +337,26 @@ class PFSenseIpsecP2Module(PFSenseModuleBase):
 
         return None
 
+    def _pre_remove_target_elt(self):
+        """ processing before removing elt """
+        super(PFSenseIpsecP2Module, self)._pre_remove_target_elt()
+        self._unindex_phase2(self.target_elt)
+        reqid_elt = self.target_elt.find('reqid')
+        if reqid_elt is not None:
+            self.pfsense.release_id('reqid', reqid_elt.text)
+        self._ipsec_changed(self.diff['before'].get('mode'))
+
+    def _ipsec_changed(self, mode_before):
+        """ record the change of the target_elt for the ipsec apply """
+        reqid_elt = self.target_elt.find('reqid')
+        if reqid_elt is None:
+            self.pfsense.ipsec_changed(self.target_elt.find('ikeid').text, full_reload=True)
+            return
+
+        mode_elt = self.target_elt.find('mode')
+        vti = mode_before == 'vti' or mode_elt is not None and mode_elt.text == 'vti'
+        self.pfsense.ipsec_changed(self.target_elt.find('ikeid').text, reqid_elt.text, full_reload=vti)
+
     def _remove_deleted_ipsec_params(self):
         """ Remove from phase2 a few deleted params """
         changed = False
@@ -125,10 +125,19 @@ class PFSenseIpsecProposalModule(PFSenseModuleBase):
         """ update the XML target_elt """
         return (None, False)
 
+    def _copy_and_add_target(self):
+        """ create the XML target_elt """
+        super(PFSenseIpsecProposalModule, self)._copy_and_add_target()
+        self.pfsense.ipsec_changed(self._phase1.find('ikeid').text)
+
     def _create_target(self):
         """ create the XML target_elt """
         return self.pfsense.new_element('item')
 
+    def _post_remove_target_elt(self):
+        """ processing after removing elt """
+        self.pfsense.ipsec_changed(self._phase1.find('ikeid').text)
+
     def _find_target(self):
         """ find the XML target_elt """
         # 2.5.0: when deleting, if prf is not specified we're taking the first matching proposal without taking prf into account
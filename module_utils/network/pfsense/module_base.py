@@ -6,7 +6,7 @@
 from __future__ import (absolute_import, division, print_function)
 __metaclass__ = type
 
-from ansible.module_utils.network.pfsense.pfsense import PFSenseModule
+from ansible.module_utils.network.pfsense.pfsense import PFSenseModule, PFSenseTimings
 
 
 class PFSenseModuleBase(object):
@@ -36,6 +36,9 @@ class PFSenseModuleBase(object):
 
         self.change_descr = ''
 
+        # phases timings of this module, the parsing and writing ones are in the pfsense timings
+        self.timings = PFSenseTimings(self.pfsense.timings.enabled)
+
         self.result = {}
         self.result['changed'] = False
         self.result['commands'] = []
@@ -185,10 +188,21 @@ class PFSenseModuleBase(object):
             self.pfsense.write_config(descr=self.change_descr)
 
             if self.apply:
+                started = self.timings.start()
                 (dummy, self.result['stdout'], self.result['stderr']) = self._update()
+                self.timings.stop('apply', started)
 
+        if self.timings.enabled:
+            self.result['timings'] = self.timings.to_dict(self.pfsense.timings)
         self.module.exit_json(**self.result)
 
+    @staticmethod
+    def _php_str(value):
+        """ return value as a php single quoted string """
+        if value is None:
+            return "''"
+        return "'{0}'".format(value.replace('\\', '\\\\').replace("'", "\\'"))
+
     def _post_remove_target_elt(self):
         """ processing after removing elt """
         pass
@@ -215,18 +229,26 @@ class PFSenseModuleBase(object):
         """ process input params to add/update/delete """
         self.params = params
         self.target_elt = None
+        started = self.timings.start()
         self._check_deprecated_params()
         self._check_onward_params()
         self._validate_params()
+        started = self.timings.stop('validate', started)
 
         self.obj = self._params_to_obj()
+        started = self.timings.stop('params', started)
         if self.target_elt is None:
             self.target_elt = self._find_target()
+            if self.root_elt is not None:
+                self.timings.count('elements_scanned', len(self.root_elt))
+        started = self.timings.stop('find_target', started)
 
         if params['state'] == 'absent':
             self._remove()
         else:
             self._add()
+        self.timings.stop('mutate', started)
+        self.timings.count('runs')
 
     ##############################
     # Logging
@@ -19,6 +19,66 @@ import time
 import xml.etree.ElementTree as ET
 from tempfile import mkstemp
 
+# lines of ifconfig -m -a output
+IFCONFIG_INTERFACE_RE = re.compile(r'^([^\s:]+): flags=')
+IFCONFIG_MEDIA_RE = re.compile(r'^\s+media (.*?)(?: mediaopt (.*))?\s*$')
+
+# elements holding the ids allocated with PFSenseModule.allocate_id: (parent elements xpaths, id tag)
+ID_SOURCES = dict(
+    ikeid=(['ipsec/phase1', 'ipsec/phase2'], 'ikeid'),
+    reqid=(['ipsec/phase2'], 'reqid'),
+    uid=(['system/user'], 'uid'),
+    gid=(['system/group'], 'gid'),
+    vpnid=(['openvpn/openvpn-server', 'openvpn/openvpn-client'], 'vpnid'),
+)
+
+
+class PFSenseTimings(object):
+    """ phases timings (in milliseconds) and counters of a module run
+
+        Timings are disabled unless the PFSENSE_MODULE_TIMINGS environment variable is set (for example with the
+        environment keyword of the task). They are then returned in the timings field of the module result. """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.phases = dict()
+        self.counts = dict()
+
+    @classmethod
+    def from_environment(cls):
+        """ return timings enabled by the environment """
+        return cls(enabled=os.environ.get('PFSENSE_MODULE_TIMINGS', '').lower() not in ['', '0', 'false', 'no'])
+
+    def start(self):
+        """ return the start time of a phase, or None if timings are disabled """
+        if not self.enabled:
+            return None
+        return time.time()
+
+    def stop(self, phase, started):
+        """ add the time elapsed since started to phase and return the current time (the start of the next phase) """
+        if started is None:
+            return None
+        now = time.time()
+        self.phases[phase] = self.phases.get(phase, 0.0) + (now - started) * 1000
+        return now
+
+    def count(self, counter, value=1):
+        """ add value to counter """
+        if self.enabled:
+            self.counts[counter] = self.counts.get(counter, 0) + value
+
+    def to_dict(self, *others):
+        """ return the timings, merged with others timings, as a result field """
+        phases = dict(self.phases)
+        counts = dict(self.counts)
+        for other in others:
+            for phase, elapsed in other.phases.items():
+                phases[phase] = phases.get(phase, 0.0) + elapsed
+            for counter, value in other.counts.items():
+                counts[counter] = counts.get(counter, 0) + value
+        return dict(phases_ms=dict((phase, round(elapsed, 3)) for phase, elapsed in phases.items()), counts=counts)
+
 
 class PFSenseModule(object):
     """ class managing pfsense base configuration """
@@ -54,6 +114,8 @@ class PFSenseModule(object):
     def __init__(self, module, config='/cf/conf/config.xml'):
         self.module = module
         self.config = config
+        self.timings = PFSenseTimings.from_environment()
+        started = self.timings.start()
         self.tree = ET.parse(config)
         self.root = self.tree.getroot()
         self.config_version = float(self.get_element('version').text)
@@ -71,8 +133,12 @@ class PFSenseModule(object):
         self.debug = open('/tmp/pfsense.debug', 'w')
         if sys.version_info >= (3, 4):
             self._scrub()
+        self.timings.stop('parse', started)
 
         self.pfsense_version = None
+        self.used_ids = dict()
+        self.ipsec_changes = dict(phase1=set(), phase2=dict(), filter=False, full=False)
+        self.port_inventory = None
 
     # Work around pfSense CDATA xml formatting issue
     # https://github.com/opoplawski/ansible-pfsense/issues/61
@@ -184,6 +250,47 @@ class PFSenseModule(object):
 
         return None
 
+    def _get_used_ids(self, kind):
+        """ return the used ids of kind, collected from the configuration on first call """
+        if kind not in self.used_ids:
+            used = set()
+            (xpaths, tag) = ID_SOURCES[kind]
+            for xpath in xpaths:
+                for elt in self.root.findall(xpath):
+                    id_elt = elt.find(tag)
+                    if id_elt is not None and id_elt.text is not None and id_elt.text.strip().isdigit():
+                        used.add(int(id_elt.text))
+            # all the ids lower than lowest are used
+            self.used_ids[kind] = dict(used=used, lowest=1)
+        return self.used_ids[kind]
+
+    def allocate_id(self, kind, start=1):
+        """ return the lowest unused id of kind (ikeid, reqid, uid, gid or vpnid) not lower than start, and reserve it
+
+            The used ids are collected once and kept up to date by allocate_id, reserve_id and release_id, so
+            consecutive allocations (in an aggregated module for example) do not scan the configuration again. """
+        ids = self._get_used_ids(kind)
+        candidate = max(start, ids['lowest'])
+        while candidate in ids['used']:
+            candidate += 1
+        ids['used'].add(candidate)
+        if start <= ids['lowest']:
+            ids['lowest'] = candidate + 1
+        return candidate
+
+    def reserve_id(self, kind, value):
+        """ mark an id of kind as used """
+        if value is not None and str(value).strip().isdigit():
+            self._get_used_ids(kind)['used'].add(int(value))
+
+    def release_id(self, kind, value):
+        """ mark an id of kind as unused """
+        if value is None or not str(value).strip().isdigit():
+            return
+        ids = self._get_used_ids(kind)
+        ids['used'].discard(int(value))
+        ids['lowest'] = min(ids['lowest'], int(value))
+
     @staticmethod
     def rule_match_interface(rule_elt, interface, floating):
         """ check if a rule elt match the targeted interface
@@ -586,20 +693,217 @@ class PFSenseModule(object):
     def phpshell(self, command):
         """ Run a command in the php developer shell """
         command = "global $debug;\n$debug = 1;\n" + command + "\nexec\nexit"
+        self.timings.count('php_calls')
         # Dummy argument suppresses displaying help message
         return self.module.run_command('/usr/local/sbin/pfSsh.php dummy', data=command)
 
+    def _get_port_inventory_cmd(self):
+        """ return the php command listing the ports and interfaces of the target pfsense """
+        cmd = (
+            'require_once("/etc/inc/interfaces.inc");'
+            '$inventory = array();'
+            ''
+            '/* physical interfaces on which vlans can be set */'
+            '$portlist = get_interface_list();'
+            '$lagglist = get_lagg_interface_list();'
+            '$portlist = array_merge($portlist, $lagglist);'
+            'foreach ($lagglist as $laggif => $lagg) {'
+            "    $laggmembers = explode(',', $lagg['members']);"
+            '    foreach ($laggmembers as $lagm)'
+            '        if (isset($portlist[$lagm]))'
+            '            unset($portlist[$lagm]);'
+            '}'
+            '$inventory["jumbo"] = array();'
+            'foreach ($portlist as $ifn => $ifinfo)'
+            '    if (is_jumbo_capable($ifn))'
+            '        array_push($inventory["jumbo"], $ifn);'
+        )
+
+        if self.is_at_least_2_5_0():
+            cmd += (
+                '$list = array();'
+                'foreach ($portlist as $ifn => $ifinfo) {'
+                '    $list[$ifn] = $ifn . " (" . $ifinfo["mac"] . ")";'
+                '    $iface = convert_real_interface_to_friendly_interface_name($ifn);'
+                '    if (isset($iface) && strlen($iface) > 0)'
+                '        $list[$ifn] .= " - $iface";'
+                '}'
+                '$inventory["vlan_ports"] = $list;'
+            )
+        else:
+            cmd += '$inventory["vlan_ports"] = $inventory["jumbo"];'
+
+        # function build_if_list https://github.com/pfsense/pfsense/blob/master/src/usr/local/www/firewall_virtual_ip_edit.php
+        cmd += (
+            ''
+            '/* interfaces on which vips can be set */'
+            '$interfaces = get_configured_interface_with_descr(true);'
+            '$carplist = get_configured_vip_list("all", VIP_CARP);'
+            'foreach ($carplist as $vipname => $address) {'
+            '    $interfaces[$vipname] = $address;'
+            '    $interfaces[$vipname] .= " (";'
+            '    if (get_vip_descr($address)) {'
+            '        $interfaces[$vipname] .= get_vip_descr($address);'
+            '    } else {'
+            '        $vip = get_configured_vip($vipname);'
+            '        $interfaces[$vipname] .= "vhid: {$vip["vhid"]}";'
+            '    }'
+            '    $interfaces[$vipname] .= ")";'
+            '}'
+            '$interfaces["lo0"] = "Localhost";'
+            '$inventory["vip_interfaces"] = $interfaces;'
+            ''
+            '/* ports which can be assigned to interfaces */'
+            '$portlist = get_interface_list();'
+            ''
+            '/* add wireless clone interfaces */'
+            "if (is_array($config['wireless']['clone']) && count($config['wireless']['clone']))"
+            "    foreach ($config['wireless']['clone'] as $clone)  $portlist[$clone['cloneif']] = $clone;"
+            ''
+            '/* add VLAN interfaces */'
+            "if (is_array($config['vlans']['vlan']) && count($config['vlans']['vlan']))"
+            "    foreach ($config['vlans']['vlan'] as $vlan)  $portlist[$vlan['vlanif']] = $vlan;"
+            ''
+            '/* add Bridge interfaces */'
+            "if (is_array($config['bridges']['bridged']) && count($config['bridges']['bridged']))"
+            "    foreach ($config['bridges']['bridged'] as $bridge) $portlist[$bridge['bridgeif']] = $bridge;"
+            ''
+            '/* add GIF interfaces */'
+            "if (is_array($config['gifs']['gif']) && count($config['gifs']['gif']))"
+            "    foreach ($config['gifs']['gif'] as $gif) $portlist[$gif['gifif']] = $gif;"
+            ''
+            '/* add GRE interfaces */'
+            "if (is_array($config['gres']['gre']) && count($config['gres']['gre']))"
+            "    foreach ($config['gres']['gre'] as $gre) $portlist[$gre['greif']] = $gre;"
+            ''
+            '/* add LAGG interfaces */'
+            "if (is_array($config['laggs']['lagg']) && count($config['laggs']['lagg']))"
+            "    foreach ($config['laggs']['lagg'] as $lagg) {"
+            "        $portlist[$lagg['laggif']] = $lagg;"
+            '        /* LAGG members cannot be assigned */'
+            "        $lagifs = explode(',', $lagg['members']);"
+            '        foreach ($lagifs as $lagif)'
+            '            if (isset($portlist[$lagif])) unset($portlist[$lagif]);'
+            '    }'
+            ''
+            '/* add QinQ interfaces */'
+            "if (is_array($config['qinqs']['qinqentry']) && count($config['qinqs']['qinqentry']))"
+            "    foreach ($config['qinqs']['qinqentry'] as $qinq) {"
+            "        $portlist[\"{$qinq['vlanif']}\"] = $qinq;"
+            '        /* QinQ members */'
+            "        $qinqifs = explode(' ', $qinq['members']);"
+            "        foreach ($qinqifs as $qinqif) $portlist[\"{$qinq['vlanif']}.{$qinqif}\"] = $qinqif;"
+            '    }'
+            ''
+            '/* add PPP interfaces */'
+            "if (is_array($config['ppps']['ppp']) && count($config['ppps']['ppp']))"
+            "    foreach ($config['ppps']['ppp'] as $pppid => $ppp) $portlist[$ppp['if']] = $ppp;"
+            ''
+            "if (is_array($config['openvpn'])) {"
+            "    if (is_array($config['openvpn']['openvpn-server']))"
+            "        foreach ($config['openvpn']['openvpn-server'] as $s) $portlist[\"ovpns{$s['vpnid']}\"] = $s;"
+            "    if (is_array($config['openvpn']['openvpn-client']))"
+            "        foreach ($config['openvpn']['openvpn-client'] as $c)  $portlist[\"ovpnc{$c['vpnid']}\"] = $c;"
+            '}'
+            ''
+            '$ipsec_descrs = interface_ipsec_vti_list_all();'
+            "foreach ($ipsec_descrs as $ifname => $ifdescr) $portlist[$ifname] = array('descr' => $ifdescr);"
+            '$inventory["assignable_ports"] = $portlist;'
+            ''
+            '/* interfaces and supported media lines of all the interfaces, parsed by parse_ifconfig_media */'
+            '$ifconfig = array();'
+            'exec("/sbin/ifconfig -m -a | grep -E \'^[^[:space:]]+: flags=|media \'", $ifconfig);'
+            '$inventory["ifconfig_media"] = $ifconfig;'
+            ''
+            'echo json_encode($inventory);'
+        )
+        return cmd
+
+    @staticmethod
+    def parse_ifconfig_media(lines):
+        """ return the supported media options of each interface from the lines of ifconfig -m -a
+
+            The interfaces lines (like "em0: flags=8843<UP...> metric 0 mtu 1500") are followed by the supported media
+            lines, which are like "media 1000baseT" or "media 1000baseT mediaopt full-duplex" (returned as "1000baseT full-duplex") """
+        media = dict()
+        options = None
+        for line in lines:
+            match = IFCONFIG_INTERFACE_RE.match(line)
+            if match is not None:
+                options = media.setdefault(match.group(1), [])
+                continue
+
+            match = IFCONFIG_MEDIA_RE.match(line)
+            if match is None or options is None:
+                continue
+
+            if match.group(2) is not None:
+                options.append(match.group(1) + ' ' + match.group(2))
+            else:
+                options.append(match.group(1))
+        return media
+
+    def _get_config_stamp(self):
+        """ return the modification time and size of the config file, or None if it can't be read """
+        try:
+            stat = os.stat(self.config)
+        except OSError:
+            return None
+        return [stat.st_mtime, stat.st_size]
+
+    def get_port_inventory(self):
+        """ return the ports and interfaces of the target pfsense, with one php call for the run
+
+            The inventory has the ports on which vlans can be set (vlan_ports), the jumbo capable ones (jumbo), the
+            interfaces and CARP vips on which vips can be set (vip_interfaces), the ports which can be assigned to
+            interfaces (assignable_ports) and the supported media options of all the interfaces (media), parsed from
+            a single ifconfig -m -a.
+            When the PFSENSE_PORT_INVENTORY_CACHE environment variable is set to a file path, the inventory is stored
+            into this file and reused by the next runs until config.xml is modified. """
+        if self.port_inventory is not None:
+            return self.port_inventory
+
+        cache_file = os.environ.get('PFSENSE_PORT_INVENTORY_CACHE')
+        stamp = self._get_config_stamp() if cache_file else None
+        if stamp is not None and os.path.exists(cache_file):
+            try:
+                with open(cache_file, 'r') as f:
+                    cached = json.load(f)
+                if cached.get('config') == stamp:
+                    self.port_inventory = cached['inventory']
+            except (IOError, OSError, ValueError, KeyError, AttributeError):
+                pass
+
+        if self.port_inventory is None:
+            self.port_inventory = self.php(self._get_port_inventory_cmd())
+            # php encodes empty arrays as lists
+            for name in ['vip_interfaces', 'assignable_ports']:
+                if not self.port_inventory.get(name):
+                    self.port_inventory[name] = dict()
+            self.port_inventory['media'] = self.parse_ifconfig_media(self.port_inventory.pop('ifconfig_media', None) or [])
+
+            if stamp is not None:
+                try:
+                    with open(cache_file, 'w') as f:
+                        json.dump(dict(config=stamp, inventory=self.port_inventory), f)
+                except (IOError, OSError):
+                    pass
+
+        return self.port_inventory
+
     def php(self, command):
         """ Run a command in php and return the output """
         cmd = '<?php\n'
         cmd += command
         cmd += '\n?>\n'
+        self.timings.count('php_calls')
         (dummy, stdout, stderr) = self.module.run_command('/usr/local/bin/php', data=cmd)
         # TODO: check stderr for errors
         return json.loads(stdout)
 
     def write_config(self, descr='Updated by ansible pfsense module'):
         """ Generate config file """
+        started = self.timings.start()
         revision = self.get_element('revision')
         revision.find('time').text = '%d' % time.time()
         revdescr = revision.find('description')
@@ -615,6 +919,8 @@ class PFSenseModule(object):
             self.tree.write(tmp_name, xml_declaration=True, method='xml', short_empty_elements=False)
         else:
             self.tree.write(tmp_name, xml_declaration=True, method='xml')
+        if self.timings.enabled:
+            self.timings.count('bytes_written', os.path.getsize(tmp_name))
         shutil.move(tmp_name, self.config)
         os.chmod(self.config, 0o644)
         try:
@@ -625,6 +931,7 @@ class PFSenseModule(object):
                 pass
             else:
                 raise
+        self.timings.stop('write_config', started)
 
     @staticmethod
     def get_version():
@@ -671,8 +978,67 @@ class PFSenseModule(object):
         """ check target pfSense version """
         return self.is_version([2, 5, 0]) or self.is_version([21, 2])
 
-    def apply_ipsec_changes(self):
-        """ execute pfSense code to appy ipsec changes """
+    def ipsec_changed(self, ikeid, reqid=None, filter_reload=False, full_reload=False):
+        """ record a change of the phase1 ikeid, or of its phase2 reqid, for apply_ipsec_changes
+
+            filter_reload must be set when the change requires to reload the filter (phase1 added, removed, or with
+            another interface or gateway) and full_reload when it requires a global IPsec apply (VTI phase2) """
+        if reqid is None:
+            self.ipsec_changes['phase1'].add(ikeid)
+        else:
+            self.ipsec_changes['phase2'][reqid] = ikeid
+        self.ipsec_changes['filter'] = self.ipsec_changes['filter'] or filter_reload
+        self.ipsec_changes['full'] = self.ipsec_changes['full'] or full_reload
+
+    def _apply_changed_ipsec_connections(self):
+        """ execute pfSense code to apply ipsec changes to the changed connections only """
+        changes = self.ipsec_changes
+        cmd = (
+            "require_once('vpn.inc');"
+            "$ipsec_dynamic_hosts = ipsec_configure();"
+            "ipsec_reload_package_hook();"
+            "$retval = 0;"
+        )
+        if changes['filter']:
+            cmd += "$retval |= filter_configure();"
+
+        cmd += "$reset_ike = array({0});".format(', '.join("'{0}'".format(ikeid) for ikeid in sorted(changes['phase1'], key=int)))
+        cmd += "$reset_child = array({0});".format(
+            ', '.join("'{0}' => '{1}'".format(reqid, changes['phase2'][reqid]) for reqid in sorted(changes['phase2'], key=int)))
+        cmd += (
+            "$phase1s = array();"
+            "if (is_array($config['ipsec']['phase1']))"
+            "    foreach ($config['ipsec']['phase1'] as $p1)  $phase1s[$p1['ikeid']] = $p1;"
+            "foreach ($reset_ike as $ikeid)"
+            "    mwexec('/usr/local/sbin/swanctl --terminate --force --ike ' . escapeshellarg(ipsec_conid(array('ikeid' => $ikeid))));"
+            "foreach ($reset_child as $reqid => $ikeid) {"
+            "    if (in_array($ikeid, $reset_ike))  continue;"
+            "    $p1 = isset($phase1s[$ikeid]) ? $phase1s[$ikeid] : array('ikeid' => $ikeid);"
+            "    $p2 = array('ikeid' => $ikeid, 'reqid' => $reqid);"
+            "    mwexec('/usr/local/sbin/swanctl --terminate --force --child ' . escapeshellarg(ipsec_conid($p1, $p2)));"
+            "}"
+            "if (is_array($config['ipsec']['phase2']))"
+            "    foreach ($config['ipsec']['phase2'] as $p2) {"
+            "        if (isset($p2['disabled']) || !isset($phase1s[$p2['ikeid']]))  continue;"
+            "        $p1 = $phase1s[$p2['ikeid']];"
+            "        if (isset($p1['disabled']) || isset($p1['responderonly']))  continue;"
+            "        if (in_array($p2['ikeid'], $reset_ike) || isset($reset_child[$p2['reqid']]))"
+            "            mwexec_bg('/usr/local/sbin/swanctl --initiate --child ' . escapeshellarg(ipsec_conid($p1, $p2)));"
+            "    }"
+            "if ($ipsec_dynamic_hosts >= 0 && is_subsystem_dirty('ipsec'))"
+            "    clear_subsystem_dirty('ipsec');"
+        )
+        return self.phpshell(cmd)
+
+    def apply_ipsec_changes(self, changed_only=False):
+        """ execute pfSense code to appy ipsec changes
+
+            With changed_only, the swanctl configuration is regenerated and loaded but only the connections of the
+            phase1 and phase2 recorded with ipsec_changed are reset and initiated again, and the filter is reloaded
+            only if required. The whole configuration is applied on pfSense < 2.5.0 or when a global apply is required. """
+        if changed_only and self.is_at_least_2_5_0() and not self.ipsec_changes['full']:
+            return self._apply_changed_ipsec_connections()
+
         if self.is_at_least_2_5_0():
             return self.phpshell(
                 "require_once('vpn.inc');"
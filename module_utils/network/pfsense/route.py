@@ -5,6 +5,7 @@
 
 from __future__ import absolute_import, division, print_function
 __metaclass__ = type
+from copy import deepcopy
 from ansible.module_utils.network.pfsense.module_base import PFSenseModuleBase
 
 ROUTE_ARGUMENT_SPEC = dict(
@@ -38,6 +39,10 @@ class PFSenseRouteModule(PFSenseModuleBase):
         self.obj = dict()
         self.route_cmd = list()
 
+        # gateways of the changed routes and whether one of them routes an alias, to find if the filter depends on them
+        self.changed_gateways = set()
+        self.changed_aliases = False
+
         if self.root_elt is None:
             self.root_elt = self.pfsense.new_element('staticroutes')
             self.pfsense.root.append(self.root_elt)
@@ -117,6 +122,31 @@ class PFSenseRouteModule(PFSenseModuleBase):
     ##############################
     # XML processing
     #
+    def _record_route_change(self, route_elt):
+        """ record the gateway and the network of a changed route """
+        gateway_elt = route_elt.find('gateway')
+        if gateway_elt is not None and gateway_elt.text:
+            self.changed_gateways.add(gateway_elt.text)
+
+        network_elt = route_elt.find('network')
+        if network_elt is not None and network_elt.text and not self.pfsense.is_ip_network(network_elt.text, False):
+            self.changed_aliases = True
+
+    def _copy_and_add_target(self):
+        """ create the XML target_elt """
+        super(PFSenseRouteModule, self)._copy_and_add_target()
+        self._record_route_change(self.target_elt)
+
+    def _copy_and_update_target(self):
+        """ update the XML target_elt """
+        old_route_elt = deepcopy(self.target_elt)
+        (before, changed) = super(PFSenseRouteModule, self)._copy_and_update_target()
+        if changed:
+            self._record_route_change(old_route_elt)
+            self._record_route_change(self.target_elt)
+
+        return (before, changed)
+
     def _create_target(self):
         """ create the XML target_elt """
         return self.pfsense.new_element('route')
@@ -133,31 +163,71 @@ class PFSenseRouteModule(PFSenseModuleBase):
         """ returns the list of params to remove if they are not set """
         return ['disabled']
 
+    def _pre_remove_target_elt(self):
+        """ processing before removing elt """
+        super(PFSenseRouteModule, self)._pre_remove_target_elt()
+        self._record_route_change(self.target_elt)
+
     ##############################
     # run
     #
-    def _update(self):
-        """ make the target pfsense reload """
-        for cmd in self.route_cmd:
-            self.module.run_command(cmd)
-
-        return self.pfsense.phpshell('''
+    def _filter_depends_on_changes(self):
+        """ return True if the filter must be reloaded for the changed routes
+
+            The filter depends on the static routes when it bypasses the firewall rules for them, and on the routes
+            of aliases. Unless negation is disabled, the rules using a gateway are negated for the networks of all the
+            static routes. Otherwise, it only depends on the gateways of the changed routes (or on their groups) used by rules. """
+        if self.changed_aliases:
+            return True
+
+        system_elt = self.pfsense.get_element('system')
+        if system_elt is not None and system_elt.find('bypassstaticroutes') is not None:
+            return True
+
+        negate = system_elt is None or system_elt.find('disablenegate') is None
+        gateways = set(self.changed_gateways)
+        if self.pfsense.gateways is not None:
+            for group_elt in self.pfsense.gateways.findall('gateway_group'):
+                for item_elt in group_elt.findall('item'):
+                    if item_elt.text and item_elt.text.split('|')[0] in self.changed_gateways:
+                        gateways.add(group_elt.find('name').text)
+
+        for rule_elt in self.pfsense.rules.findall('rule'):
+            gateway_elt = rule_elt.find('gateway')
+            if gateway_elt is not None and gateway_elt.text and (negate or gateway_elt.text in gateways):
+                return True
+
+        return False
+
+    def get_update_cmds(self):
+        """ build and return the php commands deleting the old routes and reloading the routing in one pass """
+        cmd = '''
 require_once("filter.inc");
 $retval = 0;
-if (file_exists("{$g['tmp_path']}/.system_routes.apply")) {
-        $toapplylist = unserialize(file_get_contents("{$g['tmp_path']}/.system_routes.apply"));
-        foreach ($toapplylist as $toapply)
-                mwexec("{$toapply}");
-        @unlink("{$g['tmp_path']}/.system_routes.apply");
-}
+$toapplylist = array({0});
+if (file_exists("{{$g['tmp_path']}}/.system_routes.apply")) {{
+        $toapplylist = array_merge($toapplylist, unserialize(file_get_contents("{{$g['tmp_path']}}/.system_routes.apply")));
+        @unlink("{{$g['tmp_path']}}/.system_routes.apply");
+}}
+foreach ($toapplylist as $toapply)
+        mwexec("{{$toapply}}");
 
 $retval |= system_routing_configure();
-$retval |= filter_configure();
-/* reconfigure our gateway monitor */
+'''.format(', '.join([self._php_str(route_cmd) for route_cmd in self.route_cmd]))
+
+        if self._filter_depends_on_changes():
+            cmd += '$retval |= filter_configure();\n'
+
+        cmd += '''/* reconfigure our gateway monitor */
 setup_gateways_monitor();
 
 if ($retval == 0) clear_subsystem_dirty('staticroutes');
-''')
+'''
+        return cmd
+
+    def _update(self):
+        """ make the target pfsense reload """
+        return self.pfsense.phpshell(self.get_update_cmds())
 
     ##############################
     # Logging
@@ -50,29 +50,7 @@ class PFSenseVIPModule(PFSenseModuleBase):
         self.setup_vip_cmds = ""
 
         # get interfaces on which vips can be set
-        # function build_if_list https://github.com/pfsense/pfsense/blob/master/src/usr/local/www/firewall_virtual_ip_edit.php
-        get_interface_cmd = (
-            'require_once("/etc/inc/interfaces.inc");'
-            '$list = array();'
-            '$interfaces = get_configured_interface_with_descr(true);'
-	        '$carplist = get_configured_vip_list("all", VIP_CARP);'
-
-	        'foreach ($carplist as $vipname => $address) {\n'
-            '$interfaces[$vipname] = $address;'
-		    '$interfaces[$vipname] .= " (";'
-		    'if (get_vip_descr($address)) {\n'
-			'$interfaces[$vipname] .= get_vip_descr($address);'
-		    '} else {\n'
-			'$vip = get_configured_vip($vipname);'
-			'$interfaces[$vipname] .= "vhid: {$vip["vhid"]}";'
-		    '}\n'
-		    '$interfaces[$vipname] .= ")";'
-	        '}\n'
-            '$interfaces["lo0"] = "Localhost";'
-            'echo json_encode($interfaces);'
-        )
-
-        self.interfaces = self.pfsense.php(get_interface_cmd)
+        self.interfaces = self.pfsense.get_port_inventory()['vip_interfaces']
 
     ##############################
     # params processing
@@ -37,40 +37,12 @@ class PFSenseVlanModule(PFSenseModuleBase):
             self.root_elt = self.pfsense.new_element('vlans')
             self.pfsense.root.append(self.root_elt)
 
-        self.setup_vlan_cmds = ""
+        # the vlans interfaces to destroy and to create, applied in one batch by get_update_cmds
+        self.vlans_to_destroy = []
+        self.vlans_to_create = []
 
         # get physical interfaces on which vlans can be set
-        get_interface_cmd = (
-            'require_once("/etc/inc/interfaces.inc");'
-            '$portlist = get_interface_list();'
-            '$lagglist = get_lagg_interface_list();'
-            '$portlist = array_merge($portlist, $lagglist);'
-            'foreach ($lagglist as $laggif => $lagg) {'
-            "    $laggmembers = explode(',', $lagg['members']);"
-            '    foreach ($laggmembers as $lagm)'
-            '        if (isset($portlist[$lagm]))'
-            '            unset($portlist[$lagm]);'
-            '}')
-
-        if self.pfsense.is_at_least_2_5_0():
-            get_interface_cmd += (
-                '$list = array();'
-                'foreach ($portlist as $ifn => $ifinfo) {'
-                '  $list[$ifn] = $ifn . " (" . $ifinfo["mac"] . ")";'
-                '  $iface = convert_real_interface_to_friendly_interface_name($ifn);'
-                '  if (isset($iface) && strlen($iface) > 0)'
-                '    $list[$ifn] .= " - $iface";'
-                '}'
-                'echo json_encode($list);')
-        else:
-            get_interface_cmd += (
-                '$list = array();'
-                'foreach ($portlist as $ifn => $ifinfo)'
-                '   if (is_jumbo_capable($ifn))'
-                '       array_push($list, $ifn);'
-                'echo json_encode($list);')
-
-        self.interfaces = self.pfsense.php(get_interface_cmd)
+        self.interfaces = self.pfsense.get_port_inventory()['vlan_ports']
 
     ##############################
     # params processing
@@ -125,39 +97,28 @@ class PFSenseVlanModule(PFSenseModuleBase):
     ##############################
     # XML processing
     #
-    def _cmd_create(self):
-        """ return the php shell to create the vlan's interface """
-        cmd = "$vlan = array();\n"
-        cmd += "$vlan['if'] = '{0}';\n".format(self.obj['if'])
-        cmd += "$vlan['tag'] = '{0}';\n".format(self.obj['tag'])
-        cmd += "$vlan['pcp'] = '{0}';\n".format(self.obj['pcp'])
-        cmd += "$vlan['descr'] = '{0}';\n".format(self.obj['descr'])
-        cmd += "$vlan['vlanif'] = '{0}';\n".format(self.obj['vlanif'])
-        cmd += "$vlanif = interface_vlan_configure($vlan);\n"
-
-        cmd += "if ($vlanif == NULL || $vlanif != $vlan['vlanif']) {pfSense_interface_destroy('%s');} else {\n" % (self.obj['vlanif'])
+    def _add_vlan_to_create(self):
+        """ add the vlan's interface to the ones to create """
+        vlan = dict()
+        for field in ['if', 'tag', 'pcp', 'descr', 'vlanif']:
+            vlan[field] = self.obj[field]
 
         # if vlan is assigned to an interface, configuration needs to be applied again
-        interface = self.pfsense.get_interface_by_port('{0}.{1}'.format(self.obj['if'], self.obj['tag']))
-        if interface is not None:
-            cmd += "interface_configure('{0}', true);\n".format(interface)
-
-        cmd += '}\n'
-
-        return cmd
+        vlan['interface'] = self.pfsense.get_interface_by_port(self.obj['vlanif'])
+        self.vlans_to_create.append(vlan)
 
     def _copy_and_add_target(self):
         """ create the XML target_elt """
         super(PFSenseVlanModule, self)._copy_and_add_target()
-        self.setup_vlan_cmds += self._cmd_create()
+        self._add_vlan_to_create()
 
     def _copy_and_update_target(self):
         """ update the XML target_elt """
         old_vlanif = self.target_elt.find('vlanif').text
         (before, changed) = super(PFSenseVlanModule, self)._copy_and_update_target()
         if changed:
-            self.setup_vlan_cmds += "pfSense_interface_destroy('{0}');\n".format(old_vlanif)
-            self.setup_vlan_cmds += self._cmd_create()
+            self.vlans_to_destroy.append(old_vlanif)
+            self._add_vlan_to_create()
 
         return (before, changed)
 
@@ -175,17 +136,54 @@ class PFSenseVlanModule(PFSenseModuleBase):
             self.module.fail_json(
                 msg='vlan {0} on {1} cannot be deleted because it is still being used as an interface'.format(self.obj['tag'], self.obj['if'])
             )
-        self.setup_vlan_cmds += "pfSense_interface_destroy('{0}');\n".format(self.target_elt.find('vlanif').text)
+        self.vlans_to_destroy.append(self.target_elt.find('vlanif').text)
 
     ##############################
     # run
     #
+    def _get_vlans_cmds(self):
+        """ return the php commands destroying and creating all the vlans interfaces in one pass
+
+            The interfaces are destroyed first (an updated vlan is destroyed and created again), then all the new
+            interfaces are created, and the interfaces list cache is refreshed once before reconfiguring the
+            interfaces assigned to the created vlans. The outcome of each vlan is printed as one
+            "vlan <vlanif> <destroyed|created|failed>" line. """
+        cmd = ''
+        if self.vlans_to_destroy:
+            cmd += '$vlans_to_destroy = array({0});\n'.format(', '.join([self._php_str(vlanif) for vlanif in self.vlans_to_destroy]))
+            cmd += 'foreach ($vlans_to_destroy as $vlanif) {\n'
+            cmd += '    pfSense_interface_destroy($vlanif);\n'
+            cmd += '    echo "vlan {$vlanif} destroyed\\n";\n'
+            cmd += '}\n'
+
+        if self.vlans_to_create:
+            cmd += '$vlans_to_create = array(\n'
+            for vlan in self.vlans_to_create:
+                fields = ['{0} => {1}'.format(self._php_str(field), self._php_str(vlan[field]))
+                          for field in ['if', 'tag', 'pcp', 'descr', 'vlanif', 'interface']]
+                cmd += '    array({0}),\n'.format(', '.join(fields))
+            cmd += ');\n'
+            cmd += '$vlans_interfaces = array();\n'
+            cmd += 'foreach ($vlans_to_create as $vlan) {\n'
+            cmd += '    $vlanif = interface_vlan_configure($vlan);\n'
+            cmd += "    if ($vlanif == NULL || $vlanif != $vlan['vlanif']) {\n"
+            cmd += "        pfSense_interface_destroy($vlan['vlanif']);\n"
+            cmd += '        echo "vlan {$vlan[\'vlanif\']} failed\\n";\n'
+            cmd += '    } else {\n'
+            cmd += '        echo "vlan {$vlan[\'vlanif\']} created\\n";\n'
+            cmd += "        if ($vlan['interface'] != '') $vlans_interfaces[] = $vlan['interface'];\n"
+            cmd += '    }\n'
+            cmd += '}\n'
+            cmd += 'get_interface_arr(true);\n'
+            cmd += 'foreach ($vlans_interfaces as $interface) interface_configure($interface, true);\n'
+        return cmd
+
     def get_update_cmds(self):
         """ build and return php commands to setup interfaces """
         cmd = 'require_once("filter.inc");\n'
-        if self.setup_vlan_cmds != "":
+        if self.vlans_to_destroy or self.vlans_to_create:
             cmd += 'require_once("interfaces.inc");\n'
-            cmd += self.setup_vlan_cmds
+            cmd += self._get_vlans_cmds()
         cmd += "if (filter_configure() == 0) { clear_subsystem_dirty('filter'); }"
         return cmd
 
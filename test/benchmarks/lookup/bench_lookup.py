@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+""" Benchmark of the pfsense lookup plugin compilation phases on generated definitions
+
+    Each scale is run in its own process, so the peak RSS measured after each phase only depends on this scale.
+    The results are compared to the baselines file and the script fails when a phase is slower or uses more memory
+    than its baseline by more than the tolerance.
+
+    python test/benchmarks/lookup/bench_lookup.py                     # compare all scales to the baselines
+    python test/benchmarks/lookup/bench_lookup.py -s 100 -r 1         # run only the 100x scale, once
+    python test/benchmarks/lookup/bench_lookup.py --update-baselines  # store the results as the new baselines """
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+PLUGIN_DIR = os.path.join(BENCHMARK_DIR, '..', '..', '..', 'lookup_plugins')
+BASELINES_FILE = os.path.join(BENCHMARK_DIR, 'baselines.json')
+SCALES = [1, 10, 100]
+PHASES = ['parse', 'generate_rules', 'generate_aliases']
+
+
+def get_peak_rss():
+    """ return the peak RSS of the process, in MB """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return peak / (1024 * 1024)
+    return peak / 1024
+
+
+def run_scale(scale, target):
+    """ compile target at scale and return the time and peak RSS after each phase """
+    sys.path.insert(0, BENCHMARK_DIR)
+    sys.path.insert(0, PLUGIN_DIR)
+    from definitions_generator import DefinitionsGenerator
+    from pfsense import PFSenseAliasFactory, PFSenseData, PFSenseDataParser, PFSenseRuleFactory
+
+    definitions = DefinitionsGenerator.scaled(scale).generate()
+    data = PFSenseData(
+        hosts_aliases=definitions['hosts_aliases'],
+        ports_aliases=definitions['ports_aliases'],
+        pfsenses=definitions['pfsenses'],
+        rules=definitions['rules'],
+        target_name=target,
+    )
+
+    results = {}
+
+    started = time.time()
+    if not PFSenseDataParser(data).parse():
+        raise AssertionError('invalid generated definitions')
+    results['parse'] = dict(time=time.time() - started, peak_rss=get_peak_rss())
+
+    started = time.time()
+    PFSenseRuleFactory(data, display_warnings=False).generate_rules()
+    results['generate_rules'] = dict(time=time.time() - started, peak_rss=get_peak_rss())
+
+    started = time.time()
+    PFSenseAliasFactory(data).generate_aliases()
+    results['generate_aliases'] = dict(time=time.time() - started, peak_rss=get_peak_rss())
+
+    return results
+
+
+def run_scale_process(scale, target, repeat):
+    """ run a scale repeat times in new processes and return the best results """
+    best = None
+    for dummy in range(repeat):
+        output = subprocess.check_output([sys.executable, os.path.abspath(__file__), '--child', str(scale), '--target', target])
+        results = json.loads(output.decode('utf-8').splitlines()[-1])
+        if best is None:
+            best = results
+        else:
+            for phase in PHASES:
+                for measure in ['time', 'peak_rss']:
+                    best[phase][measure] = min(best[phase][measure], results[phase][measure])
+    for phase in PHASES:
+        best[phase]['time'] = round(best[phase]['time'], 4)
+        best[phase]['peak_rss'] = round(best[phase]['peak_rss'], 1)
+    return best
+
+
+def compare(scale, results, baselines, time_tolerance, memory_tolerance, time_margin):
+    """ print results and return the regressions compared to baselines """
+    regressions = []
+    baseline = baselines.get(str(scale), {})
+    for phase in PHASES:
+        line = '{0:>4}x {1:<18} {2:9.3f}s {3:9.1f} MB'.format(scale, phase, results[phase]['time'], results[phase]['peak_rss'])
+        if phase in baseline:
+            line += '   (baseline {0:9.3f}s {1:9.1f} MB)'.format(baseline[phase]['time'], baseline[phase]['peak_rss'])
+            # the shortest phases are too noisy to be compared with a ratio only
+            if results[phase]['time'] > max(baseline[phase]['time'] * time_tolerance, baseline[phase]['time'] + time_margin):
+                regressions.append('{0}x {1}: time {2:.3f}s > {3:.3f}s'.format(scale, phase, results[phase]['time'], baseline[phase]['time']))
+            if results[phase]['peak_rss'] > baseline[phase]['peak_rss'] * memory_tolerance:
+                regressions.append('{0}x {1}: peak RSS {2:.1f} MB > {3:.1f} MB'.format(
+                    scale, phase, results[phase]['peak_rss'], baseline[phase]['peak_rss']))
+        print(line)
+        sys.stdout.flush()
+    return regressions
+
+
+def main():
+    """ run the benchmark """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-s", "--scales", type=int, nargs='+', default=SCALES, help="scales to run")
+    parser.add_argument("-t", "--target", default='pf_0', help="firewall to compile")
+    parser.add_argument("-r", "--repeat", type=int, default=3, help="number of runs of each scale (the best one is kept)")
+    parser.add_argument("--baselines", default=BASELINES_FILE, help="baselines file")
+    parser.add_argument("--update-baselines", action="store_true", help="store the results as the new baselines")
+    parser.add_argument("--time-tolerance", type=float, default=1.5, help="maximum ratio between a phase time and its baseline")
+    parser.add_argument("--time-margin", type=float, default=0.05, help="time (in seconds) a phase may always exceed its baseline by")
+    parser.add_argument("--memory-tolerance", type=float, default=1.2, help="maximum ratio between a phase peak RSS and its baseline")
+    parser.add_argument("--child", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child is not None:
+        print(json.dumps(run_scale(args.child, args.target)))
+        return 0
+
+    baselines = {}
+    if os.path.exists(args.baselines):
+        with open(args.baselines) as f:
+            baselines = json.load(f)
+
+    regressions = []
+    for scale in args.scales:
+        results = run_scale_process(scale, args.target, args.repeat)
+        regressions.extend(compare(scale, results, baselines.get('scales', {}), args.time_tolerance, args.memory_tolerance, args.time_margin))
+        baselines.setdefault('scales', {})[str(scale)] = results
+
+    if args.update_baselines:
+        baselines['python'] = platform.python_version()
+        baselines['machine'] = platform.machine()
+        with open(args.baselines, 'w') as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print('Baselines written to {0}'.format(args.baselines))
+        return 0
+
+    if regressions:
+        print('Regressions:')
+        for regression in regressions:
+            print('  ' + regression)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
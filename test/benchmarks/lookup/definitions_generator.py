@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+""" Deterministic generator of large pfsense lookup definitions files, for benchmarks """
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import argparse
+import random
+import sys
+from collections import OrderedDict
+
+import yaml
+
+PORTS = ['22', '25', '53', '80', '123', '161', '389', '443', '445', '636', '3128', '3389', '5060', '8080', '8443']
+PORTS_RANGES = ['1000-1010', '5900-5905', '8000-8099', '10000-20000']
+PROTOCOLS = ['tcp', 'udp', 'tcp/udp', 'icmp', 'any']
+
+
+class DefinitionsGenerator(object):
+    """ Generate definitions with firewalls sites linked by a vpn interface
+
+        Each firewall gets a WAN interface, interfaces_count lan interfaces and a vpn interface routing the other sites.
+        hosts_count hosts aliases are spread over the lan networks, nested_count aliases nest hosts, networks and
+        other nested aliases, ports_count ports aliases mix ports, ranges and other ports aliases. rules_count rules
+        are grouped by 10 in separators. The same parameters and seed always generate the same definitions. """
+
+    def __init__(self, firewalls=2, interfaces=3, hosts=30, nested=10, ports=10, rules=50, seed=1):
+        self.firewalls_count = firewalls
+        self.interfaces_count = interfaces
+        self.hosts_count = hosts
+        self.nested_count = nested
+        self.ports_count = ports
+        self.rules_count = rules
+        self._random = random.Random(seed)
+
+    @classmethod
+    def scaled(cls, factor, seed=1):
+        """ return a generator for factor times the base definitions (the interfaces per firewall are not scaled) """
+        return cls(firewalls=2 * factor, hosts=30 * factor, nested=10 * factor, ports=10 * factor, rules=50 * factor, seed=seed)
+
+    @staticmethod
+    def _network(site, interface):
+        """ return the network prefix of the interface of a site """
+        return '{0}.{1}.{2}'.format(10 + site // 256, site % 256, interface)
+
+    def _sample(self, values, count_min, count_max):
+        """ return a random sample of values """
+        return self._random.sample(values, min(len(values), self._random.randint(count_min, count_max)))
+
+    def _generate_pfsenses(self, hosts_aliases):
+        """ return the pfsenses definitions, adding the sites networks aliases """
+        pfsenses = OrderedDict()
+        for site in range(self.firewalls_count):
+            networks = []
+            interfaces = OrderedDict()
+            interfaces['WAN'] = OrderedDict(remote_networks='internet')
+            for interface in range(self.interfaces_count):
+                name = 'net_{0}_{1}'.format(site, interface)
+                hosts_aliases[name] = OrderedDict(ip='{0}.0/24'.format(self._network(site, interface)))
+                networks.append(name)
+                interfaces['LAN{0}'.format(interface)] = OrderedDict(ip='{0}.1/24'.format(self._network(site, interface)))
+
+            hosts_aliases['site_{0}'.format(site)] = OrderedDict(ip=' '.join(networks))
+            others = ['site_{0}'.format(other) for other in range(self.firewalls_count) if other != site]
+            if others:
+                interfaces['VPN'] = OrderedDict(ip='172.31.{0}.{1}/30'.format(site // 64, (site % 64) * 4 + 1), remote_networks=' '.join(others))
+
+            pfsenses['pf_{0}'.format(site)] = OrderedDict(interfaces=interfaces)
+        return pfsenses
+
+    def _generate_hosts_aliases(self, hosts_aliases):
+        """ add the hosts and nested aliases """
+        hosts = []
+        for host in range(self.hosts_count):
+            site = host % self.firewalls_count
+            interface = (host // self.firewalls_count) % self.interfaces_count
+            name = 'host_{0}'.format(host)
+            index = host // (self.firewalls_count * self.interfaces_count)
+            hosts_aliases[name] = OrderedDict(ip='{0}.{1}'.format(self._network(site, interface), 10 + index % 240))
+            hosts.append(name)
+
+        # nested aliases only include aliases defined before them, so there is no cycle
+        members = hosts + list(name for name in hosts_aliases if name.startswith('net_'))
+        for nested in range(self.nested_count):
+            name = 'group_{0}'.format(nested)
+            hosts_aliases[name] = OrderedDict(ip=' '.join(self._sample(members, 2, 6)))
+            members.append(name)
+
+    def _generate_ports_aliases(self):
+        """ return the ports aliases definitions """
+        ports_aliases = OrderedDict()
+        for port in range(self.ports_count):
+            # each alias gets its own port, so no alias duplicates another one
+            values = self._sample(PORTS + PORTS_RANGES, 1, 3) + [str(30000 + port)]
+            if port >= 2 and self._random.random() < 0.2:
+                values.append('port_{0}'.format(self._random.randint(0, port - 1)))
+            ports_aliases['port_{0}'.format(port)] = OrderedDict(port=' '.join(values))
+        return ports_aliases
+
+    def _generate_rules(self, hosts_aliases, ports_aliases):
+        """ return the rules definitions """
+        rules = OrderedDict()
+        rules['options'] = OrderedDict(log='yes')
+        addresses = list(name for name in hosts_aliases if name != 'internet')
+        ports = list(ports_aliases.keys()) + PORTS
+
+        separator = None
+        for rule in range(self.rules_count):
+            if rule % 10 == 0:
+                separator = OrderedDict()
+                rules['SEPARATOR_{0}'.format(rule // 10)] = separator
+
+            definition = OrderedDict()
+            definition['src'] = 'any' if rule % 13 == 0 else ' '.join(self._sample(addresses, 1, 3))
+            definition['dst'] = 'any' if rule % 17 == 0 else ' '.join(self._sample(addresses, 1, 3))
+            definition['protocol'] = self._random.choice(PROTOCOLS)
+            if definition['protocol'] in ['tcp', 'udp', 'tcp/udp']:
+                definition['dst_port'] = ' '.join(self._sample(ports, 1, 3))
+            elif definition['protocol'] == 'icmp':
+                definition['icmptype'] = 'any'
+            if rule % 11 == 0:
+                definition['action'] = 'block'
+            separator['rule_{0}'.format(rule)] = definition
+        return rules
+
+    def generate(self):
+        """ return the definitions """
+        hosts_aliases = OrderedDict()
+        hosts_aliases['internet'] = OrderedDict(ip='0.0.0.0/0')
+        pfsenses = self._generate_pfsenses(hosts_aliases)
+        self._generate_hosts_aliases(hosts_aliases)
+        ports_aliases = self._generate_ports_aliases()
+        rules = self._generate_rules(hosts_aliases, ports_aliases)
+
+        definitions = OrderedDict()
+        definitions['pfsenses'] = pfsenses
+        definitions['rules'] = rules
+        definitions['hosts_aliases'] = hosts_aliases
+        definitions['ports_aliases'] = ports_aliases
+        return definitions
+
+
+def dump(definitions, stream):
+    """ write definitions as yaml into stream """
+    class OrderedDumper(yaml.SafeDumper):
+        pass
+
+    OrderedDumper.add_representer(OrderedDict, lambda dumper, data: dumper.represent_dict(data.items()))
+    yaml.dump(definitions, stream, Dumper=OrderedDumper, default_flow_style=None)
+
+
+def main():
+    """ write generated definitions into a file """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("file", help="output file ('-' for stdout)")
+    parser.add_argument("-s", "--scale", type=int, help="generate scale times the base definitions (other counts are ignored)")
+    parser.add_argument("--firewalls", type=int, default=2, help="number of firewalls")
+    parser.add_argument("--interfaces", type=int, default=3, help="number of lan interfaces per firewall")
+    parser.add_argument("--hosts", type=int, default=30, help="number of hosts aliases")
+    parser.add_argument("--nested", type=int, default=10, help="number of nested aliases")
+    parser.add_argument("--ports", type=int, default=10, help="number of ports aliases")
+    parser.add_argument("--rules", type=int, default=50, help="number of rules")
+    parser.add_argument("--seed", type=int, default=1, help="random seed")
+    args = parser.parse_args()
+
+    if args.scale:
+        generator = DefinitionsGenerator.scaled(args.scale, args.seed)
+    else:
+        generator = DefinitionsGenerator(args.firewalls, args.interfaces, args.hosts, args.nested, args.ports, args.rules, args.seed)
+
+    definitions = generator.generate()
+    if args.file == '-':
+        dump(definitions, sys.stdout)
+    else:
+        with open(args.file, 'w') as f:
+            dump(definitions, f)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,290 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+""" Benchmark of the pfsense aggregate, rule and ipsec aggregate modules on generated config.xml files
+
+    The modules run end to end (main() included) with the mocks of the unit tests: the config.xml is parsed from
+    the generated one, php, phpshell and get_version are mocked, and the written config.xml is discarded.
+    Each module desired state is the generated configuration with 10% of its entries modified, 5% added
+    and 5% removed (and purged). pfsense_rule adds a single rule in the middle of the lan rules.
+    Each scale is run in its own process, so the peak RSS measured after each module only depends on this scale.
+    The results are compared to the baselines file and the script fails when a module is slower or uses more
+    memory than its baseline by more than the tolerance.
+
+    The modules and the unit tests have to be installed into ansible sources with misc/local2ansible first:
+
+    export PYTHONPATH=$ANSIBLE_HOME/lib:$ANSIBLE_HOME/test
+    python test/benchmarks/modules/bench_modules.py                     # compare all scales to the baselines
+    python test/benchmarks/modules/bench_modules.py -s 10 -r 1          # run only the 10x scale, once
+    python test/benchmarks/modules/bench_modules.py --update-baselines  # store the results as the new baselines """
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import argparse
+import importlib
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from copy import deepcopy
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+BASELINES_FILE = os.path.join(BENCHMARK_DIR, 'baselines.json')
+SCALES = [1, 10, 50]
+MODULES = ['pfsense_aggregate', 'pfsense_rule', 'pfsense_ipsec_aggregate']
+
+
+def get_peak_rss():
+    """ return the peak RSS of the process, in MB """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return peak / (1024 * 1024)
+    return peak / 1024
+
+
+##############################
+# desired states
+#
+def churn(items, key, modify, used=None):
+    """ return a copy of items with 10% of them modified, 5% removed and 5% added (the used ones are never removed) """
+    desired = []
+    for index, item in enumerate(items):
+        if index % 20 == 7 and (used is None or item[key] not in used):
+            continue
+        item = deepcopy(item)
+        if index % 10 == 3:
+            modify(item, index)
+        desired.append(item)
+
+    for index, item in enumerate(items):
+        if index % 20 == 11:
+            item = deepcopy(item)
+            item[key] = 'new_' + item[key]
+            modify(item, index)
+            desired.append(item)
+    return desired
+
+
+def aggregate_args(model):
+    """ return the pfsense_aggregate arguments """
+    def modify_alias(alias, index):
+        alias['descr'] = 'modified {0}'.format(index)
+
+    def modify_rule(rule, index):
+        rule['log'] = not rule['log']
+        rule.pop('tracker', None)
+
+    def modify_nat_outbound(nat, index):
+        nat['ipprotocol'] = 'inet'
+
+    def modify_nat_port_forward(nat, index):
+        nat['target'] = nat['target'].split(':')[0] + ':2222'
+
+    used = set()
+    for rule in model['rules']:
+        used.update([rule['source'], rule['destination'], rule.get('destination_port')])
+    aliases = churn(model['aliases'], 'name', modify_alias, used)
+    rules = churn(model['rules'], 'name', modify_rule)
+    nat_outbounds = churn(model['nat_outbounds'], 'descr', modify_nat_outbound)
+    nat_port_forwards = churn(model['nat_port_forwards'], 'descr', modify_nat_port_forward)
+    return dict(
+        aggregated_aliases=aliases,
+        aggregated_nat_outbounds=nat_outbounds,
+        aggregated_nat_port_forwards=nat_port_forwards,
+        aggregated_rules=rules,
+        aggregated_rule_separators=model['rule_separators'],
+        aggregated_vlans=model['vlans'],
+        purge_aliases=True,
+        purge_nat_outbounds=True,
+        purge_nat_port_forwards=True,
+        purge_rules=True,
+        purge_rule_separators=True,
+    )
+
+
+def rule_args(model):
+    """ return the pfsense_rule arguments, adding a rule in the middle of the lan rules """
+    lan_rules = [rule for rule in model['rules'] if rule['interface'] == 'lan']
+    args = dict(name='benchmark_rule', interface='lan', source='any', destination='NET:lan', protocol='tcp', destination_port='443')
+    if lan_rules:
+        args['after'] = lan_rules[len(lan_rules) // 2]['name']
+    return args
+
+
+def ipsec_aggregate_args(model):
+    """ return the pfsense_ipsec_aggregate arguments """
+    def modify_ipsec(ipsec, index):
+        ipsec['preshared_key'] = 'modified_{0}'.format(index)
+
+    def modify_proposal(proposal, index):
+        proposal['dhgroup'] = 19
+
+    def modify_p2(p2, index):
+        # a phase1 can not have two phase2 with the same networks
+        p2['remote'] = '192.168.{0}.{1}/32'.format(index // 256, index % 256)
+        p2['aes_len'] = '128'
+
+    ipsecs = churn(model['ipsecs'], 'descr', modify_ipsec)
+    proposals = churn(model['ipsec_proposals'], 'descr', modify_proposal)
+    p2s = churn(model['ipsec_p2s'], 'descr', modify_p2)
+
+    # drop the proposals and phase2 of the removed tunnels, they are purged with them
+    descrs = set(ipsec['descr'] for ipsec in ipsecs)
+    proposals = [proposal for proposal in proposals if proposal['descr'] in descrs]
+    for p2 in p2s:
+        if p2['p1_descr'] not in descrs:
+            p2['p1_descr'] = 'new_' + p2['p1_descr']
+    p2s = [p2 for p2 in p2s if p2['p1_descr'] in descrs]
+    return dict(
+        aggregated_ipsecs=ipsecs,
+        aggregated_ipsec_proposals=proposals,
+        aggregated_ipsec_p2s=p2s,
+        purge_ipsecs=True,
+        purge_ipsec_proposals=True,
+        purge_ipsec_p2s=True,
+    )
+
+
+MODULES_ARGS = dict(
+    pfsense_aggregate=aggregate_args,
+    pfsense_rule=rule_args,
+    pfsense_ipsec_aggregate=ipsec_aggregate_args,
+)
+
+
+##############################
+# run
+#
+def run_scale(scale):
+    """ run the modules at scale and return the time and peak RSS after each module """
+    sys.path.insert(0, BENCHMARK_DIR)
+    from config_generator import ConfigGenerator, to_xml
+    from xml.etree.ElementTree import ElementTree, fromstring, tostring
+    from units.modules.utils import AnsibleExitJson, AnsibleFailJson, set_module_args
+    from units.modules.network.pfsense.pfsense_module import TestPFSenseModule
+
+    class ModuleBenchmark(TestPFSenseModule):
+        """ the unit tests mocks, without any test """
+
+        def runTest(self):
+            pass
+
+    model = ConfigGenerator.scaled(scale).generate()
+    config = tostring(to_xml(model).getroot())
+
+    case = ModuleBenchmark()
+    case.setUp()
+    case.php.return_value = dict(
+        vlan_ports=model['physical_interfaces'], jumbo=model['physical_interfaces'], vip_interfaces=dict(), assignable_ports=dict(), ifconfig_media=[])
+    results = {}
+    try:
+        for name in MODULES:
+            module = importlib.import_module('ansible.modules.network.pfsense.' + name)
+            set_module_args(MODULES_ARGS[name](model))
+            case.parse.return_value = ElementTree(fromstring(config))
+
+            started = time.time()
+            try:
+                module.main()
+            except AnsibleExitJson:
+                pass
+            except AnsibleFailJson as exc:
+                raise AssertionError('{0} failed: {1}'.format(name, exc.args[0]['msg']))
+            results[name] = dict(time=time.time() - started, peak_rss=get_peak_rss())
+    finally:
+        case.tearDown()
+        case.doCleanups()
+
+    return results
+
+
+def run_scale_process(scale, repeat):
+    """ run a scale repeat times in new processes and return the best results """
+    best = None
+    for dummy in range(repeat):
+        output = subprocess.check_output([sys.executable, os.path.abspath(__file__), '--child', str(scale)])
+        results = json.loads(output.decode('utf-8').splitlines()[-1])
+        if best is None:
+            best = results
+        else:
+            for name in MODULES:
+                for measure in ['time', 'peak_rss']:
+                    best[name][measure] = min(best[name][measure], results[name][measure])
+    for name in MODULES:
+        best[name]['time'] = round(best[name]['time'], 4)
+        best[name]['peak_rss'] = round(best[name]['peak_rss'], 1)
+    return best
+
+
+def compare(scale, results, baselines, time_tolerance, memory_tolerance, time_margin):
+    """ print results and return the regressions compared to baselines """
+    regressions = []
+    baseline = baselines.get(str(scale), {})
+    for name in MODULES:
+        line = '{0:>4}x {1:<24} {2:9.3f}s {3:9.1f} MB'.format(scale, name, results[name]['time'], results[name]['peak_rss'])
+        if name in baseline:
+            line += '   (baseline {0:9.3f}s {1:9.1f} MB)'.format(baseline[name]['time'], baseline[name]['peak_rss'])
+            # the shortest runs are too noisy to be compared with a ratio only
+            if results[name]['time'] > max(baseline[name]['time'] * time_tolerance, baseline[name]['time'] + time_margin):
+                regressions.append('{0}x {1}: time {2:.3f}s > {3:.3f}s'.format(scale, name, results[name]['time'], baseline[name]['time']))
+            if results[name]['peak_rss'] > baseline[name]['peak_rss'] * memory_tolerance:
+                regressions.append('{0}x {1}: peak RSS {2:.1f} MB > {3:.1f} MB'.format(
+                    scale, name, results[name]['peak_rss'], baseline[name]['peak_rss']))
+        print(line)
+        sys.stdout.flush()
+    return regressions
+
+
+def main():
+    """ run the benchmark """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-s", "--scales", type=int, nargs='+', default=SCALES, help="scales to run")
+    parser.add_argument("-r", "--repeat", type=int, default=3, help="number of runs of each scale (the best one is kept)")
+    parser.add_argument("--baselines", default=BASELINES_FILE, help="baselines file")
+    parser.add_argument("--update-baselines", action="store_true", help="store the results as the new baselines")
+    parser.add_argument("--time-tolerance", type=float, default=1.5, help="maximum ratio between a module time and its baseline")
+    parser.add_argument("--time-margin", type=float, default=0.05, help="time (in seconds) a module may always exceed its baseline by")
+    parser.add_argument("--memory-tolerance", type=float, default=1.2, help="maximum ratio between a module peak RSS and its baseline")
+    parser.add_argument("--child", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child is not None:
+        print(json.dumps(run_scale(args.child)))
+        return 0
+
+    baselines = {}
+    if os.path.exists(args.baselines):
+        with open(args.baselines) as f:
+            baselines = json.load(f)
+
+    regressions = []
+    for scale in args.scales:
+        results = run_scale_process(scale, args.repeat)
+        regressions.extend(compare(scale, results, baselines.get('scales', {}), args.time_tolerance, args.memory_tolerance, args.time_margin))
+        baselines.setdefault('scales', {})[str(scale)] = results
+
+    if args.update_baselines:
+        baselines['python'] = platform.python_version()
+        baselines['machine'] = platform.machine()
+        with open(args.baselines, 'w') as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print('Baselines written to {0}'.format(args.baselines))
+        return 0
+
+    if regressions:
+        print('Regressions:')
+        for regression in regressions:
+            print('  ' + regression)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
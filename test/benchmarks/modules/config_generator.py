@@ -0,0 +1,474 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+""" Deterministic generator of large pfsense config.xml files, for benchmarks """
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import argparse
+import os
+import random
+import sys
+import xml.etree.ElementTree as ET
+from collections import OrderedDict
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+SKELETON_FILE = os.path.join(BENCHMARK_DIR, '..', '..', 'units', 'modules', 'network', 'pfsense', 'fixtures', 'pfsense_ipsec_aggregate_config.xml')
+
+# sections of the skeleton replaced by the generated ones
+GENERATED_SECTIONS = ['interfaces', 'staticroutes', 'nat', 'filter', 'ipsec', 'aliases', 'gateways', 'vlans']
+
+PORTS = ['22', '25', '53', '80', '123', '443', '445', '3128', '3389', '8080']
+PROTOCOLS = ['tcp', 'udp', 'tcp/udp', 'icmp', 'any']
+TIMESTAMP = '1600000000'
+
+
+class ConfigGenerator(object):
+    """ Generate a pfsense configuration with many interfaces, aliases, rules, NAT entries and IPsec tunnels
+
+        The firewall gets a wan and a lan interface, then interfaces_count optional interfaces: half of them on
+        their own physical port, the other half on vlans of the lan port. Each interface gets a gateway.
+        aliases_count aliases mix hosts, networks and ports aliases, rules_count rules are spread over the
+        interfaces and grouped by 10 under separators. tunnels_count IPsec tunnels get phase2_count phase2 each.
+
+        generate() returns the model of the configuration (a dict of lists of dicts using the modules parameters
+        names), to_xml() converts a model into the config.xml tree. The model is meant to be used as the desired
+        state of the benchmarked modules. The same parameters and seed always generate the same configuration. """
+
+    def __init__(self, interfaces=4, aliases=40, rules=60, nat=10, tunnels=5, phase2=2, seed=1):
+        self.interfaces_count = interfaces
+        self.aliases_count = aliases
+        self.rules_count = rules
+        self.nat_count = nat
+        self.tunnels_count = tunnels
+        self.phase2_count = phase2
+        self._random = random.Random(seed)
+
+    @classmethod
+    def scaled(cls, factor, seed=1):
+        """ return a generator for factor times the base configuration (the phase2 per tunnel are not scaled) """
+        return cls(interfaces=4 * factor, aliases=40 * factor, rules=60 * factor, nat=10 * factor, tunnels=5 * factor, seed=seed)
+
+    @staticmethod
+    def _network(index):
+        """ return the network prefix of the interface index """
+        return '10.{0}.{1}'.format(index // 256, index % 256)
+
+    def _sample(self, values, count_min, count_max):
+        """ return a random sample of values """
+        return self._random.sample(values, min(len(values), self._random.randint(count_min, count_max)))
+
+    def _generate_interfaces(self, model):
+        """ add the interfaces, vlans and gateways """
+        physicals = ['vmx0', 'vmx1']
+        interfaces = [
+            OrderedDict([('name', 'wan'), ('descr', 'wan'), ('port', 'vmx0'), ('ipaddr', '192.168.240.137'), ('subnet', '24')]),
+            OrderedDict([('name', 'lan'), ('descr', 'lan'), ('port', 'vmx1'), ('ipaddr', '10.0.0.1'), ('subnet', '24')]),
+        ]
+        vlans = []
+        for index in range(1, self.interfaces_count + 1):
+            if index % 2:
+                port = 'vmx{0}'.format(len(physicals))
+                physicals.append(port)
+            else:
+                vlan = OrderedDict([('interface', 'vmx1'), ('vlan_id', 100 + index), ('priority', None), ('descr', 'vlan {0}'.format(index))])
+                vlans.append(vlan)
+                port = 'vmx1.{0}'.format(vlan['vlan_id'])
+            interfaces.append(OrderedDict([
+                ('name', 'opt{0}'.format(index)), ('descr', 'net_{0}'.format(index)), ('port', port),
+                ('ipaddr', '{0}.1'.format(self._network(index))), ('subnet', '24'),
+            ]))
+
+        gateways = []
+        for index, interface in enumerate(interfaces):
+            gateways.append(OrderedDict([
+                ('name', 'GW_{0}'.format(interface['descr'].upper())), ('interface', interface['descr']),
+                ('gateway', '{0}.254'.format(self._network(index)) if index else '192.168.240.1'), ('descr', 'gateway {0}'.format(index)),
+            ]))
+
+        model['physical_interfaces'] = physicals
+        model['interfaces'] = interfaces
+        model['vlans'] = vlans
+        model['gateways'] = gateways
+
+    def _generate_aliases(self, model):
+        """ add the hosts, networks and ports aliases """
+        aliases = []
+        interfaces_count = len(model['interfaces'])
+        for index in range(self.aliases_count):
+            kind = index % 4
+            if kind == 3:
+                # each alias gets its own port, so no alias duplicates another one
+                address = ' '.join(self._sample(PORTS, 1, 3) + [str(30000 + index)])
+                aliases.append(OrderedDict([('name', 'port_{0}'.format(index)), ('type', 'port'), ('address', address), ('descr', 'ports {0}'.format(index))]))
+            elif kind == 2:
+                networks = ['{0}.0/24'.format(self._network(self._random.randint(1, interfaces_count))) for dummy in range(self._random.randint(1, 3))]
+                address = ' '.join(sorted(set(networks)))
+                aliases.append(OrderedDict([
+                    ('name', 'net_alias_{0}'.format(index)), ('type', 'network'), ('address', address), ('descr', 'networks {0}'.format(index)),
+                ]))
+            else:
+                network = self._network(index % interfaces_count)
+                address = '{0}.{1}'.format(network, 10 + (index // interfaces_count) % 240)
+                aliases.append(OrderedDict([('name', 'host_{0}'.format(index)), ('type', 'host'), ('address', address), ('descr', 'host {0}'.format(index))]))
+        model['aliases'] = aliases
+
+    def _generate_rules(self, model):
+        """ add the filter rules and their separators """
+        interfaces = [interface['descr'] for interface in model['interfaces']]
+        hosts = [alias['name'] for alias in model['aliases'] if alias['type'] != 'port']
+        ports = [alias['name'] for alias in model['aliases'] if alias['type'] == 'port'] + PORTS
+
+        rules = []
+        separators = []
+        for index in range(self.rules_count):
+            interface = interfaces[(index // 10) % len(interfaces)]
+            if index % 10 == 0:
+                separators.append(OrderedDict([('name', 'section_{0}'.format(index // 10)), ('interface', interface), ('color', 'info')]))
+
+            rule = OrderedDict([('name', 'rule_{0}'.format(index)), ('interface', interface)])
+            rule['action'] = 'block' if index % 11 == 0 else 'pass'
+            rule['source'] = 'any' if index % 13 == 0 or not hosts else self._random.choice(hosts)
+            rule['destination'] = 'any' if index % 17 == 0 or not hosts else self._random.choice(hosts + ['NET:' + interface])
+            rule['protocol'] = self._random.choice(PROTOCOLS)
+            if rule['protocol'] in ['tcp', 'udp', 'tcp/udp']:
+                rule['destination_port'] = self._random.choice(ports)
+            rule['log'] = index % 5 == 0
+            rule['tracker'] = 1000000000 + index
+            rules.append(rule)
+
+        model['rules'] = rules
+        model['rule_separators'] = separators
+
+    def _generate_nat(self, model):
+        """ add the NAT outbound and port forward rules """
+        nat_outbounds = []
+        nat_port_forwards = []
+        hosts = [alias for alias in model['aliases'] if alias['type'] == 'host']
+        for index in range(self.nat_count):
+            network = self._network(1 + index % self.interfaces_count) if self.interfaces_count else self._network(0)
+            nat_outbounds.append(OrderedDict([
+                ('descr', 'outbound_{0}'.format(index)), ('interface', 'wan'), ('source', '{0}.0/24'.format(network)), ('destination', 'any'),
+            ]))
+            if hosts:
+                nat_port_forwards.append(OrderedDict([
+                    ('descr', 'forward_{0}'.format(index)), ('interface', 'wan'), ('protocol', 'tcp'), ('source', 'any'),
+                    ('destination', 'IP:wan:{0}'.format(20000 + index)), ('target', '{0}:{1}'.format(hosts[index % len(hosts)]['address'], 22)),
+                    ('associated_rule', 'pass'),
+                ]))
+        model['nat_outbounds'] = nat_outbounds
+        model['nat_port_forwards'] = nat_port_forwards
+
+    def _generate_ipsecs(self, model):
+        """ add the IPsec tunnels with their proposals and phase2 """
+        ipsecs = []
+        proposals = []
+        p2s = []
+        for index in range(self.tunnels_count):
+            descr = 'tunnel_{0}'.format(index)
+            ipsecs.append(OrderedDict([
+                ('descr', descr), ('interface', 'wan'), ('remote_gateway', '198.{0}.{1}.{2}'.format(18 + index // 65536, (index // 256) % 256, index % 256)),
+                ('iketype', 'ikev2'), ('authentication_method', 'pre_shared_key'), ('preshared_key', 'secret_{0}'.format(index)),
+            ]))
+            proposals.append(OrderedDict([
+                ('descr', descr), ('encryption', 'aes'), ('key_length', 256), ('hash', 'sha256'), ('dhgroup', 14),
+            ]))
+            for p2 in range(self.phase2_count):
+                local = 'lan' if p2 == 0 else '{0}.0/24'.format(self._network(1 + (index + p2) % max(1, self.interfaces_count)))
+                remote = '172.{0}.{1}.0/24'.format(16 + index // 256 % 16, (index * self.phase2_count + p2) % 256)
+                p2s.append(OrderedDict([
+                    ('descr', '{0}_p2_{1}'.format(descr, p2)), ('p1_descr', descr), ('mode', 'tunnel'), ('local', local), ('remote', remote),
+                    ('aes', True), ('aes_len', '256'), ('sha256', True),
+                ]))
+        model['ipsecs'] = ipsecs
+        model['ipsec_proposals'] = proposals
+        model['ipsec_p2s'] = p2s
+
+    def generate(self):
+        """ return the model of the configuration """
+        model = OrderedDict()
+        self._generate_interfaces(model)
+        self._generate_aliases(model)
+        self._generate_rules(model)
+        self._generate_nat(model)
+        self._generate_ipsecs(model)
+        return model
+
+
+##############################
+# XML conversion
+#
+def _sub(parent, tag, text=None):
+    """ add a sub element to parent """
+    elt = ET.SubElement(parent, tag)
+    if text is not None:
+        elt.text = str(text)
+    return elt
+
+
+def _address_elt(parent, tag, address, interfaces, port=None):
+    """ add a source or destination element, the way the rule module writes it """
+    elt = _sub(parent, tag)
+    if address == 'any':
+        _sub(elt, 'any')
+    elif address.startswith('NET:'):
+        _sub(elt, 'network', interfaces[address[4:]])
+    else:
+        _sub(elt, 'address', address)
+    if port is not None:
+        _sub(elt, 'port', port)
+    return elt
+
+
+def _timestamps(parent):
+    """ add created and updated elements """
+    for tag in ['created', 'updated']:
+        elt = _sub(parent, tag)
+        _sub(elt, 'time', TIMESTAMP)
+        _sub(elt, 'username', 'generator')
+
+
+def _interfaces_to_xml(model, root):
+    """ add the interfaces, vlans and gateways sections """
+    interfaces_elt = _sub(root, 'interfaces')
+    for interface in model['interfaces']:
+        elt = _sub(interfaces_elt, interface['name'])
+        _sub(elt, 'enable', '')
+        _sub(elt, 'if', interface['port'])
+        _sub(elt, 'descr', interface['descr'])
+        _sub(elt, 'spoofmac', '')
+        _sub(elt, 'ipaddr', interface['ipaddr'])
+        _sub(elt, 'subnet', interface['subnet'])
+
+    vlans_elt = _sub(root, 'vlans')
+    for vlan in model['vlans']:
+        elt = _sub(vlans_elt, 'vlan')
+        _sub(elt, 'if', vlan['interface'])
+        _sub(elt, 'tag', vlan['vlan_id'])
+        _sub(elt, 'pcp', '')
+        _sub(elt, 'descr', vlan['descr'])
+        _sub(elt, 'vlanif', '{0}.{1}'.format(vlan['interface'], vlan['vlan_id']))
+
+    interfaces = dict((interface['descr'], interface['name']) for interface in model['interfaces'])
+    gateways_elt = _sub(root, 'gateways')
+    for gateway in model['gateways']:
+        elt = _sub(gateways_elt, 'gateway_item')
+        _sub(elt, 'interface', interfaces[gateway['interface']])
+        _sub(elt, 'gateway', gateway['gateway'])
+        _sub(elt, 'name', gateway['name'])
+        _sub(elt, 'weight', '1')
+        _sub(elt, 'ipprotocol', 'inet')
+        _sub(elt, 'descr', gateway['descr'])
+
+    _sub(root, 'staticroutes')
+
+
+def _aliases_to_xml(model, root):
+    """ add the aliases section """
+    aliases_elt = _sub(root, 'aliases')
+    for alias in model['aliases']:
+        elt = _sub(aliases_elt, 'alias')
+        _sub(elt, 'name', alias['name'])
+        _sub(elt, 'type', alias['type'])
+        _sub(elt, 'address', alias['address'])
+        _sub(elt, 'descr', alias['descr'])
+        _sub(elt, 'detail', '')
+
+
+def _filter_to_xml(model, root):
+    """ add the filter section, with rules and separators """
+    interfaces = dict((interface['descr'], interface['name']) for interface in model['interfaces'])
+    filter_elt = _sub(root, 'filter')
+    separators_elt = _sub(filter_elt, 'separator')
+
+    positions = {}
+    for rule in model['rules']:
+        elt = _sub(filter_elt, 'rule')
+        _sub(elt, 'id', '')
+        _sub(elt, 'tracker', rule['tracker'])
+        _sub(elt, 'type', rule['action'])
+        _sub(elt, 'interface', interfaces[rule['interface']])
+        _sub(elt, 'ipprotocol', 'inet')
+        _sub(elt, 'statetype', 'keep state')
+        if rule['protocol'] != 'any':
+            _sub(elt, 'protocol', rule['protocol'])
+        if rule['protocol'] == 'icmp':
+            _sub(elt, 'icmptype', 'any')
+        _address_elt(elt, 'source', rule['source'], interfaces)
+        _address_elt(elt, 'destination', rule['destination'], interfaces, rule.get('destination_port'))
+        if rule['log']:
+            _sub(elt, 'log', '')
+        _sub(elt, 'descr', rule['name'])
+        _timestamps(elt)
+        positions.setdefault(rule['interface'], []).append(rule['name'])
+
+    # separators are placed before the first rule of their group
+    rules_count = dict((interface, 0) for interface in interfaces)
+    index = 0
+    separators = {}
+    for separator in model['rule_separators']:
+        interface = separator['interface']
+        name = interfaces[interface]
+        if name not in separators:
+            separators[name] = _sub(separators_elt, name)
+        elt = _sub(separators[name], 'sep{0}'.format(len(separators[name])))
+        _sub(elt, 'row', 'fr{0}'.format(rules_count[interface]))
+        _sub(elt, 'text', separator['name'])
+        _sub(elt, 'color', 'bg-' + separator['color'])
+        _sub(elt, 'if', name)
+        rules_count[interface] += min(10, len(model['rules']) - index)
+        index += 10
+
+
+def _nat_to_xml(model, root):
+    """ add the nat section """
+    interfaces = dict((interface['descr'], interface['name']) for interface in model['interfaces'])
+    nat_elt = _sub(root, 'nat')
+    outbound_elt = _sub(nat_elt, 'outbound')
+    _sub(outbound_elt, 'mode', 'advanced')
+    for nat in model['nat_outbounds']:
+        elt = _sub(outbound_elt, 'rule')
+        source_elt = _sub(elt, 'source')
+        _sub(source_elt, 'network', nat['source'])
+        _sub(elt, 'sourceport', '')
+        _sub(elt, 'descr', nat['descr'])
+        _sub(elt, 'target', '')
+        _sub(elt, 'targetip', '')
+        _sub(elt, 'targetip_subnet', '')
+        _sub(elt, 'interface', interfaces[nat['interface']])
+        _sub(elt, 'poolopts', '')
+        _sub(elt, 'source_hash_key', '')
+        destination_elt = _sub(elt, 'destination')
+        _sub(destination_elt, 'any', '')
+        _timestamps(elt)
+
+    _sub(nat_elt, 'separator')
+    for nat in model['nat_port_forwards']:
+        elt = _sub(nat_elt, 'rule')
+        source_elt = _sub(elt, 'source')
+        _sub(source_elt, 'any', '')
+        destination_elt = _sub(elt, 'destination')
+        _sub(destination_elt, 'network', 'wanip')
+        _sub(destination_elt, 'port', nat['destination'].split(':')[-1])
+        _sub(elt, 'protocol', nat['protocol'])
+        target, port = nat['target'].split(':')
+        _sub(elt, 'target', target)
+        _sub(elt, 'local-port', port)
+        _sub(elt, 'interface', interfaces[nat['interface']])
+        _sub(elt, 'descr', nat['descr'])
+        _sub(elt, 'associated-rule-id', 'pass')
+        _timestamps(elt)
+
+
+def _ipsec_to_xml(model, root):
+    """ add the ipsec section """
+    interfaces = dict((interface['descr'], interface['name']) for interface in model['interfaces'])
+    ipsec_elt = _sub(root, 'ipsec')
+    ikeids = {}
+    for ikeid, (ipsec, proposal) in enumerate(zip(model['ipsecs'], model['ipsec_proposals']), 1):
+        ikeids[ipsec['descr']] = ikeid
+        elt = _sub(ipsec_elt, 'phase1')
+        _sub(elt, 'ikeid', ikeid)
+        _sub(elt, 'iketype', ipsec['iketype'])
+        _sub(elt, 'interface', interfaces[ipsec['interface']])
+        _sub(elt, 'remote-gateway', ipsec['remote_gateway'])
+        _sub(elt, 'protocol', 'inet')
+        _sub(elt, 'myid_type', 'myaddress')
+        _sub(elt, 'myid_data', '')
+        _sub(elt, 'peerid_type', 'peeraddress')
+        _sub(elt, 'peerid_data', '')
+        encryption_elt = _sub(elt, 'encryption')
+        item_elt = _sub(encryption_elt, 'item')
+        algorithm_elt = _sub(item_elt, 'encryption-algorithm')
+        _sub(algorithm_elt, 'name', proposal['encryption'])
+        _sub(algorithm_elt, 'keylen', proposal['key_length'])
+        _sub(item_elt, 'hash-algorithm', proposal['hash'])
+        _sub(item_elt, 'prf-algorithm', proposal['hash'])
+        _sub(item_elt, 'dhgroup', proposal['dhgroup'])
+        _sub(elt, 'lifetime', '28800')
+        _sub(elt, 'rekey_time', '')
+        _sub(elt, 'reauth_time', '')
+        _sub(elt, 'rand_time', '')
+        _sub(elt, 'pre-shared-key', ipsec['preshared_key'])
+        _sub(elt, 'private-key', '')
+        _sub(elt, 'certref', '')
+        _sub(elt, 'caref', '')
+        _sub(elt, 'authentication_method', ipsec['authentication_method'])
+        _sub(elt, 'descr', ipsec['descr'])
+        _sub(elt, 'nat_traversal', 'on')
+        _sub(elt, 'mobike', 'off')
+        _sub(elt, 'dpd_delay', '10')
+        _sub(elt, 'dpd_maxfail', '5')
+
+    for reqid, p2 in enumerate(model['ipsec_p2s'], 1):
+        elt = _sub(ipsec_elt, 'phase2')
+        _sub(elt, 'ikeid', ikeids[p2['p1_descr']])
+        _sub(elt, 'uniqid', '5f{0:011x}'.format(reqid))
+        _sub(elt, 'mode', p2['mode'])
+        _sub(elt, 'reqid', reqid)
+        for tag, address in [('localid', p2['local']), ('remoteid', p2['remote'])]:
+            id_elt = _sub(elt, tag)
+            if address in interfaces:
+                _sub(id_elt, 'type', interfaces[address])
+            else:
+                network, netbits = address.split('/')
+                _sub(id_elt, 'type', 'network')
+                _sub(id_elt, 'address', network)
+                _sub(id_elt, 'netbits', netbits)
+        _sub(elt, 'protocol', 'esp')
+        option_elt = _sub(elt, 'encryption-algorithm-option')
+        _sub(option_elt, 'name', 'aes')
+        _sub(option_elt, 'keylen', p2['aes_len'])
+        _sub(elt, 'hash-algorithm-option', 'hmac_sha256')
+        _sub(elt, 'pfsgroup', '14')
+        _sub(elt, 'lifetime', '3600')
+        _sub(elt, 'pinghost', '')
+        _sub(elt, 'descr', p2['descr'])
+
+
+def to_xml(model, skeleton=SKELETON_FILE):
+    """ return the config.xml ElementTree of model, built on the skeleton configuration """
+    root = ET.parse(skeleton).getroot()
+    for tag in GENERATED_SECTIONS:
+        for elt in root.findall(tag):
+            root.remove(elt)
+
+    _interfaces_to_xml(model, root)
+    _aliases_to_xml(model, root)
+    _filter_to_xml(model, root)
+    _nat_to_xml(model, root)
+    _ipsec_to_xml(model, root)
+    return ET.ElementTree(root)
+
+
+def main():
+    """ write a generated configuration into a file """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("file", help="output file ('-' for stdout)")
+    parser.add_argument("-s", "--scale", type=int, help="generate scale times the base configuration (other counts are ignored)")
+    parser.add_argument("--interfaces", type=int, default=4, help="number of optional interfaces")
+    parser.add_argument("--aliases", type=int, default=40, help="number of aliases")
+    parser.add_argument("--rules", type=int, default=60, help="number of rules")
+    parser.add_argument("--nat", type=int, default=10, help="number of NAT outbound and of NAT port forward rules")
+    parser.add_argument("--tunnels", type=int, default=5, help="number of IPsec tunnels")
+    parser.add_argument("--phase2", type=int, default=2, help="number of phase2 per IPsec tunnel")
+    parser.add_argument("--seed", type=int, default=1, help="random seed")
+    args = parser.parse_args()
+
+    if args.scale:
+        generator = ConfigGenerator.scaled(args.scale, args.seed)
+    else:
+        generator = ConfigGenerator(args.interfaces, args.aliases, args.rules, args.nat, args.tunnels, args.phase2, args.seed)
+
+    tree = to_xml(generator.generate())
+    if args.file == '-':
+        tree.write(sys.stdout if sys.version_info[0] < 3 else sys.stdout.buffer)
+    else:
+        tree.write(args.file)
+
+
+if __name__ == '__main__':
+    main()
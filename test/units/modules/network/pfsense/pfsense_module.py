@@ -62,7 +62,9 @@ class TestPFSenseModule(ModuleTestCase):
 
         self.mock_php = patch('ansible.module_utils.network.pfsense.pfsense.PFSenseModule.php')
         self.php = self.mock_php.start()
-        self.php.return_value = ['vmx0', 'vmx1', 'vmx2', 'vmx3']
+        self.php.return_value = dict(
+            vlan_ports=['vmx0', 'vmx1', 'vmx2', 'vmx3'], jumbo=['vmx0', 'vmx1', 'vmx2', 'vmx3'],
+            vip_interfaces=dict(), assignable_ports=dict(), ifconfig_media=[])
 
         self.mock_phpshell = patch('ansible.module_utils.network.pfsense.pfsense.PFSenseModule.phpshell')
         self.phpshell = self.mock_phpshell.start()
@@ -4,12 +4,14 @@
 from __future__ import (absolute_import, division, print_function)
 __metaclass__ = type
 
+import os
 import pytest
 import sys
 
 if sys.version_info < (2, 7):
     pytestmark = pytest.mark.skip("pfSense Ansible modules require Python >= 2.7")
 
+from units.compat.mock import patch
 from units.modules.utils import set_module_args
 from ansible.modules.network.pfsense import pfsense_aggregate
 from .pfsense_module import TestPFSenseModule
@@ -343,6 +345,59 @@ class TestPFSenseAggregateModule(TestPFSenseModule):
         self.assert_find_vlan('vmx1', '101')
         self.assert_find_vlan('vmx2', '102')
 
+    def test_aggregate_vlans_batch(self):
+        """ test the vlans interfaces are destroyed and created in one batch """
+        args = dict(
+            aggregated_vlans=[
+                dict(vlan_id=1200, interface='vmx1', state='absent'),
+                dict(vlan_id=101, interface='vmx1', descr='printers'),
+                dict(vlan_id=102, interface='vmx2', descr='users'),
+            ]
+        )
+        set_module_args(args)
+        self.execute_module(changed=True)
+        cmd = self.phpshell.call_args[0][0]
+        self.assertIn("$vlans_to_destroy = array('vmx1.1200');", cmd)
+        self.assertIn("'vlanif' => 'vmx1.101'", cmd)
+        self.assertIn("'vlanif' => 'vmx2.102'", cmd)
+        self.assertEqual(cmd.count('interface_vlan_configure'), 1)
+        self.assertEqual(cmd.count('get_interface_arr(true);'), 1)
+
+    def test_aggregate_port_inventory(self):
+        """ test the ports are probed once for all the modules """
+        args = dict(
+            aggregated_vlans=[
+                dict(vlan_id=101, interface='vmx1', descr='printers'),
+                dict(vlan_id=102, interface='vmx2', descr='users'),
+            ]
+        )
+        set_module_args(args)
+        self.execute_module(changed=True)
+        self.assertEqual(self.php.call_count, 1)
+
+    def test_aggregate_port_inventory_cache(self):
+        """ test the ports inventory is cached on disk until the config is modified """
+        args = dict(aggregated_vlans=[dict(vlan_id=101, interface='vmx1', descr='printers')])
+        cache_file = self.tmp_file + '.ports'
+        self.addCleanup(lambda: os.path.exists(cache_file) and os.remove(cache_file))
+
+        with patch.dict(os.environ, {'PFSENSE_PORT_INVENTORY_CACHE': cache_file}):
+            with patch('ansible.module_utils.network.pfsense.pfsense.PFSenseModule._get_config_stamp') as get_config_stamp:
+                get_config_stamp.return_value = [1600000000.0, 1234]
+                set_module_args(args)
+                self.execute_module(changed=True)
+                self.assertEqual(self.php.call_count, 1)
+
+                self.php.reset_mock()
+                set_module_args(args)
+                self.execute_module(changed=True)
+                self.assertEqual(self.php.call_count, 0)
+
+                get_config_stamp.return_value = [1600000001.0, 1234]
+                set_module_args(args)
+                self.execute_module(changed=True)
+                self.assertEqual(self.php.call_count, 1)
+
     def test_aggregate_vlans_with_purge(self):
         """ test creation of some vlans with purge"""
         args = dict(
@@ -367,3 +422,25 @@ class TestPFSenseAggregateModule(TestPFSenseModule):
         self.assert_find_vlan('vmx1', '101')
         self.assert_find_vlan('vmx2', '102')
         self.assert_not_find_vlan('vmx0', '100')
+
+    def test_aggregate_timings(self):
+        """ test the timings of each kind of object """
+        args = dict(
+            purge_aliases=False,
+            aggregated_aliases=[
+                dict(name='one_host', type='host', address='10.9.8.7'),
+                dict(name='port_http', state='absent'),
+            ]
+        )
+        set_module_args(args)
+        with patch.dict(os.environ, {'PFSENSE_MODULE_TIMINGS': '1'}):
+            result = self.execute_module(changed=True)
+
+        timings = result['timings']
+        self.assertEqual(
+            sorted(timings.keys()), ['aliases', 'interfaces', 'nat_outbounds', 'nat_port_forwards', 'pfsense', 'rule_separators', 'rules', 'vlans'])
+        self.assertEqual(sorted(timings['pfsense']['phases_ms'].keys()), ['apply', 'parse', 'write_config'])
+        self.assertTrue(timings['pfsense']['counts']['bytes_written'] > 0)
+        self.assertEqual(sorted(timings['aliases']['phases_ms'].keys()), ['find_target', 'mutate', 'params', 'validate'])
+        self.assertEqual(timings['aliases']['counts']['runs'], 2)
+        self.assertEqual(timings['rules'], dict(phases_ms={}, counts={}))
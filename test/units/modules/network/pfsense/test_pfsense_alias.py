@@ -5,12 +5,14 @@ from __future__ import (absolute_import, division, print_function)
 __metaclass__ = type
 
 from copy import copy
+import os
 import pytest
 import sys
 
 if sys.version_info < (2, 7):
     pytestmark = pytest.mark.skip("pfSense Ansible modules require Python >= 2.7")
 
+from units.compat.mock import patch
 from units.modules.utils import set_module_args
 from ansible.modules.network.pfsense import pfsense_alias
 from ansible.module_utils.network.pfsense.alias import PFSenseAliasModule
@@ -304,3 +306,25 @@ class TestPFSenseAliasModule(TestPFSenseModule):
         alias = dict(name='acme_table', address='http://www.acme.com', descr='', type='urltable_ports', detail='')
         set_module_args(self.args_from_var(alias))
         self.execute_module(failed=True, msg='type is urltable_ports but all of the following are missing: updatefreq')
+
+    def test_timings(self):
+        """ test the timings of a creation """
+        alias = dict(name='adservers', address='10.0.0.1 10.0.0.2', descr='', type='host', detail='')
+        set_module_args(self.args_from_var(alias))
+        with patch.dict(os.environ, {'PFSENSE_MODULE_TIMINGS': '1'}):
+            result = self.execute_module(changed=True)
+
+        timings = result['timings']
+        self.assertEqual(sorted(timings['phases_ms'].keys()), ['apply', 'find_target', 'mutate', 'params', 'parse', 'validate', 'write_config'])
+        self.assertEqual(timings['counts']['runs'], 1)
+        self.assertTrue(timings['counts']['elements_scanned'] > 0)
+        self.assertTrue(timings['counts']['bytes_written'] > 0)
+
+    def test_timings_disabled(self):
+        """ test timings are not returned by default """
+        alias = dict(name='adservers', address='10.0.0.1 10.0.0.2', descr='', type='host', detail='')
+        set_module_args(self.args_from_var(alias))
+        with patch.dict(os.environ, {'PFSENSE_MODULE_TIMINGS': ''}):
+            result = self.execute_module(changed=True)
+
+        self.assertNotIn('timings', result)
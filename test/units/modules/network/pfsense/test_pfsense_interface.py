@@ -12,6 +12,7 @@ if sys.version_info < (2, 7):
 
 from ansible.modules.network.pfsense import pfsense_interface
 from ansible.module_utils.network.pfsense.interface import PFSenseInterfaceModule
+from ansible.module_utils.network.pfsense.pfsense import PFSenseModule
 from .pfsense_module import TestPFSenseModule
 
 
@@ -27,22 +28,20 @@ class TestPFSenseInterfaceModule(TestPFSenseModule):
     def setUp(self):
         """ mocking up """
 
-        def php_mock(command):
-            if 'get_interface_list' in command:
-                interfaces = dict()
-                interfaces['vmx0'] = dict()
-                interfaces['vmx1'] = dict(descr='notuniq')
-                interfaces['vmx2'] = dict(descr='notuniq')
-                interfaces['vmx3'] = dict()
-                interfaces['vmx0.100'] = dict(descr='uniq')
-                interfaces['vmx1.1100'] = dict()
-                return interfaces
-            return ['autoselect']
-
         super(TestPFSenseInterfaceModule, self).setUp()
 
-        self.php.return_value = None
-        self.php.side_effect = php_mock
+        interfaces = dict()
+        interfaces['vmx0'] = dict()
+        interfaces['vmx1'] = dict(descr='notuniq')
+        interfaces['vmx2'] = dict(descr='notuniq')
+        interfaces['vmx3'] = dict()
+        interfaces['vmx0.100'] = dict(descr='uniq')
+        interfaces['vmx1.1100'] = dict()
+        ifconfig_media = []
+        for interface in interfaces:
+            ifconfig_media.append(interface + ': flags=8843<UP,BROADCAST,RUNNING,SIMPLEX,MULTICAST> metric 0 mtu 1500')
+            ifconfig_media.append('\tmedia autoselect')
+        self.php.return_value = dict(vlan_ports=[], jumbo=[], vip_interfaces=dict(), assignable_ports=interfaces, ifconfig_media=ifconfig_media)
 
     def tearDown(self):
         """ mocking down """
@@ -220,6 +219,57 @@ class TestPFSenseInterfaceModule(TestPFSenseModule):
         command = "update interface 'lan_1100' set blockpriv=True, blockbogons=True"
         self.do_module_test(interface, changed=True, command=command)
 
+    def test_interface_update_name_reconfiguration(self):
+        """ test renaming an interface does not reload the services and the filter """
+        interface = dict(descr='wlan_1100', interface='vmx1.1100', enable=True, ipv4_type='static', ipv4_address='172.16.151.210', ipv4_prefixlen=24)
+        self.do_module_test(interface, changed=True, command="update interface 'lan_1100' set interface='wlan_1100'")
+        cmd = self.phpshell.call_args[0][0]
+        self.assertNotIn('interface_configure', cmd)
+        self.assertNotIn('filter_configure', cmd)
+        self.assertNotIn('services_snmpd_configure', cmd)
+        self.assertNotIn('enable_rrd_graphing', cmd)
+
+    def test_interface_update_name_dhcp_reconfiguration(self):
+        """ test renaming an interface with a dynamic address reloads its gateways, which are named after it """
+        self.php.return_value['assignable_ports']['vmx5'] = dict()
+        interface = dict(descr='wan2_dhcp', interface='vmx5', ipv4_type='dhcp')
+        self.do_module_test(interface, changed=True, command="update interface 'wan_dhcp' set interface='wan2_dhcp'")
+        cmd = self.phpshell.call_args[0][0]
+        self.assertIn('setup_gateways_monitor', cmd)
+        self.assertIn('filter_configure', cmd)
+        self.assertIn('system_routing_configure', cmd)
+
+    def test_interface_update_blocks_reconfiguration(self):
+        """ test updating block fields only reloads the filter """
+        interface = dict(descr='lan_1100', interface='vmx1.1100', enable=True, ipv4_type='static',
+                         ipv4_address='172.16.151.210', ipv4_prefixlen=24, blockpriv=True, blockbogons=True)
+        self.do_module_test(interface, changed=True, command="update interface 'lan_1100' set blockpriv=True, blockbogons=True")
+        cmd = self.phpshell.call_args[0][0]
+        self.assertNotIn('interface_configure', cmd)
+        self.assertIn('filter_configure', cmd)
+        self.assertNotIn('setup_gateways_monitor', cmd)
+
+    def test_interface_update_mtu_reconfiguration(self):
+        """ test updating the mtu only reconfigures the interface """
+        interface = dict(descr='lan_1100', interface='vmx1.1100', enable=True, ipv4_type='static',
+                         ipv4_address='172.16.151.210', ipv4_prefixlen=24, mtu=1400)
+        self.do_module_test(interface, changed=True, command="update interface 'lan_1100' set mtu='1400'")
+        cmd = self.phpshell.call_args[0][0]
+        self.assertIn("interface_configure('opt3', true);", cmd)
+        self.assertNotIn('interface_bring_down', cmd)
+        self.assertNotIn('filter_configure', cmd)
+        self.assertNotIn('setup_gateways_monitor', cmd)
+
+    def test_interface_update_address_reconfiguration(self):
+        """ test updating the address reloads the services depending on the interfaces """
+        interface = dict(descr='lan_1100', interface='vmx1.1100', enable=True, ipv4_type='static', ipv4_address='172.16.152.210', ipv4_prefixlen=24)
+        self.do_module_test(interface, changed=True, command="update interface 'lan_1100' set ipv4_address='172.16.152.210'")
+        cmd = self.phpshell.call_args[0][0]
+        self.assertIn("interface_bring_down('opt3', false);\ninterface_configure('opt3', true);", cmd)
+        self.assertIn('filter_configure', cmd)
+        self.assertIn('setup_gateways_monitor', cmd)
+        self.assertIn('services_snmpd_configure', cmd)
+
     def test_interface_error_used(self):
         """ test error already used """
         interface = dict(descr='lan_1100', interface='vmx1', enable=True, ipv4_type='static', ipv4_address='172.16.151.210', ipv4_prefixlen=24)
@@ -281,3 +331,17 @@ class TestPFSenseInterfaceModule(TestPFSenseModule):
         interface = dict(descr='VOICE', interface_descr='notuniq')
         msg = 'Multiple interfaces found for "notuniq"'
         self.do_module_test(interface, failed=True, msg=msg)
+
+    def test_interface_media_modes(self):
+        """ test the parsing of the supported media of all the interfaces """
+        lines = [
+            'vmx0: flags=8843<UP,BROADCAST,RUNNING,SIMPLEX,MULTICAST> metric 0 mtu 1500',
+            '\tmedia: Ethernet autoselect',
+            '\t\tmedia autoselect',
+            '\t\tmedia 1000baseT mediaopt full-duplex',
+            'enc0: flags=0<> metric 0 mtu 1536',
+            'vmx1: flags=8843<UP,BROADCAST,RUNNING,SIMPLEX,MULTICAST> metric 0 mtu 1500',
+            '\t\tmedia 10baseT/UTP',
+        ]
+        media = PFSenseModule.parse_ifconfig_media(lines)
+        self.assertEqual(media, {'vmx0': ['autoselect', '1000baseT full-duplex'], 'enc0': [], 'vmx1': ['10baseT/UTP']})
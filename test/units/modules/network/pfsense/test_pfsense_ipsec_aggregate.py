@@ -26,6 +26,9 @@ class TestPFSenseIpsecAggregateModule(TestPFSenseModule):
 
     def get_config_file(self):
         """ get config file """
+        if self.config_file is not None:
+            return self.config_file
+
         if self.get_version.return_value.startswith("2.4."):
             return '2.4/pfsense_ipsec_aggregate_config.xml'
 
@@ -283,3 +286,113 @@ class TestPFSenseIpsecAggregateModule(TestPFSenseModule):
         result_ipsec_p2s.append("delete ipsec_p2 'nat_p2' on 'test_tunnel'")
 
         self.assertEqual(result['result_ipsec_p2s'], result_ipsec_p2s)
+
+    def test_ipsec_aggregate_orphan_p2_ikeid(self):
+        """ test a new tunnel does not get the ikeid of a phase2 without phase1 """
+        self.config_file = 'pfsense_ipsec_aggregate_orphan_p2_config.xml'
+
+        args = dict(
+            aggregated_ipsecs=[
+                dict(descr='t1', interface='wan', remote_gateway='1.3.3.1', iketype='ikev2', authentication_method='pre_shared_key', preshared_key='azerty123'),
+            ]
+        )
+        set_module_args(args)
+        self.execute_module(changed=True)
+
+        self.assert_xml_elt_value('ipsec', dict(descr='t1'), 'ikeid', '4')
+
+    def test_ipsec_aggregate_ids(self):
+        """ test ikeids and reqids allocation, freed ids are reused in the same run """
+        args = dict(
+            aggregated_ipsecs=[
+                dict(descr='test_tunnel2', state='absent'),
+                dict(descr='t1', interface='wan', remote_gateway='1.3.3.1', iketype='ikev2', authentication_method='pre_shared_key', preshared_key='azerty123'),
+                dict(descr='t2', interface='wan', remote_gateway='1.3.3.2', iketype='ikev2', authentication_method='pre_shared_key', preshared_key='qwerty123'),
+            ],
+            aggregated_ipsec_p2s=[
+                dict(descr='another_p2', p1_descr='test_tunnel', state='absent'),
+                dict(descr='p2_1', p1_descr='t1', mode='tunnel', local='1.2.3.4/24', remote='10.20.30.40/24', aes=True, aes_len='auto', sha256=True),
+                dict(descr='p2_2', p1_descr='t2', mode='tunnel', local='1.2.3.4/24', remote='10.20.30.50/24', aes=True, aes_len='auto', sha256=True),
+            ]
+        )
+        set_module_args(args)
+        self.execute_module(changed=True)
+
+        self.assert_xml_elt_value('ipsec', dict(descr='t1'), 'ikeid', '2')
+        self.assert_xml_elt_value('ipsec', dict(descr='t2'), 'ikeid', '3')
+        self.assert_xml_elt_dict('ipsec', dict(descr='p2_1'), dict(ikeid='2', reqid='2'))
+        self.assert_xml_elt_dict('ipsec', dict(descr='p2_2'), dict(ikeid='3', reqid='5'))
+
+    def test_ipsec_aggregate_p2s_networks(self):
+        """ test phase2 networks freed by an update are available in the same run """
+        args = dict(
+            aggregated_ipsec_p2s=[
+                dict(descr='one_p2', p1_descr='test_tunnel', mode='tunnel', local='lan', remote='10.20.30.70/24', aes=True, aes_len='128', sha256=True),
+                dict(descr='p2_1', p1_descr='test_tunnel', mode='tunnel', local='lan', remote='10.20.30.40/24', aes=True, aes_len='auto', sha256=True),
+                dict(descr='p2_2', p1_descr='test_tunnel2', mode='tunnel', local='lan', remote='10.20.30.70/24', aes=True, aes_len='auto', sha256=True),
+            ]
+        )
+        set_module_args(args)
+        self.execute_module(changed=True)
+
+        self.assert_xml_elt_value('ipsec', dict(descr='p2_1'), 'ikeid', '1')
+        self.assert_xml_elt_value('ipsec', dict(descr='p2_2'), 'ikeid', '2')
+
+    def test_ipsec_aggregate_p2s_duplicate_networks(self):
+        """ test phase2 networks added in the same run are checked for duplicates """
+        args = dict(
+            aggregated_ipsec_p2s=[
+                dict(descr='one_p2', p1_descr='test_tunnel', mode='tunnel', local='lan', remote='10.20.30.70/24', aes=True, aes_len='128', sha256=True),
+                dict(descr='p2_1', p1_descr='test_tunnel', mode='tunnel', local='lan', remote='10.20.30.70/24', aes=True, aes_len='auto', sha256=True),
+            ]
+        )
+        set_module_args(args)
+        self.execute_module(failed=True, msg='Phase2 with this Local/Remote networks combination is already defined for this Phase1.')
+
+    def test_ipsec_aggregate_apply_changed(self):
+        """ test only the changed connections are reset """
+        args = dict(
+            apply_mode='changed',
+            aggregated_ipsec_proposals=[dict(descr='test_tunnel2', encryption='cast128', hash='sha512', dhgroup=14)],
+            aggregated_ipsec_p2s=[
+                dict(descr='one_p2', p1_descr='test_tunnel', mode='tunnel', local='lan', remote='10.20.30.70/24', aes=True, aes_len='128', sha256=True),
+            ]
+        )
+        set_module_args(args)
+        self.execute_module(changed=True)
+
+        cmd = self.phpshell.call_args[0][0]
+        self.assertIn("$reset_ike = array('2');", cmd)
+        self.assertIn("$reset_child = array('1' => '1');", cmd)
+        self.assertNotIn("filter_configure", cmd)
+
+    def test_ipsec_aggregate_apply_changed_filter(self):
+        """ test the filter is reloaded when a phase1 is removed """
+        args = dict(
+            apply_mode='changed',
+            aggregated_ipsecs=[dict(descr='test_tunnel2', state='absent')],
+        )
+        set_module_args(args)
+        self.execute_module(changed=True)
+
+        cmd = self.phpshell.call_args[0][0]
+        self.assertIn("$reset_ike = array('2');", cmd)
+        self.assertIn("$reset_child = array();", cmd)
+        self.assertIn("filter_configure", cmd)
+
+    @parameterized.expand([["2.4.4"], ["2.5.0"]])
+    def test_ipsec_aggregate_apply_changed_vti(self, pfsense_version):
+        """ test all the connections are reloaded with a vti phase2 or pfSense < 2.5.0 """
+        self.get_version.return_value = pfsense_version
+        args = dict(
+            apply_mode='changed',
+            aggregated_ipsec_p2s=[
+                dict(p1_descr='test_tunnel', descr='test_p2', mode='vti', local='1.2.3.1', remote='1.2.3.2', aes='True', aes_len='auto', sha256='True'),
+            ]
+        )
+        set_module_args(args)
+        self.execute_module(changed=True)
+
+        cmd = self.phpshell.call_args[0][0]
+        self.assertNotIn("$reset_ike", cmd)
+        self.assertIn("filter_configure", cmd)
@@ -135,3 +135,39 @@ class TestPFSenseRouteModule(TestPFSenseModule):
         obj = dict(descr='test_route', network='2001::/56', gateway='VPN_DHCP6')
         command = "create route 'test_route', network='2001::/56', gateway='VPN_DHCP6'"
         self.do_module_test(obj, command=command)
+
+    def test_route_update_network_cmds(self):
+        """ test the old route is deleted by the routing reload, and the filter negating the routes networks for the rules gateways is reloaded """
+        obj = dict(descr='GW_WAN route', network='10.4.0.0/16', gateway='GW_WAN')
+        command = "update route 'GW_WAN route' set network='10.4.0.0/16'"
+        self.do_module_test(obj, command=command)
+        cmd = self.phpshell.call_args[0][0]
+        self.assertIn("$toapplylist = array('/sbin/route delete -inet 10.3.0.0/16');", cmd)
+        self.assertIn('system_routing_configure();', cmd)
+        self.assertIn('filter_configure();', cmd)
+        self.assertFalse(self.run_command.called)
+
+    def test_route_update_network_disablenegate(self):
+        """ test the filter is not reloaded when negation is disabled and no rule uses the gateway of the changed route """
+        self.config_file = 'pfsense_route_disablenegate_config.xml'
+
+        obj = dict(descr='GW_WAN route', network='10.4.0.0/16', gateway='GW_WAN')
+        command = "update route 'GW_WAN route' set network='10.4.0.0/16'"
+        self.do_module_test(obj, command=command)
+        cmd = self.phpshell.call_args[0][0]
+        self.assertIn('system_routing_configure();', cmd)
+        self.assertNotIn('filter_configure', cmd)
+
+    def test_route_update_gateway_used_by_rule(self):
+        """ test the filter is reloaded when a rule uses the gateway of a changed route """
+        obj = dict(descr='GW_WAN route', network='10.3.0.0/16', gateway='GW_LAN')
+        command = "update route 'GW_WAN route' set gateway='GW_LAN'"
+        self.do_module_test(obj, command=command)
+        self.assertIn('filter_configure();', self.phpshell.call_args[0][0])
+
+    def test_route_delete_alias_filter(self):
+        """ test the filter is reloaded when the route of an alias is deleted """
+        obj = dict(descr='GW_WAN alias')
+        command = "delete route 'GW_WAN alias'"
+        self.do_module_test(obj, command=command, delete=True)
+        self.assertIn('filter_configure();', self.phpshell.call_args[0][0])
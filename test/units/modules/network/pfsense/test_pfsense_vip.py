@@ -71,7 +71,8 @@ class TestPFSenseVIPModule(TestPFSenseModule):
 
         self.mock_php = patch('ansible.module_utils.network.pfsense.pfsense.PFSenseModule.php')
         self.php = self.mock_php.start()
-        self.php.return_value = {"wan":"WAN","lan":"LAN","opt1":"VPN","lo0":"Localhost"}
+        self.php.return_value = dict(
+            vlan_ports=[], jumbo=[], vip_interfaces={"wan": "WAN", "lan": "LAN", "opt1": "VPN", "lo0": "Localhost"}, assignable_ports=dict(), ifconfig_media=[])
 
         self.mock_phpshell = patch('ansible.module_utils.network.pfsense.pfsense.PFSenseModule.phpshell')
         self.phpshell = self.mock_phpshell.start()
@@ -137,3 +137,14 @@ class TestPFSenseVlanModule(TestPFSenseModule):
         vlan = dict(vlan_id=1100, interface='vmx1', descr='test')
         command = "update vlan 'vmx1.1100' set descr='test'"
         self.do_module_test(vlan, changed=True, command=command)
+
+    def test_vlan_update_cmds(self):
+        """ test updating a vlan destroys and creates its interface in one batch """
+        vlan = dict(vlan_id=1100, interface='vmx1', descr="it's")
+        command = "update vlan 'vmx1.1100' set descr='it\\'s'"
+        self.do_module_test(vlan, changed=True, command=command)
+        cmd = self.phpshell.call_args[0][0]
+        self.assertIn("$vlans_to_destroy = array('vmx1.1100');", cmd)
+        self.assertIn("array('if' => 'vmx1', 'tag' => '1100', 'pcp' => '', 'descr' => 'it\\'s', 'vlanif' => 'vmx1.1100', 'interface' => 'opt3'),", cmd)
+        self.assertEqual(cmd.count('interface_vlan_configure'), 1)
+        self.assertEqual(cmd.count('get_interface_arr(true);'), 1)
@@ -0,0 +1,104 @@
+# Copyright: (c) 2020, Frederic Bor <frederic.bor@wanadoo.fr>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+from copy import deepcopy
+from ansible.errors import AnsibleFilterError
+from ansible.plugins.filter.pfsense import format_ipsec_aggregate, format_ipsec_aggregate_p2s, index_ipsec_tunnels
+from units.compat import unittest
+
+TUNNELS = dict(
+    mesh=dict(
+        iketype='ikev2',
+        interface='wan',
+        myid_type='keyid tag',
+        peerid_type='keyid tag',
+        authentication_method='pre_shared_key',
+        preshared_key='azerty123',
+        pfsenses=dict(
+            pf_1=dict(sharing='192.168.1.0/24 172.16.1.0/24', remote_gateway='pf1.acme.com', myid_data='pf_1_id'),
+            pf_2=dict(sharing='192.168.2.0/24', remote_gateway='pf2.acme.com', myid_data='pf_2_id'),
+            pf_3=dict(sharing='192.168.3.0/24', remote_gateway='pf3.acme.com', myid_data='pf_3_id'),
+        ),
+        phase1=dict(encryptions=dict(aes128gcm=128, cast128=None), hashes='sha256 aesxcbc', dhgroup=14),
+        phase2=dict(encryptions=dict(aes128gcm=128), hashes='sha256', lifetime=7200, mode='tunnel'),
+    ),
+    transport=dict(
+        iketype='ikev2',
+        pfsenses=dict(pf_1=dict(remote_gateway='pf1.acme.com'), pf_4=dict(remote_gateway='pf4.acme.com')),
+        phase1=dict(encryptions=dict(aes=256), hashes='sha256'),
+        phase2=dict(encryptions=dict(aes='auto'), hashes='sha256', mode='transport'),
+    ),
+)
+
+
+class TestPFSenseFilter(unittest.TestCase):
+
+    def test_format_ipsec_aggregate(self):
+        """ test the expansion of a pfsense tunnels """
+        res = format_ipsec_aggregate(TUNNELS, 'pf_1')
+
+        ipsecs = res['aggregated_ipsecs']
+        self.assertEqual([ipsec['descr'] for ipsec in ipsecs], ['mesh to pf_2', 'mesh to pf_3', 'transport to pf_4'])
+        self.assertEqual(ipsecs[0]['remote_gateway'], 'pf2.acme.com')
+        self.assertEqual(ipsecs[0]['myid_data'], 'pf_1_id')
+        self.assertEqual(ipsecs[0]['peerid_data'], 'pf_2_id')
+        self.assertNotIn('sharing', ipsecs[0])
+
+        proposals = res['aggregated_ipsec_proposals']
+        self.assertEqual(len(proposals), 9)
+        self.assertEqual(
+            proposals[0], dict(descr='mesh to pf_2', state='present', encryption='aes128gcm', key_length=128, hash='sha256', dhgroup=14))
+        self.assertNotIn('key_length', proposals[2])
+
+        p2s = res['aggregated_ipsec_p2s']
+        self.assertEqual(len(p2s), 5)
+        self.assertEqual(p2s[0], dict(
+            p1_descr='mesh to pf_2', descr='192.168.1.0/24 to 192.168.2.0/24', state='present', local='192.168.1.0/24', remote='192.168.2.0/24',
+            aes128gcm=True, aes128gcm_len='128', sha256=True, lifetime=7200, mode='tunnel'))
+        self.assertEqual(p2s[4], dict(
+            p1_descr='transport to pf_4', descr='transport to pf_4', state='present', aes=True, aes_len='auto', sha256=True, mode='transport'))
+
+    def test_format_ipsec_aggregate_unknown(self):
+        """ test the expansion of a pfsense without tunnels """
+        res = format_ipsec_aggregate(TUNNELS, 'pf_5')
+        self.assertEqual(res, dict(aggregated_ipsecs=[], aggregated_ipsec_proposals=[], aggregated_ipsec_p2s=[]))
+
+    def test_format_ipsec_aggregate_index(self):
+        """ test the expansion with the index of the play, from fresh copies of the tunnels like the ones ansible templates for each host """
+        index = index_ipsec_tunnels(deepcopy(TUNNELS))
+        self.assertEqual(index, dict(pf_1=['mesh', 'transport'], pf_2=['mesh'], pf_3=['mesh'], pf_4=['transport']))
+
+        for pfname in ['pf_1', 'pf_2', 'pf_3', 'pf_4', 'pf_5']:
+            res = format_ipsec_aggregate(deepcopy(TUNNELS), pfname, deepcopy(index))
+            self.assertEqual(res, format_ipsec_aggregate(deepcopy(TUNNELS), pfname))
+        p2s = format_ipsec_aggregate_p2s(deepcopy(TUNNELS), 'pf_2', deepcopy(index))
+        self.assertEqual(p2s, format_ipsec_aggregate(deepcopy(TUNNELS), 'pf_2')['aggregated_ipsec_p2s'])
+
+        tunnels = deepcopy(TUNNELS)
+        del tunnels['mesh']['pfsenses']['pf_3']
+        with self.assertRaises(AnsibleFilterError) as context:
+            format_ipsec_aggregate(tunnels, 'pf_3', deepcopy(index))
+        self.assertEqual(str(context.exception), 'the ipsec tunnels index does not match the tunnels for pf_3 in mesh')
+
+    def test_format_ipsec_aggregate_errors(self):
+        """ test the invalid tunnels definitions """
+        tunnels = deepcopy(TUNNELS)
+        del tunnels['mesh']['pfsenses']['pf_3']['sharing']
+        with self.assertRaises(AnsibleFilterError) as context:
+            format_ipsec_aggregate(tunnels, 'pf_1')
+        self.assertEqual(str(context.exception), 'sharing is missing for pf_3 in mesh')
+
+        tunnels = deepcopy(TUNNELS)
+        del tunnels['transport']['phase1']
+        with self.assertRaises(AnsibleFilterError) as context:
+            format_ipsec_aggregate(tunnels, 'pf_4')
+        self.assertEqual(str(context.exception), 'phase1 is missing in transport')
+
+        with self.assertRaises(AnsibleFilterError):
+            format_ipsec_aggregate(TUNNELS)
+
+        with self.assertRaises(AnsibleFilterError):
+            format_ipsec_aggregate(TUNNELS, 'pf_1', ['mesh'])
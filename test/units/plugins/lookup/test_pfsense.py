@@ -4,11 +4,18 @@
 from __future__ import (absolute_import, division, print_function)
 __metaclass__ = type
 
+import errno
+import json
 import os
 from collections import OrderedDict
+from copy import deepcopy
+from tempfile import mkdtemp
+import shutil
 import yaml
 from units.compat.mock import patch
+from ansible.errors import AnsibleError
 from ansible.plugins.loader import lookup_loader
+from ansible.plugins.lookup.pfsense import PFSenseArtifact, ordered_load
 from units.modules.utils import ModuleTestCase
 
 
@@ -92,10 +99,10 @@ class TestPFSenseLookup(ModuleTestCase):
         with open(filename, 'w') as outfile:
             outfile.write(ordered_dump(self.definitions))
 
-    def run_rules(self):
+    def run_rules(self, **kwargs):
         """ run the plugin for rules """
         pfsense_lookup = lookup_loader.get('pfsense')
-        self.rules = pfsense_lookup.run(['dummy.yml', 'rules'], {})[0]
+        self.rules = pfsense_lookup.run(['dummy.yml', 'rules'], {}, **kwargs)[0]
 
     def assert_get_rule(self, rule_name, count=1):
         """ check that rule_name is defined """
@@ -232,3 +239,382 @@ class TestPFSenseLookup(ModuleTestCase):
 
         for rule in not_expected_rules:
             self.assert_rule_not_found(rule['name'])
+
+    def test_fqdn_hosts_file(self):
+        """ test fqdns are resolved using the hosts file override """
+        tmpdir = mkdtemp()
+        try:
+            hosts_file = os.path.join(tmpdir, 'hosts')
+            with open(hosts_file, 'w') as f:
+                f.write('# static entries\n10.20.30.5 srv.example.com\n10.20.40.5 other.example.com\n')
+
+            self.definitions['hosts_aliases']['srv'] = OrderedDict(ip='srv.example.com')
+            self.definitions['rules']['fqdn_rule'] = OrderedDict(src='srv', dst='other.example.com', protocol='tcp', dst_port='443')
+
+            with patch('ansible.plugins.lookup.pfsense.resolve_hostname') as resolve_hostname:
+                self.run_rules(dns_hosts_file=hosts_file)
+                self.assertFalse(resolve_hostname.called)
+
+            rule = self.assert_get_rule('fqdn_rule')
+            self.assertEqual(rule['interface'], 'LANA')
+            self.assertEqual(rule['source'], 'srv')
+            self.assertEqual(rule['destination'], 'other.example.com')
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_fqdn_dns_cache(self):
+        """ test fqdns are resolved once and then read from the dns cache """
+        tmpdir = mkdtemp()
+        try:
+            cache_file = os.path.join(tmpdir, 'dns_cache.json')
+            self.definitions['rules']['fqdn_rule'] = OrderedDict(src='srv.example.com', dst='other.example.com', protocol='tcp', dst_port='443')
+
+            with patch('ansible.plugins.lookup.pfsense.resolve_hostname') as resolve_hostname:
+                resolve_hostname.side_effect = lambda address, dns_servers: '10.20.30.5' if address == 'srv.example.com' else '10.20.40.5'
+                self.run_rules(dns_cache=cache_file, dns_workers=4)
+                self.assertEqual(resolve_hostname.call_count, 2)
+                self.assert_get_rule('fqdn_rule')
+
+                self.run_rules(dns_cache=cache_file)
+                self.assertEqual(resolve_hostname.call_count, 2)
+                rule = self.assert_get_rule('fqdn_rule')
+                self.assertEqual(rule['interface'], 'LANA')
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_fqdn_dns_cache_invalid(self):
+        """ test malformed dns cache files are ignored, and replaced by a valid one """
+        tmpdir = mkdtemp()
+        try:
+            cache_file = os.path.join(tmpdir, 'dns_cache.json')
+            self.definitions['rules']['fqdn_rule'] = OrderedDict(src='srv.example.com', dst='other.example.com', protocol='tcp', dst_port='443')
+
+            with patch('ansible.plugins.lookup.pfsense.resolve_hostname') as resolve_hostname:
+                resolve_hostname.side_effect = lambda address, dns_servers: '10.20.30.5' if address == 'srv.example.com' else '10.20.40.5'
+                for content in ['{"srv.example.com": ', '["srv.example.com"]', '{"srv.example.com": 1}', '{"srv.example.com": ["10.20.30.5"]}']:
+                    with open(cache_file, 'w') as f:
+                        f.write(content)
+
+                    resolve_hostname.reset_mock()
+                    self.run_rules(dns_cache=cache_file)
+                    self.assertEqual(resolve_hostname.call_count, 2)
+                    self.assert_get_rule('fqdn_rule')
+
+                self.assertEqual(os.listdir(tmpdir), ['dns_cache.json'])
+                with open(cache_file) as f:
+                    self.assertEqual(sorted(json.load(f).keys()), ['other.example.com', 'srv.example.com'])
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_circular_aliases(self):
+        """ test circular aliases definitions are reported with their path """
+        self.definitions['hosts_aliases']['srv_a'] = OrderedDict(ip='10.20.30.5 srv_b')
+        self.definitions['hosts_aliases']['srv_b'] = OrderedDict(ip='10.20.30.6 srv_c')
+        self.definitions['hosts_aliases']['srv_c'] = OrderedDict(ip='srv_a')
+        self.definitions['rules']['circular_rule'] = OrderedDict(src='srv_a', dst='10.20.40.5')
+
+        with patch('ansible.plugins.lookup.pfsense.display') as display:
+            with self.assertRaises(AnsibleError):
+                self.run_rules()
+            display.error.assert_called_with('Circular definition of alias srv_a: srv_a -> srv_b -> srv_c -> srv_a')
+
+    def test_nested_aliases(self):
+        """ test aliases shared by several rules are expanded to the same addresses """
+        self.definitions['hosts_aliases']['srv_a'] = OrderedDict(ip='10.20.30.5')
+        self.definitions['hosts_aliases']['srv_b'] = OrderedDict(ip='10.20.30.6 srv_a')
+        self.definitions['hosts_aliases']['all_srv'] = OrderedDict(ip='srv_a srv_b')
+        self.definitions['rules']['nested_rule_1'] = OrderedDict(src='all_srv', dst='10.20.40.5')
+        self.definitions['rules']['nested_rule_2'] = OrderedDict(src='srv_b', dst='10.20.40.6')
+        self.run_rules()
+
+        rule = self.assert_get_rule('nested_rule_1')
+        self.assertEqual(rule['source'], 'all_srv')
+        self.assertEqual(rule['interface'], 'LANA')
+        rule = self.assert_get_rule('nested_rule_2')
+        self.assertEqual(rule['source'], 'srv_b')
+        self.assertEqual(rule['interface'], 'LANA')
+
+    def run_aliases(self, **kwargs):
+        """ run the plugin for aliases """
+        pfsense_lookup = lookup_loader.get('pfsense')
+        return pfsense_lookup.run(['dummy.yml', 'aliases'], {}, **kwargs)[0]
+
+    def test_collapse_aliases(self):
+        """ test adjacent addresses of generated network aliases are merged """
+        self.definitions['rules']['collapse_rule'] = OrderedDict(src='10.20.30.4 10.20.30.5 10.20.30.6 10.20.30.7 10.20.30.64/26', dst='10.20.40.5')
+
+        aliases = self.run_aliases()
+        self.assertEqual(aliases[0]['name'], 'h_collapse_rule_1')
+        self.assertEqual(aliases[0]['address'], '10.20.30.4 10.20.30.5 10.20.30.6 10.20.30.64/26 10.20.30.7')
+
+        aliases = self.run_aliases(collapse_aliases=True)
+        self.assertEqual(aliases[0]['name'], 'h_collapse_rule_1')
+        self.assertEqual(aliases[0]['type'], 'network')
+        self.assertEqual(aliases[0]['address'], '10.20.30.4/30 10.20.30.64/26')
+
+    def test_content_names(self):
+        """ test generated aliases are shared and named after their content """
+        self.definitions['rules']['content_rule_1'] = OrderedDict(src='10.20.30.4 10.20.30.5', dst='10.20.40.5', protocol='tcp', dst_port='80 443')
+        self.definitions['rules']['content_rule_2'] = OrderedDict(src='10.20.30.5 10.20.30.4', dst='10.20.40.6', protocol='tcp', dst_port='443 080')
+
+        aliases = self.run_aliases(content_names=True)
+        self.assertEqual(len(aliases), 2)
+        self.assertEqual(aliases[0]['name'], 'h_dcd4d9f5879fa135')
+        self.assertEqual(aliases[1]['name'], 'p_2c5b42df684efd38')
+
+        self.run_rules(content_names=True)
+        for name in ['content_rule_1', 'content_rule_2']:
+            rule = self.assert_get_rule(name)
+            self.assertEqual(rule['source'], 'h_dcd4d9f5879fa135')
+            self.assertEqual(rule['destination_port'], 'p_2c5b42df684efd38')
+
+    def test_compact_ports(self):
+        """ test ports and ports ranges are merged """
+        self.definitions['ports_aliases']['port_web'] = OrderedDict(port='8080 8081 8000-8079')
+        self.definitions['rules']['ports_rule_1'] = OrderedDict(src='10.20.30.4', dst='10.20.40.5', protocol='tcp', dst_port='80 81 82 80-90 443')
+        self.definitions['rules']['ports_rule_2'] = OrderedDict(src='10.20.30.4', dst='10.20.40.6', protocol='tcp', dst_port='443 80-90')
+        self.definitions['rules']['ports_rule_3'] = OrderedDict(src='10.20.30.4', dst='10.20.40.7', protocol='tcp', dst_port='22 23')
+        self.definitions['rules']['ports_rule_4'] = OrderedDict(src='10.20.30.4', dst='10.20.40.8', protocol='tcp', dst_port='port_web')
+
+        self.run_rules(compact_ports=True)
+        self.assertEqual(self.assert_get_rule('ports_rule_1')['destination_port'], 'p_ports_rule_1_1')
+        self.assertEqual(self.assert_get_rule('ports_rule_2')['destination_port'], 'p_ports_rule_1_1')
+        self.assertEqual(self.assert_get_rule('ports_rule_3')['destination_port'], '22-23')
+
+        aliases = self.run_aliases(compact_ports=True)
+        self.assertEqual(len(aliases), 2)
+        self.assertEqual(aliases[0]['name'], 'p_ports_rule_1_1')
+        self.assertEqual(aliases[0]['address'], '80:90 443')
+        self.assertEqual(aliases[1]['name'], 'port_web')
+        self.assertEqual(aliases[1]['address'], '8000:8081')
+
+    def test_rules_cache(self):
+        """ test only the rules whose inputs changed are decomposed again when using the rules cache """
+        self.definitions['hosts_aliases']['srv_a'] = OrderedDict(ip='10.20.30.5')
+        self.definitions['hosts_aliases']['srv_b'] = OrderedDict(ip='10.20.30.6')
+        self.definitions['hosts_aliases']['srv_c'] = OrderedDict(ip='10.20.40.7')
+        self.definitions['rules']['cache_rule_1'] = OrderedDict(src='srv_a srv_b', dst='10.20.40.5', protocol='tcp', dst_port='443')
+        self.definitions['rules']['cache_rule_2'] = OrderedDict(src='srv_c', dst='10.20.30.7', protocol='tcp', dst_port='22')
+
+        # the definitions are modified by the plugin
+        definitions = self.definitions
+        self.get_definitions.side_effect = lambda from_file: deepcopy(definitions)
+
+        tmpdir = mkdtemp()
+        try:
+            cache_dir = os.path.join(tmpdir, 'rules_cache')
+            self.run_rules(cache_dir=cache_dir)
+            expected_rules = self.rules
+            self.assertTrue(os.path.exists(os.path.join(cache_dir, 'pf_test1.json')))
+
+            with patch('ansible.plugins.lookup.pfsense.PFSenseRuleDecomposer.decompose_rules') as decompose_rules:
+                decompose_rules.side_effect = AssertionError('rules must be read from cache')
+                self.run_rules(cache_dir=cache_dir)
+                self.assertEqual(self.rules, expected_rules)
+                self.assertEqual(self.assert_get_rule('cache_rule_1')['source'], 'h_cache_rule_1_1')
+
+            # modifying an alias only recompiles the rules using it
+            # srv_c is now on the same interface as the destination, so the rule is not required anymore
+            self.definitions['hosts_aliases']['srv_c'] = OrderedDict(ip='10.20.30.8')
+            decompose_rules = patch('ansible.plugins.lookup.pfsense.PFSenseRuleDecomposer.decompose_rules', autospec=True,
+                                    side_effect=self.get_decompose_rules()).start()
+            try:
+                self.run_rules(cache_dir=cache_dir)
+            finally:
+                patch.stopall()
+            self.assertEqual([call[0][1].name for call in decompose_rules.call_args_list], ['cache_rule_2'])
+            self.assertEqual(self.assert_get_rule('cache_rule_1'), expected_rules[0])
+            self.assert_rule_not_found('cache_rule_2')
+        finally:
+            shutil.rmtree(tmpdir)
+
+    @staticmethod
+    def get_decompose_rules():
+        """ return the unpatched decompose_rules function """
+        from ansible.plugins.lookup.pfsense import PFSenseRuleDecomposer
+        return PFSenseRuleDecomposer.decompose_rules
+
+    def test_rules_cache_concurrent(self):
+        """ test the rules cache directory created by another fork is used """
+        self.definitions['rules']['cache_rule'] = OrderedDict(src='10.20.30.4', dst='10.20.40.5', protocol='tcp', dst_port='443')
+
+        def makedirs(name):
+            """ create the directory like another fork, just before this one """
+            os.mkdir(name)
+            raise OSError(errno.EEXIST, 'File exists', name)
+
+        tmpdir = mkdtemp()
+        try:
+            cache_dir = os.path.join(tmpdir, 'rules_cache')
+            with patch('ansible.plugins.lookup.pfsense.os.makedirs', side_effect=makedirs):
+                self.run_rules(cache_dir=cache_dir)
+            self.assert_get_rule('cache_rule')
+            self.assertEqual(os.listdir(cache_dir), ['pf_test1.json'])
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_artifact(self):
+        """ test definitions are read from a compiled artifact """
+        self.definitions['rules']['artifact_rule'] = OrderedDict(src='10.20.30.4', dst='10.20.40.5', protocol='tcp', dst_port='80 443')
+        pfsense_lookup = lookup_loader.get('pfsense')
+        expected = pfsense_lookup.run(['dummy.yml', 'all_definitions'], {})[0]
+
+        tmpdir = mkdtemp()
+        try:
+            artifact = os.path.join(tmpdir, 'definitions.jsonl.gz')
+            definitions = dict((name, expected['aggregated_' + name]) for name in PFSenseArtifact.TYPES)
+            PFSenseArtifact(artifact).write('pf_test1', 'input_hash', definitions)
+            PFSenseArtifact(artifact).write('pf_test2', 'input_hash', dict((name, []) for name in PFSenseArtifact.TYPES))
+
+            self.assertEqual(pfsense_lookup.run(['dummy.yml', 'all_definitions'], {}, artifact=artifact)[0], expected)
+            self.assertEqual(pfsense_lookup.run(['dummy.yml', 'rules'], {}, artifact=artifact)[0], expected['aggregated_rules'])
+            self.assertEqual(pfsense_lookup.run(['dummy.yml', 'aliases'], {}, artifact=artifact)[0], expected['aggregated_aliases'])
+
+            # the artifact must be compiled from the definitions file, when it's available
+            definitions_file = os.path.join(tmpdir, 'definitions.yml')
+            with open(definitions_file, 'w') as f:
+                f.write(ordered_dump(self.definitions))
+            with self.assertRaises(AnsibleError) as context:
+                pfsense_lookup.run([definitions_file, 'rules'], {}, artifact=artifact)
+            self.assertIn('has not been compiled from the current definitions', str(context.exception))
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_artifact_includes(self):
+        """ test the artifact must be compiled from the current included files """
+        pfsense_lookup = lookup_loader.get('pfsense')
+        tmpdir = mkdtemp()
+        try:
+            definitions_file = os.path.join(tmpdir, 'definitions.yml')
+            with open(definitions_file, 'w') as f:
+                f.write('hosts_aliases: !include mid.yml\n')
+            with open(os.path.join(tmpdir, 'mid.yml'), 'w') as f:
+                f.write('srv_a: !include inner.yml\n')
+            inner_file = os.path.join(tmpdir, 'inner.yml')
+            with open(inner_file, 'w') as f:
+                f.write('ip: 10.20.30.5\n')
+
+            included = set()
+            with open(definitions_file) as f:
+                ordered_load(f, yaml.SafeLoader, included=included)
+            includes = PFSenseArtifact.get_includes(definitions_file, included)
+            self.assertEqual(includes, ['inner.yml', 'mid.yml'])
+
+            artifact = os.path.join(tmpdir, 'definitions.jsonl.gz')
+            input_hash = PFSenseArtifact.get_input_hash(definitions_file, pfsense_lookup.get_options({}), includes)
+            PFSenseArtifact(artifact).write('pf_test1', input_hash, dict((name, []) for name in PFSenseArtifact.TYPES), includes)
+            self.assertEqual(pfsense_lookup.run([definitions_file, 'rules'], {}, artifact=artifact)[0], [])
+
+            with open(inner_file, 'w') as f:
+                f.write('ip: 10.20.30.250\n')
+            with self.assertRaises(AnsibleError) as context:
+                pfsense_lookup.run([definitions_file, 'rules'], {}, artifact=artifact)
+            self.assertIn('has not been compiled from the current definitions', str(context.exception))
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_artifact_write_error(self):
+        """ test the artifact is replaced only once the new one is complete """
+        tmpdir = mkdtemp()
+        try:
+            artifact = os.path.join(tmpdir, 'definitions.jsonl.gz')
+            definitions = dict((name, []) for name in PFSenseArtifact.TYPES)
+            PFSenseArtifact(artifact).write('pf_test1', 'input_hash', definitions)
+
+            definitions['rules'].append(object())
+            with self.assertRaises(TypeError):
+                PFSenseArtifact(artifact).write('pf_test2', 'input_hash', definitions)
+            self.assertEqual(os.listdir(tmpdir), ['definitions.jsonl.gz'])
+            self.assertEqual(PFSenseArtifact(artifact).read_header()['pfsenses'], ['pf_test1'])
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_include_cache(self):
+        """ test included files are parsed once as long as they are not modified """
+        tmpdir = mkdtemp()
+        try:
+            definitions_file = os.path.join(tmpdir, 'definitions.yml')
+            hosts_file = os.path.join(tmpdir, 'hosts.yml')
+            with open(definitions_file, 'w') as f:
+                f.write('hosts_aliases: !include hosts.yml\n')
+            with open(hosts_file, 'w') as f:
+                f.write('srv_a: { ip: 10.20.30.5 }\nsrv_b: { ip: 10.20.30.6 }\n')
+
+            with open(definitions_file) as f:
+                fvars = ordered_load(f, yaml.SafeLoader)
+            self.assertEqual(list(fvars['hosts_aliases'].keys()), ['srv_a', 'srv_b'])
+            self.assertIsInstance(fvars['hosts_aliases']['srv_a'], OrderedDict)
+
+            # the cached documents are not modified by the callers
+            fvars['hosts_aliases']['srv_a']['type'] = 'host'
+            with patch('ansible.plugins.lookup.pfsense.yaml.load', wraps=yaml.load) as load:
+                with open(definitions_file) as f:
+                    fvars = ordered_load(f, yaml.SafeLoader)
+                self.assertEqual(load.call_count, 1)
+            self.assertEqual(fvars['hosts_aliases']['srv_a'], OrderedDict(ip='10.20.30.5'))
+
+            # modified files are parsed again
+            with open(hosts_file, 'w') as f:
+                f.write('srv_c: { ip: 10.20.30.7 }\n')
+            os.utime(hosts_file, (0, 0))
+            with open(definitions_file) as f:
+                fvars = ordered_load(f, yaml.SafeLoader)
+            self.assertEqual(list(fvars['hosts_aliases'].keys()), ['srv_c'])
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_include_cache_nested(self):
+        """ test included files are parsed again when a file they include is modified """
+        tmpdir = mkdtemp()
+        try:
+            definitions_file = os.path.join(tmpdir, 'definitions.yml')
+            with open(definitions_file, 'w') as f:
+                f.write('hosts_aliases: !include mid.yml\n')
+            with open(os.path.join(tmpdir, 'mid.yml'), 'w') as f:
+                f.write('srv_a: !include inner.yml\n')
+            inner_file = os.path.join(tmpdir, 'inner.yml')
+            with open(inner_file, 'w') as f:
+                f.write('ip: 10.20.30.5\n')
+
+            with open(definitions_file) as f:
+                fvars = ordered_load(f, yaml.SafeLoader)
+            self.assertEqual(fvars['hosts_aliases']['srv_a'], OrderedDict(ip='10.20.30.5'))
+
+            with open(inner_file, 'w') as f:
+                f.write('ip: 10.20.30.250\n')
+            os.utime(inner_file, (0, 0))
+            with open(definitions_file) as f:
+                fvars = ordered_load(f, yaml.SafeLoader)
+            self.assertEqual(fvars['hosts_aliases']['srv_a'], OrderedDict(ip='10.20.30.250'))
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_profile_dump_error(self):
+        """ test the cProfile profiling is stopped when the definitions are not valid """
+        self.definitions['rules']['invalid_rule'] = OrderedDict(src='unknown_alias', dst='10.20.40.5')
+
+        # the profile is mocked, so the dump file is never written
+        with patch.dict(os.environ, {'PFSENSE_LOOKUP_PROFILE_DUMP': 'lookup.prof'}):
+            with patch('ansible.plugins.lookup.pfsense.cProfile.Profile') as profile:
+                with patch('ansible.plugins.lookup.pfsense.display'):
+                    with self.assertRaises(AnsibleError):
+                        self.run_rules()
+        profile.return_value.enable.assert_called_once_with()
+        profile.return_value.disable.assert_called_once_with()
+
+    def test_profile(self):
+        """ test the compilation phases are displayed when PFSENSE_LOOKUP_PROFILE is set """
+        self.definitions['rules']['profiled_rule'] = OrderedDict(src='10.20.30.4', dst='10.20.40.5', protocol='tcp', dst_port='443')
+
+        with patch.dict(os.environ, {'PFSENSE_LOOKUP_PROFILE': '1'}):
+            with patch('ansible.plugins.lookup.pfsense.display') as display:
+                self.run_rules()
+        lines = [call[0][0] for call in display.display.call_args_list]
+        self.assertEqual(lines[0], 'Compilation profile of pf_test1:')
+        for phase in ['load', 'parse rules', 'decompose', 'guess interfaces', 'aggregation', 'generate rules', 'generate aliases']:
+            self.assertTrue([line for line in lines if line.startswith('  ' + phase + ' ')], phase)
+        self.assertTrue([line for line in lines if line.startswith('  profiled_rule ')])
+
+        with patch('ansible.plugins.lookup.pfsense.display') as display:
+            self.run_rules()
+        self.assertFalse(display.display.called)